@@ -0,0 +1,54 @@
+"""
+Synthetic request inputs. Every generator takes a numpy RandomState so a run
+is reproducible for a given --seed.
+"""
+import base64
+
+import cv2
+import numpy as np
+
+WORDS = (
+    'invoice total amount date customer order shipping address payment due '
+    'account number reference item quantity price tax discount balance'
+).split()
+
+
+def document_image(rs, width, height):
+    """ White page with dark text lines made of glyph sized blocks """
+    img = np.full((height, width, 3), 255, np.uint8)
+    line_height = max(height // 40, 12)
+    for y in range(line_height, height - 2 * line_height, 2 * line_height):
+        if rs.rand() < 0.2:
+            continue
+        x = rs.randint(line_height, max(width // 5, line_height + 1))
+        end = rs.randint(min(x + 4 * line_height, width - line_height), width - line_height + 1)
+        glyph = max(line_height * 2 // 5, 4)
+        for gx in range(x, end, glyph + 2):
+            img[y:y + line_height, gx:min(gx + glyph, end)] = rs.randint(0, 110, 3)
+    return img
+
+
+def scene_image(rs, width, height, objects=6):
+    """ Smooth random background with a few saturated rectangles """
+    coarse = rs.randint(60, 200, (max(height // 64, 2), max(width // 64, 2), 3)).astype(np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(objects):
+        w, h = rs.randint(width // 10, width // 3), rs.randint(height // 10, height // 3)
+        x, y = rs.randint(0, width - w), rs.randint(0, height - h)
+        img[y:y + h, x:x + w] = (rs.randint(0, 256), rs.randint(0, 256), rs.randint(180, 256))
+    return img
+
+
+def encode(img, ext='.jpg'):
+    """
+    return:
+        the base64 string of img, an RGB array, encoded as ext
+    """
+    ok, data = cv2.imencode(ext, img[:, :, ::-1])
+    if not ok:
+        raise ValueError('failed to encode {}'.format(ext))
+    return base64.b64encode(data.tobytes()).decode('utf-8')
+
+
+def sentence(rs, words=12):
+    return ' '.join(rs.choice(WORDS, words))
@@ -0,0 +1,372 @@
+"""
+Benchmark the container handlers offline, see README.md.
+
+Each target and concurrency runs in its own process, started in the
+container directory of the handler so its modules (main, utils,
+aikits_utils, ...) are the ones the image ships and the peak RSS is that of
+one container. The process imports the *_app.py module against real models
+or tiny stand-ins, drives synthetic requests through handler(event, context)
+from a thread pool and writes its measurements for the report.
+"""
+import argparse
+import copy
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from targets import TARGETS, TARGETS_BY_NAME  # noqa: E402
+
+# metric, True when a higher value is a regression
+REGRESSION_METRICS = [
+    ('latency_ms.p50', True),
+    ('latency_ms.p99', True),
+    ('throughput_rps', False),
+    ('peak_rss_mb', True),
+]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def summarize(seconds):
+    """
+    return:
+        percentiles of the durations, in milliseconds
+    """
+    ms = np.asarray(seconds) * 1000
+    if not len(ms):
+        return {}
+    return {
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p90': round(float(np.percentile(ms, 90)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'mean': round(float(ms.mean()), 3),
+        'max': round(float(ms.max()), 3),
+    }
+
+
+def install_stage_recorder(request_metrics):
+    """
+    Replace the histograms the handlers report to with one that also keeps
+    every per-request stage duration.
+    return:
+        dict from stage name to the list of its durations in seconds
+    """
+    samples = defaultdict(list)
+
+    class StageRecorder(request_metrics.StageHistograms):
+        def observe(self, handler, stages):
+            super(StageRecorder, self).observe(handler, stages)
+            with self.lock:
+                for name, seconds in stages.items():
+                    samples[name].append(seconds)
+
+    request_metrics.histograms = StageRecorder()
+    return samples
+
+
+def run_worker(args):
+    target = TARGETS_BY_NAME[args.worker]
+    for key, value in target.env.items():
+        os.environ.setdefault(key, value)
+    # the handlers join MODEL_PATH and file names without a separator
+    os.environ['MODEL_PATH'] = os.path.join(os.path.abspath(args.model_dir), '')
+    os.chdir(target.container_dir)
+    sys.path.insert(0, target.container_dir)
+
+    start = time.perf_counter()
+    module = importlib.import_module(target.module)
+    load_seconds = time.perf_counter() - start
+    load_rss_mb = peak_rss_mb()
+    import onnxruntime
+    import request_metrics
+
+    width, height = args.image_size
+    rs = np.random.RandomState(args.seed)
+    bodies = [target.payload(rs, width, height) for _ in range(args.payloads)]
+
+    def call(i):
+        body = copy.deepcopy(bodies[i % len(bodies)])
+        event = {'body': json.dumps(body) if args.json_body else body}
+        start = time.perf_counter()
+        try:
+            response = module.handler(event, None)
+        except Exception:
+            return time.perf_counter() - start, traceback.format_exc(limit=3)
+        latency = time.perf_counter() - start
+        if response.get('statusCode') != 200:
+            return latency, '{}: {}'.format(response.get('statusCode'), str(response.get('body'))[:200])
+        return latency, None
+
+    for i in range(args.warmup):
+        call(i)
+    samples = install_stage_recorder(request_metrics)
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(call, range(args.requests)))
+        wall_seconds = time.perf_counter() - start
+
+    latencies = [latency for latency, error in results]
+    errors = [error for latency, error in results if error is not None]
+    result = {
+        'target': target.name,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'onnxruntime': onnxruntime.__version__,
+        'load_seconds': round(load_seconds, 3),
+        'throughput_rps': round(args.requests / wall_seconds, 3),
+        'latency_ms': summarize(latencies),
+        'stages_ms': {name: summarize(seconds) for name, seconds in sorted(samples.items())},
+        'load_rss_mb': load_rss_mb,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    with open(args.result_file, 'w') as f:
+        json.dump(result, f)
+
+
+def resolve_model_dir(target, args):
+    """
+    return:
+        (model directory, 'real' or 'standin'), (None, reason) when the
+        target cannot run
+    """
+    if args.models_root:
+        model_dir = os.path.join(args.models_root, target.name)
+        if target.has_models(model_dir):
+            return model_dir, 'real'
+    if args.real_only or target.build_standins is None:
+        return None, 'missing models: {}'.format(', '.join(target.model_files))
+    model_dir = os.path.join(args.work_dir, target.name)
+    if not target.has_models(model_dir):
+        os.makedirs(model_dir, exist_ok=True)
+        target.build_standins(model_dir)
+    return model_dir, 'standin'
+
+
+def run_target(target, model_dir, concurrency, args, env):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        result_file = f.name
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        '--worker', target.name,
+        '--model-dir', model_dir,
+        '--result-file', result_file,
+        '--concurrency', str(concurrency),
+        '--requests', str(args.requests),
+        '--warmup', str(args.warmup),
+        '--payloads', str(args.payloads),
+        '--image-size', '{}x{}'.format(*args.image_size),
+        '--seed', str(args.seed),
+    ]
+    if args.json_body:
+        command.append('--json-body')
+    try:
+        process = subprocess.run(
+            command, env=env, timeout=args.timeout,
+            stdout=None if args.verbose else subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            return {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'exit code {}'.format(process.returncode)}
+        with open(result_file) as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {'error': 'timed out after {} seconds'.format(args.timeout)}
+    finally:
+        os.remove(result_file)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(result, metric):
+    value = result
+    for key in metric.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(baseline, report, max_regression):
+    """
+    return:
+        lines describing the metrics of report that are worse than the
+        baseline by more than max_regression, a fraction
+    """
+    previous = {(r['target'], r['concurrency']): r for r in baseline['results'] if 'error' not in r and 'skipped' not in r}
+    regressions = []
+    for result in report['results']:
+        if 'error' in result or 'skipped' in result:
+            continue
+        old = previous.get((result['target'], result['concurrency']))
+        if old is None:
+            continue
+        for metric, higher_is_worse in REGRESSION_METRICS:
+            before, after = lookup(old, metric), lookup(result, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (change if higher_is_worse else -change) > max_regression:
+                regressions.append('{} c={} {}: {} -> {} ({:+.1%})'.format(
+                    result['target'], result['concurrency'], metric, before, after, change))
+    return regressions
+
+
+SUMMARY_FORMAT = '{:<28} {:>4} {:>8} {:>9} {:>10} {:>10} {:>9} {:>6}'
+
+
+def print_summary(result):
+    if 'skipped' in result or 'error' in result:
+        print('{:<28} {:>4} {}'.format(
+            result['target'], result.get('concurrency', ''),
+            'skipped: ' + result['skipped'] if 'skipped' in result else 'error: ' + result['error']), file=sys.stderr)
+        return
+    print(SUMMARY_FORMAT.format(
+        result['target'], result['concurrency'], result['models'], result['throughput_rps'],
+        result['latency_ms']['p50'], result['latency_ms']['p99'], result['peak_rss_mb'], result['errors']), file=sys.stderr)
+
+
+def run(args):
+    names = args.targets.split(',') if args.targets else [target.name for target in TARGETS]
+    unknown = [name for name in names if name not in TARGETS_BY_NAME]
+    if unknown:
+        sys.exit('unknown targets: {}'.format(', '.join(unknown)))
+    args.work_dir = args.work_dir or tempfile.mkdtemp(prefix='aikits-bench-')
+    env = dict(os.environ)
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+
+    # the summary goes to stderr, stdout may carry the report
+    print(SUMMARY_FORMAT.format('target', 'conc', 'models', 'req/s', 'p50 ms', 'p99 ms', 'rss MB', 'errors'), file=sys.stderr)
+    results = []
+    for name in names:
+        target = TARGETS_BY_NAME[name]
+        model_dir, models = resolve_model_dir(target, args)
+        if model_dir is None:
+            results.append({'target': name, 'skipped': models})
+            print_summary(results[-1])
+            continue
+        for concurrency in args.concurrency:
+            result = {'target': name, 'concurrency': concurrency, 'models': models}
+            result.update(run_target(target, model_dir, concurrency, args, env))
+            results.append(result)
+            print_summary(result)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': git_commit(),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'payloads': args.payloads,
+            'image_size': list(args.image_size),
+            'seed': args.seed,
+            'json_body': args.json_body,
+            'env': args.env,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        for line in regressions:
+            print('regression: ' + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def parse_size(value):
+    width, _, height = value.partition('x')
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the container handlers offline.')
+    parser.add_argument('--targets', help='comma separated targets, all by default')
+    parser.add_argument('--list', action='store_true', help='list the targets and exit')
+    parser.add_argument('--concurrency', type=lambda v: [int(c) for c in v.split(',')], default=[1],
+                        help='comma separated numbers of concurrent requests, one run each')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per run')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests before each run')
+    parser.add_argument('--payloads', type=int, default=8, help='distinct synthetic inputs per run')
+    parser.add_argument('--image-size', type=parse_size, default=(1280, 960), help='WIDTHxHEIGHT of the synthetic images')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json-body', action='store_true',
+                        help='pass the body as a JSON string, like API Gateway does, instead of a dict')
+    parser.add_argument('--models-root', help='directory with a <target>/ directory of real models per target')
+    parser.add_argument('--real-only', action='store_true', help='skip the targets without real models')
+    parser.add_argument('--work-dir', help='where stand-in models are built, reused across runs')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='environment of the handlers, e.g. CLS_MODE=adaptive')
+    parser.add_argument('--timeout', type=int, default=1800, help='seconds allowed per run')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the handlers')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against, exits 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='allowed relative regression of latency, throughput and RSS')
+    # set by run_target for the per-run processes
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--model-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        args.concurrency = args.concurrency[0]
+    return args
+
+
+def list_targets(args):
+    for target in TARGETS:
+        if args.models_root and target.has_models(os.path.join(args.models_root, target.name)):
+            models = 'real'
+        elif target.build_standins is not None:
+            models = 'standin'
+        else:
+            models = 'missing'
+        print('{:<28} {:<8} {}'.format(target.name, models, target.container))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+    elif args.list:
+        list_targets(args)
+    else:
+        run(args)
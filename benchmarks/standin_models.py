@@ -0,0 +1,161 @@
+"""
+Tiny ONNX models with the input and output signatures of the container
+models. They are not trained, they only keep the shapes, dtypes and rough
+output statistics of the real models so the pre- and post-processing of the
+handlers does representative work, e.g. the OCR detector marks the dark
+strokes of the synthetic text lines so boxes are found and recognized.
+"""
+import os
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+OPSET = 13
+# the IR version understood by every onnxruntime the containers pin
+IR_VERSION = 8
+
+
+def save_model(path, nodes, inputs, outputs, initializers=()):
+    graph = helper.make_graph(
+        nodes, os.path.basename(path),
+        inputs, outputs,
+        initializer=[numpy_helper.from_array(array, name) for name, array in initializers])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', OPSET)])
+    model.ir_version = IR_VERSION
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def tensor(name, shape, dtype=TensorProto.FLOAT):
+    return helper.make_tensor_value_info(name, dtype, shape)
+
+
+def text_detector(path):
+    """ DB detector, probability map high on the dark pixels """
+    nodes = [
+        helper.make_node('ReduceMean', ['x'], ['mean'], axes=[1], keepdims=1),
+        helper.make_node('Mul', ['mean', 'gain'], ['logits']),
+        helper.make_node('Sigmoid', ['logits'], ['maps']),
+    ]
+    return save_model(
+        path, nodes,
+        [tensor('x', ['N', 3, 'H', 'W'])],
+        [tensor('maps', ['N', 1, 'H', 'W'])],
+        [('gain', np.array(-4.0, dtype=np.float32))])
+
+
+def text_recognizer(path, num_classes):
+    """ CTC recognizer, one time step per 4 columns for any input height """
+    weights = np.random.RandomState(0).randn(num_classes, 3, 1, 1).astype(np.float32) * 3
+    nodes = [
+        helper.make_node('ReduceMean', ['x'], ['rows'], axes=[2], keepdims=1),
+        helper.make_node('AveragePool', ['rows'], ['steps'], kernel_shape=[1, 4], strides=[1, 4]),
+        helper.make_node('Conv', ['steps', 'weights'], ['logits']),
+        helper.make_node('Squeeze', ['logits', 'axes'], ['squeezed']),
+        helper.make_node('Transpose', ['squeezed'], ['transposed'], perm=[0, 2, 1]),
+        helper.make_node('Softmax', ['transposed'], ['probs'], axis=2),
+    ]
+    return save_model(
+        path, nodes,
+        [tensor('x', ['N', 3, 'H', 'W'])],
+        [tensor('probs', ['N', 'T', num_classes])],
+        [('weights', weights), ('axes', np.array([2], dtype=np.int64))])
+
+
+def image_classifier(path, num_outputs, input_name='x', output_name='output', softmax=False):
+    """ Global average pool followed by a dense layer """
+    weights = np.random.RandomState(1).randn(3, num_outputs).astype(np.float32)
+    nodes = [
+        helper.make_node('GlobalAveragePool', [input_name], ['pooled']),
+        helper.make_node('Flatten', ['pooled'], ['flat']),
+        helper.make_node('MatMul', ['flat', 'weights'], ['logits' if softmax else output_name]),
+    ]
+    if softmax:
+        nodes.append(helper.make_node('Softmax', ['logits'], [output_name], axis=1))
+    return save_model(
+        path, nodes,
+        [tensor(input_name, ['N', 3, 'H', 'W'])],
+        [tensor(output_name, ['N', num_outputs])],
+        [('weights', weights)])
+
+
+def yolox(path, num_classes, input_size=640, strides=(8, 16, 32)):
+    """
+    YOLOX head output [1, anchors, 5 + num_classes] over the strides. The
+    objectness is only high on saturated blue regions, the first channel of
+    the BGR input, so postprocessing and NMS see a handful of candidates
+    instead of every anchor.
+    """
+    rs = np.random.RandomState(2)
+    weights = np.zeros((3, 5 + num_classes), dtype=np.float32)
+    weights[:, 4] = [0.05, -0.05, -0.05]
+    weights[:, 5:] = rs.randn(3, num_classes) * 0.01
+    bias = np.zeros(5 + num_classes, dtype=np.float32)
+    bias[4] = -4.0
+    nodes, levels = [], []
+    for stride in strides:
+        pooled, level = 'pooled%d' % stride, 'level%d' % stride
+        nodes.append(helper.make_node('AveragePool', ['images'], [pooled], kernel_shape=[stride, stride], strides=[stride, stride]))
+        nodes.append(helper.make_node('Reshape', [pooled, 'flat_shape'], [level]))
+        levels.append(level)
+    nodes += [
+        helper.make_node('Concat', levels, ['anchors'], axis=2),
+        helper.make_node('Transpose', ['anchors'], ['features'], perm=[0, 2, 1]),
+        helper.make_node('MatMul', ['features', 'weights'], ['projected']),
+        helper.make_node('Add', ['projected', 'bias'], ['logits']),
+        helper.make_node('Sigmoid', ['logits'], ['output']),
+    ]
+    num_anchors = sum((input_size // stride) ** 2 for stride in strides)
+    return save_model(
+        path, nodes,
+        [tensor('images', [1, 3, input_size, input_size])],
+        [tensor('output', [1, num_anchors, 5 + num_classes])],
+        [('flat_shape', np.array([1, 3, -1], dtype=np.int64)), ('weights', weights), ('bias', bias)])
+
+
+def upscaler(path, scale):
+    """ Real-ESRGAN, bilinear upscaling by scale """
+    nodes = [helper.make_node('Resize', ['input', 'roi', 'scales'], ['output'], mode='linear')]
+    return save_model(
+        path, nodes,
+        [tensor('input', [1, 3, 'H', 'W'])],
+        [tensor('output', [1, 3, 'OH', 'OW'])],
+        [('roi', np.zeros(0, dtype=np.float32)), ('scales', np.array([1, 1, scale, scale], dtype=np.float32))])
+
+
+def segmenter(path):
+    """ Human segmentation, one foreground logit channel """
+    nodes = [
+        helper.make_node('ReduceMean', ['input'], ['mean'], axes=[1], keepdims=1),
+        helper.make_node('Sigmoid', ['mean'], ['output']),
+    ]
+    return save_model(
+        path, nodes,
+        [tensor('input', [1, 3, 'H', 'W'])],
+        [tensor('output', [1, 1, 'H', 'W'])])
+
+
+def text_encoder(path, dim=768):
+    """ CoSENT sentence encoder, mean of the projected token ids """
+    weights = np.random.RandomState(3).randn(1, dim).astype(np.float32) * 0.01
+    nodes = [
+        helper.make_node('Cast', ['input_ids'], ['ids'], to=TensorProto.FLOAT),
+        helper.make_node('Unsqueeze', ['ids', 'axes'], ['tokens']),
+        helper.make_node('MatMul', ['tokens', 'weights'], ['hidden']),
+        helper.make_node('ReduceMean', ['hidden'], ['output'], axes=[1], keepdims=0),
+    ]
+    return save_model(
+        path, nodes,
+        [tensor('input_ids', ['N', 'L'], TensorProto.INT64),
+         tensor('token_type_ids', ['N', 'L'], TensorProto.INT64),
+         tensor('attention_mask', ['N', 'L'], TensorProto.INT64)],
+        [tensor('output', ['N', dim])],
+        [('axes', np.array([2], dtype=np.int64)), ('weights', weights)])
+
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
@@ -0,0 +1,161 @@
+"""
+Registry of the benchmarked handlers. A target names the container directory
+and the *_app.py module of its handler, the model files that module loads
+from MODEL_PATH, how to build stand-ins for them and how to generate its
+request bodies.
+"""
+import os
+
+import payloads
+import standin_models
+
+CONTAINERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'containers')
+# the object recognition and human attribute detectors share the class list
+YOLOX_NUM_CLASSES = 365
+TOKENIZER_SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+class Target(object):
+    """
+    args:
+        name(str): name used on the command line and in the report
+        container(str): directory of the handler under src/containers
+        module(str): module defining handler(event, context)
+        model_files(list): files the module loads from MODEL_PATH
+        payload(callable): payload(rs, width, height) returns a request body
+        env(dict): environment the container sets in its Dockerfile
+        build_standins(callable): build_standins(model_dir) writes tiny
+            models for model_files, None when the target needs real models
+    """
+
+    def __init__(self, name, container, module, model_files, payload, env=None, build_standins=None):
+        self.name = name
+        self.container = container
+        self.module = module
+        self.model_files = model_files
+        self.payload = payload
+        self.env = env or {}
+        self.build_standins = build_standins
+
+    @property
+    def container_dir(self):
+        return os.path.join(CONTAINERS_DIR, self.container)
+
+    def has_models(self, model_dir):
+        return all(os.path.exists(os.path.join(model_dir, name)) for name in self.model_files)
+
+
+def ocr_standins(model_name):
+    def build(model_dir):
+        keys = [chr(c) for c in range(ord('a'), ord('z') + 1)] + [str(d) for d in range(10)]
+        standin_models.write_lines(os.path.join(model_dir, 'keys_v1.txt'), keys)
+        standin_models.text_detector(os.path.join(model_dir, 'det_%s.onnx' % model_name))
+        # CTC blank and the optional space character besides the keys
+        standin_models.text_recognizer(os.path.join(model_dir, 'rec_%s.onnx' % model_name), len(keys) + 1)
+        standin_models.image_classifier(os.path.join(model_dir, 'classifier.onnx'), 2, softmax=True)
+    return build
+
+
+def ocr_files(model_name):
+    return ['det_%s.onnx' % model_name, 'rec_%s.onnx' % model_name, 'classifier.onnx', 'keys_v1.txt']
+
+
+def build_image_similarity(model_dir):
+    standin_models.image_classifier(os.path.join(model_dir, 'image-similarity.onnx'), 512, input_name='input')
+
+
+def build_pornography_detection(model_dir):
+    standin_models.image_classifier(os.path.join(model_dir, 'resnest50_fast_4s2x40d.onnx'), 3, input_name='input')
+
+
+def build_object_recognition(model_dir):
+    standin_models.yolox(os.path.join(model_dir, 'yolox_l.onnx'), YOLOX_NUM_CLASSES)
+
+
+def build_super_resolution(model_dir):
+    for scale in [2, 4]:
+        standin_models.upscaler(os.path.join(model_dir, 'Real_ESRGAN_x%d.onnx' % scale), scale)
+
+
+def build_human_segmentation(model_dir):
+    standin_models.segmenter(os.path.join(model_dir, 'humanseg_720.onnx'))
+
+
+def build_text_similarity(model_dir):
+    standin_models.text_encoder(os.path.join(model_dir, 'CoSENT.onnx'))
+    tokenizer_dir = os.path.join(model_dir, 'tokenizer')
+    os.makedirs(tokenizer_dir, exist_ok=True)
+    standin_models.write_lines(os.path.join(tokenizer_dir, 'vocab.txt'), TOKENIZER_SPECIAL_TOKENS + sorted(set(payloads.WORDS)))
+
+
+def document_body(rs, width, height):
+    return {'img': payloads.encode(payloads.document_image(rs, width, height))}
+
+
+def scene_body(rs, width, height):
+    return {'img': payloads.encode(payloads.scene_image(rs, width, height))}
+
+
+def scene_pair_body(rs, width, height):
+    return {
+        'img_1': payloads.encode(payloads.scene_image(rs, width, height)),
+        'img_2': payloads.encode(payloads.scene_image(rs, width, height)),
+    }
+
+
+def super_resolution_body(rs, width, height):
+    # the output is scale times larger in each side, so the input is kept small
+    body = scene_body(rs, width // 2, height // 2)
+    body['scale'] = 2
+    return body
+
+
+def text_pair_body(rs, width, height):
+    return {'text_1': payloads.sentence(rs), 'text_2': payloads.sentence(rs)}
+
+
+def nlu_body(rs, width, height):
+    return {
+        'subtask_type': '文本分类',
+        'text': payloads.sentence(rs),
+        'choices': [{'entity_type': 'invoice'}, {'entity_type': 'order'}, {'entity_type': 'payment'}],
+    }
+
+
+TARGETS = [
+    Target('general-ocr-standard', 'general-ocr/model-standard', 'infer_ocr_app',
+           ocr_files('standard'), document_body, {'MODEL_NAME': 'standard'}, ocr_standins('standard')),
+    Target('general-ocr-advanced', 'general-ocr/model-advanced', 'infer_ocr_app',
+           ocr_files('advanced'), document_body, {'MODEL_NAME': 'advanced'}, ocr_standins('advanced')),
+    Target('general-ocr-traditional', 'general-ocr-traditional/model-standard', 'infer_ocr_app',
+           ocr_files('standard'), document_body, {'MODEL_NAME': 'standard'}, ocr_standins('standard')),
+    Target('general-ocr-viet', 'general-ocr-viet/model-standard', 'infer_ocr_app',
+           ocr_files('standard'), document_body, {'MODEL_NAME': 'standard'}, ocr_standins('standard')),
+    Target('license-plate', 'license-plate/model', 'license_plate_app',
+           ocr_files('standard'), document_body, {'MODEL_NAME': 'standard'}, ocr_standins('standard')),
+    Target('image-similarity', 'image-similarity/model', 'image_similarity_app',
+           ['image-similarity.onnx'], scene_pair_body, build_standins=build_image_similarity),
+    Target('pornography-detection', 'pornography-detection/model', 'image_detection_app',
+           ['resnest50_fast_4s2x40d.onnx'], scene_body, build_standins=build_pornography_detection),
+    Target('object-recognition', 'object-recognition/model', 'object_det_app',
+           ['yolox_l.onnx'], scene_body, build_standins=build_object_recognition),
+    Target('image-super-resolution', 'image-super-resolution/model', 'super_resolution_app',
+           ['Real_ESRGAN_x2.onnx', 'Real_ESRGAN_x4.onnx'], super_resolution_body, build_standins=build_super_resolution),
+    Target('human-image-segmentation', 'human-image-segmentation/model', 'human_seg_app',
+           ['humanseg_720.onnx'], scene_body, build_standins=build_human_segmentation),
+    Target('text-similarity', 'text-similarity/model', 'text_similarity_app',
+           ['CoSENT.onnx', 'tokenizer/vocab.txt'], text_pair_body, build_standins=build_text_similarity),
+    Target('face-detection', 'face-detection/model', 'face_detection_app',
+           ['det.onnx', 'landmark.onnx', 'attribute.onnx'], scene_body),
+    Target('face-comparison', 'face-comparison/model', 'face_comparison_app',
+           ['det.onnx', 'w600k_r50.onnx'], scene_body),
+    Target('human-attribute', 'human-attribute/model', 'human_attribute_app',
+           ['yolox_l.onnx', 'model_1.onnx', 'model_2.onnx', 'model_3.onnx', 'model_4.onnx'], scene_body),
+    Target('layout-analysis', 'layout-analysis/model', 'infer_layout_app',
+           ['layout_s.onnx', 'det_cn.onnx', 'rec_ch.onnx', 'classifier.onnx', 'ppocr_keys_v1.txt',
+            'table_sim.onnx', 'table_structure_dict_ch.txt'], document_body),
+    Target('general-nlu', 'general-nlu/model', 'nlu_llm_app',
+           ['nlu.onnx', 'vocabs.txt'], nlu_body),
+]
+
+TARGETS_BY_NAME = {target.name: target for target in TARGETS}
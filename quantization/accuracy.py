@@ -0,0 +1,139 @@
+"""
+Accuracy check of a quantized variant against its FP32 model. Both run on
+the same held-out inputs and a family specific score between 0 and 1
+compares what the handlers would return:
+
+- ocr_det: mean IoU of the text masks of the probability maps
+- ocr_rec: share of crops decoded to the same CTC label sequence
+- ocr_cls: share of crops with the same orientation
+- yolox: F1 of the detected anchors and classes of the variant against
+  those of the FP32 model
+- arcface, image_embedding, text_encoder: mean cosine similarity of the
+  embeddings
+
+A variant passes when its score reaches the MIN_SCORES of its family.
+"""
+import time
+
+import numpy as np
+
+MIN_SCORES = {
+    'ocr_det': 0.9,
+    'ocr_rec': 0.95,
+    'ocr_cls': 0.98,
+    'yolox': 0.9,
+    'arcface': 0.99,
+    'image_embedding': 0.99,
+    'text_encoder': 0.99,
+}
+METRICS = {
+    'ocr_det': 'mask_iou',
+    'ocr_rec': 'sequence_agreement',
+    'ocr_cls': 'label_agreement',
+    'yolox': 'detection_f1',
+    'arcface': 'cosine',
+    'image_embedding': 'cosine',
+    'text_encoder': 'cosine',
+}
+# probability map threshold of the DB postprocess
+DET_THRESHOLD = 0.3
+# objectness times class score above which a YOLOX anchor counts as a detection
+YOLOX_SCORE_THRESHOLD = 0.3
+
+
+def mask_iou(reference, variant):
+    ious = []
+    for ref, var in zip(reference, variant):
+        ref, var = ref > DET_THRESHOLD, var > DET_THRESHOLD
+        union = np.logical_or(ref, var).sum()
+        ious.append(np.logical_and(ref, var).sum() / float(union) if union else 1.0)
+    return float(np.mean(ious))
+
+
+def ctc_labels(logits):
+    """ greedy CTC decoding, index 0 is the blank """
+    best = logits.argmax(axis=-1)
+    keep = np.concatenate([[True], best[1:] != best[:-1]]) & (best != 0)
+    return tuple(best[keep])
+
+
+def sequence_agreement(reference, variant):
+    same = [ctc_labels(ref[0]) == ctc_labels(var[0]) for ref, var in zip(reference, variant)]
+    return float(np.mean(same))
+
+
+def label_agreement(reference, variant):
+    return float(np.mean([ref.argmax(axis=-1)[0] == var.argmax(axis=-1)[0] for ref, var in zip(reference, variant)]))
+
+
+def yolox_detections(output):
+    """ (anchor, class) pairs scoring above YOLOX_SCORE_THRESHOLD """
+    scores = output[0, :, 4, None] * output[0, :, 5:]
+    anchors = np.flatnonzero(scores.max(axis=1) > YOLOX_SCORE_THRESHOLD)
+    return set(zip(anchors.tolist(), scores[anchors].argmax(axis=1).tolist()))
+
+
+def detection_f1(reference, variant):
+    matched = found = expected = 0
+    for ref, var in zip(reference, variant):
+        ref, var = yolox_detections(ref), yolox_detections(var)
+        matched += len(ref & var)
+        found += len(var)
+        expected += len(ref)
+    if not found and not expected:
+        return 1.0
+    return 2.0 * matched / (found + expected)
+
+
+def cosine(reference, variant):
+    similarities = []
+    for ref, var in zip(reference, variant):
+        ref, var = ref.reshape(-1).astype(np.float64), var.reshape(-1).astype(np.float64)
+        similarities.append(np.dot(ref, var) / max(np.linalg.norm(ref) * np.linalg.norm(var), 1e-12))
+    return float(np.mean(similarities))
+
+
+SCORES = {
+    'mask_iou': mask_iou,
+    'sequence_agreement': sequence_agreement,
+    'label_agreement': label_agreement,
+    'detection_f1': detection_f1,
+    'cosine': cosine,
+}
+
+
+def run_all(session, feeds):
+    """
+    return:
+        (first output of every feed, mean milliseconds per run)
+    """
+    outputs = []
+    start = time.perf_counter()
+    for feed in feeds:
+        outputs.append(session.run(None, feed)[0])
+    return outputs, (time.perf_counter() - start) * 1000 / max(len(feeds), 1)
+
+
+def check(family, reference_session, variant_session, feeds, min_score=None):
+    """
+    return:
+        dict with the metric, score, min_score and passed of the variant and
+        the mean run time of both models on feeds
+    """
+    if min_score is None:
+        min_score = MIN_SCORES[family]
+    # one untimed run each, so the timings leave out the first run allocations
+    reference_session.run(None, feeds[0])
+    variant_session.run(None, feeds[0])
+    reference, reference_ms = run_all(reference_session, feeds)
+    variant, variant_ms = run_all(variant_session, feeds)
+    score = SCORES[METRICS[family]](reference, variant)
+    return {
+        'metric': METRICS[family],
+        'score': round(score, 5),
+        'min_score': min_score,
+        'passed': score >= min_score,
+        'samples': len(feeds),
+        'fp32_ms': round(reference_ms, 3),
+        'variant_ms': round(variant_ms, 3),
+    }
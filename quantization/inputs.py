@@ -0,0 +1,180 @@
+"""
+Model inputs for calibration and the accuracy check, built from images and
+sentences the way the container handlers build them. Every builder takes
+the model entry, its FP32 session, the images as RGB arrays, the sentences
+and the model directory, and returns a list of input feeds, one per sample.
+"""
+import glob
+import math
+import os
+import sys
+
+import cv2
+import numpy as np
+import onnxruntime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+DET_LIMIT_SIDE_LEN = 960
+DET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+DET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# the text crops of a page cut from the pixels the FP32 detector scores
+# above this, see text_crops
+CROP_THRESHOLD = 0.3
+REC_MAX_WIDTH = 1280
+CLS_IMAGE_SHAPE = (48, 192)
+YOLOX_INPUT_SIZE = (640, 640)
+IMAGE_SIMILARITY_INPUT_SIZE = (448, 448)
+
+
+def load_images(directory, limit):
+    """
+    return:
+        up to limit images of directory as RGB arrays, in name order
+    """
+    paths = sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                   if path.lower().endswith(IMAGE_EXTENSIONS))
+    images = []
+    for path in paths[:limit]:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            print('skipped unreadable image {}'.format(path))
+            continue
+        images.append(img[:, :, ::-1])
+    return images
+
+
+def synthetic_images(family, limit, seed=0):
+    """ Images of benchmarks/payloads.py, for a smoke run without calibration data """
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+    import payloads
+    rs = np.random.RandomState(seed)
+    generate = payloads.document_image if family.startswith('ocr_') else payloads.scene_image
+    return [generate(rs, 1280, 960) for _ in range(limit)]
+
+
+def synthetic_sentences(limit, seed=0):
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+    import payloads
+    rs = np.random.RandomState(seed)
+    return [payloads.sentence(rs) for _ in range(limit)]
+
+
+def input_name(session):
+    return session.get_inputs()[0].name
+
+
+def det_input(img):
+    """ DetResizeForTest, NormalizeImage and ToCHWImage of the OCR detector """
+    h, w = img.shape[:2]
+    ratio = min(1.0, float(DET_LIMIT_SIDE_LEN) / max(h, w))
+    resize_h = max(int(round(h * ratio / 32) * 32), 32)
+    resize_w = max(int(round(w * ratio / 32) * 32), 32)
+    img = cv2.resize(img, (resize_w, resize_h)).astype(np.float32)
+    img = (img / 255.0 - DET_MEAN) / DET_STD
+    return img.transpose((2, 0, 1))[np.newaxis].astype(np.float32)
+
+
+def text_crops(images, det_path):
+    """
+    Cut text line crops from the images where the FP32 detector finds text,
+    the inputs of the recognizer and orientation classifier.
+    """
+    session = onnxruntime.InferenceSession(det_path, providers=['CPUExecutionProvider'])
+    crops = []
+    for img in images:
+        blob = det_input(img)
+        maps = session.run(None, {input_name(session): blob})[0][0, 0]
+        scale_y, scale_x = img.shape[0] / float(maps.shape[0]), img.shape[1] / float(maps.shape[1])
+        mask = (maps > CROP_THRESHOLD).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w < 4 or h < 4:
+                continue
+            # the DB map shrinks the text, grow the box back by half its height
+            pad = h // 2
+            x0, y0 = max(int((x - pad) * scale_x), 0), max(int((y - pad) * scale_y), 0)
+            x1, y1 = int((x + w + pad) * scale_x), int((y + h + pad) * scale_y)
+            crop = img[y0:y1, x0:x1]
+            if crop.shape[0] >= 4 and crop.shape[1] >= 4:
+                crops.append(crop)
+    return crops
+
+
+def line_input(crop, height, max_width, pad_width=None):
+    """ resize_norm_img of the OCR recognizer and classifier """
+    width = min(int(math.ceil(height * crop.shape[1] / float(crop.shape[0]))), max_width)
+    resized = cv2.resize(crop, (width, height)).astype(np.float32)
+    resized = (resized.transpose((2, 0, 1)) / 255 - 0.5) / 0.5
+    padded = np.zeros((3, height, pad_width or width), dtype=np.float32)
+    padded[:, :, :width] = resized
+    return padded[np.newaxis]
+
+
+def ocr_det_inputs(model, session, images, texts, model_dir):
+    return [{input_name(session): det_input(img)} for img in images]
+
+
+def ocr_rec_inputs(model, session, images, texts, model_dir):
+    crops = text_crops(images, os.path.join(model_dir, model.params['det_file']))
+    return [{input_name(session): line_input(crop, model.params['height'], REC_MAX_WIDTH)} for crop in crops]
+
+
+def ocr_cls_inputs(model, session, images, texts, model_dir):
+    crops = text_crops(images, os.path.join(model_dir, model.params['det_file']))
+    height, width = CLS_IMAGE_SHAPE
+    return [{input_name(session): line_input(crop, height, width, width)} for crop in crops]
+
+
+def yolox_inputs(model, session, images, texts, model_dir):
+    """ preprocess of object recognition, a letterbox padded with 114 """
+    feeds = []
+    for img in images:
+        padded = np.full(YOLOX_INPUT_SIZE + (3,), 114, dtype=np.uint8)
+        r = min(YOLOX_INPUT_SIZE[0] / float(img.shape[0]), YOLOX_INPUT_SIZE[1] / float(img.shape[1]))
+        resized = cv2.resize(img, (int(img.shape[1] * r), int(img.shape[0] * r)))
+        padded[:resized.shape[0], :resized.shape[1]] = resized
+        feeds.append({input_name(session): np.ascontiguousarray(padded.transpose((2, 0, 1))[np.newaxis], dtype=np.float32)})
+    return feeds
+
+
+def arcface_inputs(model, session, images, texts, model_dir):
+    """ get_feat of ArcFaceONNX on the center square of each image, give aligned faces for a real calibration """
+    size = tuple(session.get_inputs()[0].shape[2:4][::-1])
+    feeds = []
+    for img in images:
+        side = min(img.shape[:2])
+        y, x = (img.shape[0] - side) // 2, (img.shape[1] - side) // 2
+        square = np.ascontiguousarray(img[y:y + side, x:x + side])
+        feeds.append({input_name(session): cv2.dnn.blobFromImage(square, 1.0, size, (0.0, 0.0, 0.0), swapRB=True)})
+    return feeds
+
+
+def image_embedding_inputs(model, session, images, texts, model_dir):
+    """ get_embedding of image similarity """
+    return [{input_name(session): cv2.resize(img / 255, IMAGE_SIMILARITY_INPUT_SIZE).transpose((2, 0, 1))[np.newaxis].astype(np.float32)}
+            for img in images]
+
+
+def text_encoder_inputs(model, session, images, texts, model_dir):
+    """ get_embedding of text similarity, with the tokenizer next to the model """
+    from transformers import BertTokenizerFast
+    tokenizer = BertTokenizerFast.from_pretrained(os.path.join(model_dir, 'tokenizer'))
+    feeds = []
+    for text in texts:
+        tokens = tokenizer(text, return_tensors='np')
+        feeds.append({name: tokens[name].astype(np.int64) for name in ['input_ids', 'attention_mask', 'token_type_ids']})
+    return feeds
+
+
+BUILDERS = {
+    'ocr_det': ocr_det_inputs,
+    'ocr_rec': ocr_rec_inputs,
+    'ocr_cls': ocr_cls_inputs,
+    'yolox': yolox_inputs,
+    'arcface': arcface_inputs,
+    'image_embedding': image_embedding_inputs,
+    'text_encoder': text_encoder_inputs,
+}
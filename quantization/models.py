@@ -0,0 +1,60 @@
+"""
+Registry of the quantized models. An entry names the model file a container
+loads from MODEL_PATH, the family deciding how its inputs are built and its
+accuracy is measured, see inputs and accuracy, and how its INT8 variant is
+quantized.
+"""
+
+
+class QuantModel(object):
+    """
+    args:
+        target(str): directory of the model under --models-root, named like
+            the benchmark targets
+        model_file(str): file the container loads from MODEL_PATH
+        family(str): one of inputs.BUILDERS
+        int8(str): 'static' quantizes weights and activations with ranges
+            calibrated on the inputs, 'dynamic' only the weights, for the
+            text encoder whose activation ranges depend on the sentence
+        params(dict): family specific, e.g. the detector the OCR text
+            crops are cut with
+    """
+
+    def __init__(self, target, model_file, family, int8='static', params=None):
+        self.target = target
+        self.model_file = model_file
+        self.family = family
+        self.int8 = int8
+        self.params = params or {}
+
+    @property
+    def name(self):
+        return self.target + '/' + self.model_file
+
+
+def ocr_models(target, det_file, rec_file, rec_height, cls_file='classifier.onnx'):
+    crops = {'det_file': det_file}
+    return [
+        QuantModel(target, det_file, 'ocr_det'),
+        QuantModel(target, rec_file, 'ocr_rec', params=dict(crops, height=rec_height)),
+        QuantModel(target, cls_file, 'ocr_cls', params=crops),
+    ]
+
+
+MODELS = (
+    ocr_models('general-ocr-standard', 'det_standard.onnx', 'rec_standard.onnx', 32)
+    + ocr_models('general-ocr-advanced', 'det_advanced.onnx', 'rec_advanced.onnx', 48)
+    + ocr_models('general-ocr-traditional', 'det_standard.onnx', 'rec_standard.onnx', 32)
+    + ocr_models('general-ocr-viet', 'det_standard.onnx', 'rec_standard.onnx', 32)
+    + ocr_models('license-plate', 'det_standard.onnx', 'rec_standard.onnx', 32)
+    + ocr_models('layout-analysis', 'det_cn.onnx', 'rec_ch.onnx', 48)
+    + [
+        QuantModel('object-recognition', 'yolox_l.onnx', 'yolox'),
+        QuantModel('human-attribute', 'yolox_l.onnx', 'yolox'),
+        QuantModel('face-comparison', 'w600k_r50.onnx', 'arcface'),
+        QuantModel('image-similarity', 'image-similarity.onnx', 'image_embedding'),
+        QuantModel('text-similarity', 'CoSENT.onnx', 'text_encoder', int8='dynamic'),
+    ]
+)
+
+MODELS_BY_NAME = {model.name: model for model in MODELS}
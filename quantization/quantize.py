@@ -0,0 +1,218 @@
+"""
+Build the INT8 and FP16 variants of the container models and check their
+accuracy, see README.md.
+
+For every model found under --models-root the FP32 model is quantized next
+to itself as <model>.int8.onnx and/or converted to <model>.fp16.onnx. The
+variant is then compared with the FP32 model on held-out inputs and the
+result written to <model>.<precision>.json, the report inference_runtime
+reads to decide whether precision 'auto' loads the variant.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import onnx
+import onnxruntime
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, \
+    quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+QUANTIZATION_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, QUANTIZATION_DIR)
+# the variant names and model fingerprints are the ones the containers use
+RUNTIME_DIR = os.path.join(os.path.dirname(QUANTIZATION_DIR), 'src', 'containers', 'general-ocr', 'model-standard')
+sys.path.insert(1, RUNTIME_DIR)
+
+import accuracy  # noqa: E402
+import inputs  # noqa: E402
+from inference_runtime import load_variant_report, model_fingerprint, variant_paths  # noqa: E402
+from models import MODELS, MODELS_BY_NAME  # noqa: E402
+
+PRECISIONS = ['int8', 'fp16']
+CALIBRATE_METHODS = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile,
+}
+
+
+class FeedReader(CalibrationDataReader):
+    """ Calibration inputs of quantize_static, one feed per run """
+
+    def __init__(self, feeds):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+
+def split_feeds(feeds, eval_every):
+    """
+    return:
+        (calibration feeds, held-out feeds of the accuracy check), every
+        eval_every-th feed is held out, all of them serve both when there
+        are too few to split
+    """
+    held_out = feeds[::eval_every]
+    calibration = [feed for index, feed in enumerate(feeds) if index % eval_every]
+    if not calibration:
+        return feeds, feeds
+    return calibration, held_out
+
+
+def quantize_int8(model, model_path, variant_path, calibration, args):
+    if model.int8 == 'dynamic':
+        quantize_dynamic(model_path, variant_path, weight_type=QuantType.QInt8)
+        return
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, 'preprocessed.onnx')
+        try:
+            # shape inference and graph folding so more of the graph is quantized
+            quant_pre_process(model_path, source)
+        except Exception as e:
+            print('  pre-processing failed, quantizing the model as it is: {}'.format(e))
+            source = model_path
+        quantize_static(
+            source, variant_path, FeedReader(calibration),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=args.per_channel,
+            calibrate_method=CALIBRATE_METHODS[args.calibrate_method])
+
+
+def convert_fp16(model_path, variant_path):
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+    # FP32 inputs and outputs, so the handlers feed the variant unchanged
+    onnx.save(convert_float_to_float16(onnx.load(model_path), keep_io_types=True), variant_path)
+
+
+def variant_providers(precision, device):
+    if precision == 'fp16' and device == 'cuda':
+        return ['CUDAExecutionProvider', 'CPUExecutionProvider']
+    return ['CPUExecutionProvider']
+
+
+def load_samples(model, args):
+    """
+    return:
+        (images, texts, source), source is 'synthetic' when the inputs come
+        from benchmarks/payloads.py
+    """
+    if model.family == 'text_encoder':
+        if args.texts:
+            with open(args.texts) as f:
+                return [], [line.strip() for line in f if line.strip()][:args.samples], args.texts
+        return [], inputs.synthetic_sentences(args.samples, args.seed), 'synthetic'
+    if args.calibration_dir:
+        # a directory per target, e.g. aligned faces for face-comparison, or shared images
+        directory = os.path.join(args.calibration_dir, model.target)
+        if not os.path.isdir(directory):
+            directory = args.calibration_dir
+        images = inputs.load_images(directory, args.samples)
+        if images:
+            return images, [], directory
+    return inputs.synthetic_images(model.family, args.samples, args.seed), [], 'synthetic'
+
+
+def process(model, model_dir, args):
+    model_path = os.path.join(model_dir, model.model_file)
+    precisions = [precision for precision in args.precisions if precision in PRECISIONS]
+    if not args.force:
+        precisions = [precision for precision in precisions
+                      if not (os.path.exists(variant_paths(model_path, precision)[0])
+                              and load_variant_report(model_path, precision) is not None)]
+        if not precisions:
+            print('{}: variants are up to date'.format(model.name))
+            return
+    images, texts, source = load_samples(model, args)
+    if source == 'synthetic':
+        print('{}: no calibration data, using synthetic inputs, the variants are only fit for a smoke test'.format(model.name))
+    reference = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    try:
+        feeds = inputs.BUILDERS[model.family](model, reference, images, texts, model_dir)
+    except Exception as e:
+        print('{}: failed to build the inputs, skipped: {}'.format(model.name, e))
+        return
+    if not feeds:
+        print('{}: no inputs could be built, skipped'.format(model.name))
+        return
+    calibration, held_out = split_feeds(feeds, args.eval_every)
+    for precision in precisions:
+        variant_path, report_path = variant_paths(model_path, precision)
+        print('{}: building {}'.format(model.name, os.path.basename(variant_path)))
+        report = {
+            'source': model_fingerprint(model_path),
+            'precision': precision,
+            'family': model.family,
+            'calibration': source if precision == 'int8' and model.int8 == 'static' else None,
+            'device': args.device if precision == 'fp16' else 'cpu',
+            'onnxruntime': onnxruntime.__version__,
+        }
+        try:
+            if precision == 'int8':
+                quantize_int8(model, model_path, variant_path, calibration, args)
+            else:
+                convert_fp16(model_path, variant_path)
+            variant = onnxruntime.InferenceSession(variant_path, providers=variant_providers(precision, args.device))
+            report.update(accuracy.check(model.family, reference, variant, held_out, args.min_score))
+        except Exception as e:
+            # the report keeps precision 'auto' from loading the variant
+            report.update({'passed': False, 'error': str(e)})
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('  {} {} (min {}), {} ms -> {} ms, {}'.format(
+            report.get('metric', 'error'), report.get('score', report.get('error')), report.get('min_score'),
+            report.get('fp32_ms'), report.get('variant_ms'), 'passed' if report['passed'] else 'FAILED'))
+
+
+def run(args):
+    selected = MODELS
+    if args.models:
+        selected = [MODELS_BY_NAME[name] for name in args.models.split(',')]
+    for model in selected:
+        model_dir = os.path.join(args.models_root, model.target)
+        if not os.path.exists(os.path.join(model_dir, model.model_file)):
+            continue
+        process(model, model_dir, args)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build and check the INT8 and FP16 variants of the container models.')
+    parser.add_argument('--models-root', required=True, help='directory with a <target>/ directory of models per target')
+    parser.add_argument('--models', help='comma separated <target>/<model file> names, all found models by default')
+    parser.add_argument('--list', action='store_true', help='list the models and exit')
+    parser.add_argument('--precisions', type=lambda v: v.split(','), default=PRECISIONS,
+                        help='comma separated precisions to build, int8 and fp16 by default')
+    parser.add_argument('--calibration-dir',
+                        help='images to calibrate and check with, or a <target>/ directory of images per target')
+    parser.add_argument('--texts', help='file with one sentence per line, for the text encoder')
+    parser.add_argument('--samples', type=int, default=100, help='images or sentences loaded per model')
+    parser.add_argument('--eval-every', type=int, default=5,
+                        help='every n-th input is held out of calibration for the accuracy check')
+    parser.add_argument('--calibrate-method', choices=sorted(CALIBRATE_METHODS), default='minmax')
+    parser.add_argument('--no-per-channel', dest='per_channel', action='store_false',
+                        help='quantize the weights per tensor instead of per output channel')
+    parser.add_argument('--device', choices=['cpu', 'cuda'], default='cpu',
+                        help='device the FP16 variants are checked on, check them on the GPU they will serve on')
+    parser.add_argument('--min-score', type=float, help='score a variant needs to pass, by family by default')
+    parser.add_argument('--force', action='store_true', help='rebuild variants whose report is up to date')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def list_models(args):
+    for model in MODELS:
+        found = os.path.exists(os.path.join(args.models_root, model.target, model.model_file))
+        print('{:<48} {:<16} {:<8} {}'.format(model.name, model.family, model.int8, 'found' if found else 'missing'))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.list:
+        list_models(args)
+    else:
+        run(args)
@@ -20,7 +20,10 @@ export class LayoutAnalysisFeatureNestedStack extends FeatureNestedStack {
       featureCategory: 'media',
       updateCustomResourceProvider: props.updateCustomResourceProvider,
       lambdaMemorySize: props.lambdaMemorySize,
-      lambdaTimeout: Duration.seconds(19),
+      // the API Gateway still ends synchronous requests at 29 seconds, the
+      // longer timeout is for async jobs
+      lambdaTimeout: Duration.minutes(5),
+      lambdaJobMode: true,
     });
   }
 }
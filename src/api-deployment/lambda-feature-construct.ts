@@ -5,10 +5,13 @@ import {
 import { Repository } from 'aws-cdk-lib/aws-ecr';
 import {
   ManagedPolicy,
+  Policy,
+  PolicyStatement,
   Role,
   ServicePrincipal,
 } from 'aws-cdk-lib/aws-iam';
 import { DockerImageCode, DockerImageFunction } from 'aws-cdk-lib/aws-lambda';
+import { BlockPublicAccess, Bucket, BucketEncryption } from 'aws-cdk-lib/aws-s3';
 import { Provider } from 'aws-cdk-lib/custom-resources';
 import { Construct } from 'constructs';
 import { ECRDeployment } from '../lib/cdk-ecr-deployment/lib';
@@ -44,6 +47,14 @@ export interface LambdaFeatureProps {
      * @default 'latest'
      */
   readonly lambdaDockerImageTag?: string;
+
+  /**
+     * Accept `async` requests, see the job mode of the container README.
+     * Jobs are kept in a bucket of the feature, and run in asynchronous
+     * invocations of the function itself within lambdaTimeout.
+     * @default false
+     */
+  readonly lambdaJobMode?: boolean;
 }
 
 export class LambdaFeatureConstruct extends Construct {
@@ -88,6 +99,29 @@ export class LambdaFeatureConstruct extends Construct {
       );
       myRole.addManagedPolicy(ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole'));
       myRole.addManagedPolicy(ManagedPolicy.fromAwsManagedPolicyName('AmazonS3ReadOnlyAccess'));
+      if (props.lambdaJobMode) {
+        const jobBucket = new Bucket(this, `${props.featureName}Jobs`, {
+          encryption: BucketEncryption.S3_MANAGED,
+          blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+          enforceSSL: true,
+          removalPolicy: RemovalPolicy.DESTROY,
+          autoDeleteObjects: true,
+          lifecycleRules: [{ expiration: Duration.days(1) }],
+        });
+        jobBucket.grantReadWrite(myRole);
+        appFunction.addEnvironment('JOB_MODE', 'true');
+        appFunction.addEnvironment('JOB_STORE', 's3');
+        appFunction.addEnvironment('JOB_BUCKET', jobBucket.bucketName);
+        // a policy of its own, the function already depends on the default
+        // policy of its role
+        new Policy(this, `${props.featureName}JobPolicy`, {
+          roles: [myRole],
+          statements: [new PolicyStatement({
+            actions: ['lambda:InvokeFunction'],
+            resources: [appFunction.functionArn],
+          })],
+        });
+      }
       appFunction.node.addDependency(ecrCR);
       // const lambdaInt = new LambdaIntegration(appFunction, { proxy: true });
       const rootRestApi = RestApi.fromRestApiAttributes(this, 'client-api', {
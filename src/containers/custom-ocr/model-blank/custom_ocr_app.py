@@ -10,55 +10,29 @@ from main import *
 import hashlib
 import pickle
 from aikits_utils import readimg, lambda_return
+import request_metrics
+from inference_runtime import create_session
+from reading_order import sorted_boxes
 
 model_path = os.environ['MODEL_PATH']
 os.makedirs('/mnt/custom-ocr/', exist_ok=True)
-ort_session_backbone = onnxruntime.InferenceSession(model_path + 'matcher_backbone.onnx', providers=['CPUExecutionProvider'])
-_ = ort_session_backbone.run(['feat_c', 'feat_f'], {'img': np.zeros([1, 1, 64, 64], dtype='float32')})
+ort_session_backbone = create_session(model_path + 'matcher_backbone.onnx', device='cpu', warmup_shapes={'img': [1, 1, 64, 64]})
 
-ort_session_pos_encoding = onnxruntime.InferenceSession(model_path + 'matcher_pos_encoding.onnx', providers=['CPUExecutionProvider'])
-_ = ort_session_pos_encoding.run(['feat_c_out'], {'feat_c_in': np.zeros([1, 256, 64, 64], dtype='float32')})
+ort_session_pos_encoding = create_session(model_path + 'matcher_pos_encoding.onnx', device='cpu', warmup_shapes={'feat_c_in': [1, 256, 64, 64]})
 
-ort_session_loftr_coarse = onnxruntime.InferenceSession(model_path + 'matcher_loftr_coarse.onnx', providers=['CPUExecutionProvider'])
-_ = ort_session_loftr_coarse.run(['feat_c0_out', 'feat_c1_out'], {'feat_c0_in': np.zeros([1, 64, 256], dtype='float32'), 'feat_c1_in': np.zeros([1, 64, 256], dtype='float32')})
+ort_session_loftr_coarse = create_session(model_path + 'matcher_loftr_coarse.onnx', device='cpu', warmup_shapes={'feat_c0_in': [1, 64, 256], 'feat_c1_in': [1, 64, 256]})
 
-ort_session_coarse_matching = onnxruntime.InferenceSession(model_path + 'matcher_coarse_matching.onnx', providers=['CPUExecutionProvider'])
+ort_session_coarse_matching = create_session(model_path + 'matcher_coarse_matching.onnx', device='cpu')
 
-ort_session_fine_preprocess = onnxruntime.InferenceSession(model_path + 'matcher_fine_preprocess.onnx', providers=['CPUExecutionProvider'])
-_ = ort_session_fine_preprocess.run(['feat_f0_unfold', 'feat_f1_unfold'],
-                                    {'feat_f0': np.zeros([1, 128, 64, 64], dtype='float32'), 'feat_f1': np.zeros([1, 128, 64, 64], dtype='float32'), 'feat_c0': np.zeros([1, 64, 256], dtype='float32'), 'feat_c1':np.zeros([1, 64, 256], dtype='float32'),
-                                     'b_ids': np.zeros([1], dtype='int64'), 'i_ids': np.zeros([1], dtype='int64'), 'j_ids': np.zeros([1], dtype='int64')})
+ort_session_fine_preprocess = create_session(model_path + 'matcher_fine_preprocess.onnx', device='cpu', warmup_shapes={'feat_f0': [1, 128, 64, 64], 'feat_f1': [1, 128, 64, 64], 'feat_c0': [1, 64, 256], 'feat_c1': [1, 64, 256], 'b_ids': [1], 'i_ids': [1], 'j_ids': [1]})
 
-ort_session_loftr_fine = onnxruntime.InferenceSession(model_path + 'matcher_loftr_fine.onnx', providers=['CPUExecutionProvider'])
-_ = ort_session_loftr_fine.run(['feat_f0_unfold_out', 'feat_f1_unfold_out'],
-                               {'feat_f0_unfold_in': np.zeros([1, 64, 128], dtype='float32'), 'feat_f1_unfold_in': np.zeros([1, 64, 128], dtype='float32')})
+ort_session_loftr_fine = create_session(model_path + 'matcher_loftr_fine.onnx', device='cpu', warmup_shapes={'feat_f0_unfold_in': [1, 64, 128], 'feat_f1_unfold_in': [1, 64, 128]})
 
-ort_session_fine_matching = onnxruntime.InferenceSession(model_path + 'matcher_fine_matching.onnx', providers=['CPUExecutionProvider'])
+ort_session_fine_matching = create_session(model_path + 'matcher_fine_matching.onnx', device='cpu')
 
 
 lmdb_root = "/mnt/custom-ocr"
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
-
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
-
 
 class TextSystem:
     def __init__(self):
@@ -112,20 +86,23 @@ class TextSystem:
         return dst_img
 
     def __call__(self, img):
-        ori_im = img.copy()
         dt_boxes = self.text_detector(img)
         if dt_boxes is None:
             return None, None
         img_crop_list = []
 
         dt_boxes = sorted_boxes(dt_boxes)
-        for bno in range(len(dt_boxes)):
-            tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            pad = min(img_crop.shape[:2])//10
-            if pad:
-                img_crop = cv2.copyMakeBorder(img_crop, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=(255,255,255))
-            img_crop_list.append(img_crop)
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, the boxes are not copied and the image at most once, as
+        # OpenCV would copy a strided view such as img[:, :, ::-1] per crop
+        with request_metrics.stage('rec_preprocess'):
+            img = np.ascontiguousarray(img)
+            for box in dt_boxes:
+                img_crop = TextCrop(img, box)
+                pad = min(img_crop.shape[:2])//10
+                if pad:
+                    img_crop = img_crop.with_border(pad)
+                img_crop_list.append(img_crop)
         img_crop_list, angle_list = self.text_classifier(img_crop_list)
 
         rec_res = self.text_recognizer(img_crop_list)
@@ -172,6 +149,7 @@ def read_img(body):
             return str(k)
     return img
     
+@request_metrics.instrument('custom-ocr-blank')
 def handler(event, context):
     start_time = time.time()
     if "body" not in event:
@@ -236,8 +214,9 @@ def handler(event, context):
 
         h,w,_ = img.shape
         h_scale, w_scale = h/template['hw_i'][0], w/template['hw_i'][1]
-        im = cv2.resize(img, (template['hw_i'][1], template['hw_i'][0]))
-        im = (cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)/255).astype('float32')
+        with request_metrics.stage('preprocess'):
+            im = cv2.resize(img, (template['hw_i'][1], template['hw_i'][0]))
+            im = (cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)/255).astype('float32')
         feat_c1, feat_f1, hw1_c, hw1_f = get_feature(im)
         
         hw1_c = np.array(hw1_c, dtype='long')
@@ -255,8 +234,9 @@ def handler(event, context):
         mkpts0_f, mkpts1_f = ort_session_fine_matching.run(['mkpts0_f', 'mkpts1_f'],
                                                         {'feat_f0_unfold': feat_f0_unfold, 'feat_f1_unfold': feat_f1_unfold, 'hw0_i': np.array(template['hw_i'], dtype='long'), 'hw0_f': np.array(template['hw_f'], dtype='long'),
                                                         'mkpts0_c':mkpts0_c, 'mkpts1_c':mkpts1_c})
-        H, inliers = cv2.findHomography(mkpts0_f, mkpts1_f, cv2.USAC_MAGSAC, 0.5, 0.999, 100000)
-        inliers = inliers > 0
+        with request_metrics.stage('postprocess'):
+            H, inliers = cv2.findHomography(mkpts0_f, mkpts1_f, cv2.USAC_MAGSAC, 0.5, 0.999, 100000)
+            inliers = inliers > 0
         result = []
         for row in template['template']:
             points = row[0]
@@ -276,7 +256,8 @@ def handler(event, context):
             }
             result.append(res)
     
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
+    with request_metrics.stage('serialize'):
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
         
-    return lambda_return(200, json.dumps(result))
+        return lambda_return(200, json.dumps(result))
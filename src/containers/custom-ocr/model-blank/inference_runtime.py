@@ -0,0 +1,632 @@
+"""
+Shared onnxruntime session setup. The same file is copied into every model
+container, sessions are built with create_session and tuned per model through
+an ort_config.json baked into the image, e.g.
+
+    {
+        "*": {"inter_op_num_threads": 1},
+        "det_standard.onnx": {"intra_op_num_threads": 2}
+    }
+
+Run as a script at image build time to store optimized graphs next to the
+models, sessions then load those instead of optimizing on every cold start:
+
+    python3 inference_runtime.py /opt/program/model/
+
+When SERVER_WORKERS worker processes serve the same models, see prefork, the
+stored graphs keep their weights in a separate file that onnxruntime maps
+into memory, so the workers share one copy of the weights, and the
+intra-op threads are divided between the workers.
+
+Hot call sites run through TimedSession.run_bound, which reuses the input and
+output buffers of earlier runs with the same input shapes, see BoundRuns.
+
+Models can ship INT8 and FP16 variants next to them, built and checked by
+quantization/quantize.py, e.g. det_standard.int8.onnx with its accuracy
+report det_standard.int8.json. The precision config, or MODEL_PRECISION,
+selects the variant a session loads, see select_model_variant.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from glob import glob
+
+import numpy as np
+import onnxruntime
+
+import request_metrics
+
+# worker processes of the SageMaker server sharing the machine, see prefork
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 1))
+
+try:
+    import GPUtil
+    cuda_available = True if len(GPUtil.getGPUs()) else False
+    if cuda_available:
+        print(GPUtil.getGPUs()[0].name)
+except Exception:
+    cuda_available = False
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+INPUT_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+    'tensor(uint8)': np.uint8,
+    'tensor(bool)': np.bool_,
+}
+
+DEFAULT_CONFIG = {
+    # 'auto' uses CUDA when a GPU is found, 'cuda' and 'cpu' force a provider
+    'device': 'auto',
+    # 0 lets onnxruntime pick the number of physical cores
+    'intra_op_num_threads': 0,
+    'inter_op_num_threads': 0,
+    'graph_optimization_level': 'all',
+    'execution_mode': 'sequential',
+    'enable_cpu_mem_arena': True,
+    'enable_mem_pattern': True,
+    # options of the CUDA execution provider, e.g. cudnn_conv_algo_search
+    'provider_options': {},
+    # shapes of a zero input run once after loading, see warmup
+    'warmup_shapes': [],
+    # load the graph written by save_optimized_model when it is up to date
+    'optimized_model_cache': True,
+    # keep the weights of the optimized graph in a file mapped into memory,
+    # see build_session_options
+    'shared_weights': SERVER_WORKERS > 1,
+    # run_bound reuses the buffers of earlier runs, see BoundRuns, with at
+    # most io_binding_shapes input shapes and io_binding_max_mb of outputs
+    # kept per thread
+    'io_binding': True,
+    'io_binding_shapes': 8,
+    'io_binding_max_mb': 64,
+    # 'fp32', 'int8' or 'fp16' load that variant of the model, 'auto' the
+    # INT8 variant on CPU or the FP16 one on GPU when it passed its
+    # accuracy check, see select_model_variant
+    'precision': 'auto',
+}
+
+OPTIMIZED_MODEL_SUFFIX = '.opt.onnx'
+OPTIMIZED_METADATA_SUFFIX = '.opt.json'
+# layout optimizations of the 'all' level depend on the CPU the graph was
+# optimized on, so the stored graph stops at 'extended' and the remaining
+# passes run when the session is created
+OFFLINE_OPTIMIZATION_LEVEL = 'extended'
+FINGERPRINT_CHUNK_SIZE = 1 << 20
+# smaller initializers stay in the graph of a shared weights model
+SHARED_WEIGHTS_MIN_BYTES = 1024
+# precisions of the model variants stored next to a model, the variant of
+# model.onnx is model.<precision>.onnx with its report model.<precision>.json
+VARIANT_PRECISIONS = ['int8', 'fp16']
+AUTO_PRECISIONS = {'cpu': 'int8', 'cuda': 'fp16'}
+
+
+def load_config_file():
+    """
+    Load the per-model session config from ORT_CONFIG_PATH, by default
+    ort_config.json next to this file. The file maps model file names to
+    config dicts, the '*' entry applies to every model.
+    """
+    path = os.environ.get('ORT_CONFIG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ort_config.json'))
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def resolve_config(model_path, config):
+    """
+    Merge, from lowest to highest priority: DEFAULT_CONFIG, the '*' entry of
+    the config file, the config given by the caller, the model entry of the
+    config file and the ORT_INTRA_OP_NUM_THREADS / ORT_INTER_OP_NUM_THREADS /
+    MODEL_PRECISION environment variables.
+    """
+    config_file = load_config_file()
+    resolved = dict(DEFAULT_CONFIG)
+    resolved.update(config_file.get('*', {}))
+    resolved.update(config)
+    resolved.update(config_file.get(os.path.basename(model_path), {}))
+    if os.environ.get('ORT_INTRA_OP_NUM_THREADS'):
+        resolved['intra_op_num_threads'] = int(os.environ['ORT_INTRA_OP_NUM_THREADS'])
+    if os.environ.get('ORT_INTER_OP_NUM_THREADS'):
+        resolved['inter_op_num_threads'] = int(os.environ['ORT_INTER_OP_NUM_THREADS'])
+    if os.environ.get('MODEL_PRECISION'):
+        resolved['precision'] = os.environ['MODEL_PRECISION']
+    if not resolved['intra_op_num_threads'] and SERVER_WORKERS > 1:
+        # each worker process gets its share of the cores
+        resolved['intra_op_num_threads'] = max(1, (os.cpu_count() or 1) // SERVER_WORKERS)
+    return resolved
+
+
+def shares_weights(config):
+    # GPU sessions copy the weights to the device anyway
+    return bool(config['shared_weights']) and resolve_device(config) == 'cpu'
+
+
+def build_session_options(config):
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = int(config['intra_op_num_threads'])
+    sess_options.inter_op_num_threads = int(config['inter_op_num_threads'])
+    sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[config['graph_optimization_level']]
+    sess_options.execution_mode = EXECUTION_MODES[config['execution_mode']]
+    sess_options.enable_cpu_mem_arena = bool(config['enable_cpu_mem_arena'])
+    sess_options.enable_mem_pattern = bool(config['enable_mem_pattern'])
+    if shares_weights(config):
+        # prepacked weights and the NCHWc layout of the 'all' level are
+        # private copies of the mapped weights
+        sess_options.add_session_config_entry('session.disable_prepacking', '1')
+        if config['graph_optimization_level'] == 'all':
+            sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS['extended']
+    return sess_options
+
+
+def resolve_device(config):
+    device = config['device']
+    if device == 'cuda' or (device == 'auto' and cuda_available):
+        return 'cuda'
+    return 'cpu'
+
+
+def build_providers(config):
+    if resolve_device(config) == 'cuda':
+        return [('CUDAExecutionProvider', dict(config['provider_options'])), 'CPUExecutionProvider']
+    return ['CPUExecutionProvider']
+
+
+def optimized_model_paths(model_path):
+    root = os.path.splitext(model_path)[0]
+    return root + OPTIMIZED_MODEL_SUFFIX, root + OPTIMIZED_METADATA_SUFFIX
+
+
+def model_fingerprint(model_path):
+    """
+    Identify a model file by its size and the hash of its first and last
+    chunk, cheap enough to compute on every cold start.
+    """
+    size = os.path.getsize(model_path)
+    sha1 = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        sha1.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(size - FINGERPRINT_CHUNK_SIZE, FINGERPRINT_CHUNK_SIZE))
+            sha1.update(f.read())
+    return '%d:%s' % (size, sha1.hexdigest())
+
+
+def optimized_model_metadata(model_path, config):
+    metadata = {
+        'source': model_fingerprint(model_path),
+        'onnxruntime': onnxruntime.__version__,
+        'device': resolve_device(config),
+        'graph_optimization_level': OFFLINE_OPTIMIZATION_LEVEL,
+    }
+    if shares_weights(config):
+        metadata['shared_weights'] = True
+    return metadata
+
+
+def variant_paths(model_path, precision):
+    root = os.path.splitext(model_path)[0]
+    return root + '.' + precision + '.onnx', root + '.' + precision + '.json'
+
+
+def is_model_variant(model_path):
+    return any(model_path.endswith('.' + precision + '.onnx') for precision in VARIANT_PRECISIONS)
+
+
+def load_variant_report(model_path, precision):
+    """
+    return:
+        the accuracy report of the precision variant of model_path, None when
+        it is missing or was written for another model file
+    """
+    _, report_path = variant_paths(model_path, precision)
+    if not os.path.exists(report_path):
+        return None
+    with open(report_path) as f:
+        report = json.load(f)
+    if report.get('source') != model_fingerprint(model_path):
+        print('stale variant report {}'.format(report_path))
+        return None
+    return report
+
+
+def variant_rejection(report):
+    """
+    return:
+        why precision 'auto' does not load the variant of report, None when
+        it does: the variant passed its accuracy check on real calibration
+        data and ran faster than the model
+    """
+    if report is None:
+        return 'has no report of the model file'
+    if not report.get('passed'):
+        return 'did not pass its accuracy check'
+    if report.get('calibration') == 'synthetic':
+        return 'was calibrated on synthetic inputs'
+    fp32_ms, variant_ms = report.get('fp32_ms'), report.get('variant_ms')
+    if fp32_ms is None or variant_ms is None or variant_ms >= fp32_ms:
+        return 'is not faster than the model ({} ms against {} ms)'.format(variant_ms, fp32_ms)
+    return None
+
+
+def select_model_variant(model_path, config):
+    """
+    Pick the file a session of model_path loads. An explicit precision
+    loads its variant whenever the file exists. 'auto' loads the INT8
+    variant on CPU and the FP16 one on GPU, only when their report passes
+    variant_rejection, otherwise the model itself.
+    return:
+        path of the model or of one of its variants
+    """
+    precision = config['precision']
+    if precision == 'fp32':
+        return model_path
+    device = resolve_device(config)
+    if device == 'cuda' and 'CUDAExecutionProvider' not in onnxruntime.get_available_providers():
+        device = 'cpu'
+    explicit = precision != 'auto'
+    if not explicit:
+        precision = AUTO_PRECISIONS[device]
+    path, _ = variant_paths(model_path, precision)
+    if not os.path.exists(path):
+        if explicit:
+            print('no {} variant of {}, loading the model itself'.format(precision, model_path))
+        return model_path
+    rejection = variant_rejection(load_variant_report(model_path, precision))
+    if rejection is not None:
+        if not explicit:
+            print('{} {}, loading the model itself'.format(path, rejection))
+            return model_path
+        print('{} {}, loading it as configured'.format(path, rejection))
+    return path
+
+
+def selected_model_path(model_path, **config):
+    """
+    return:
+        the file create_session(model_path, **config) loads, see
+        select_model_variant
+    """
+    return select_model_variant(model_path, resolve_config(model_path, config))
+
+
+def find_optimized_model(model_path, config):
+    """
+    return:
+        path of the stored optimized graph, or None when it is missing or was
+        built from another model file, onnxruntime version or device
+    """
+    optimized_path, metadata_path = optimized_model_paths(model_path)
+    if not os.path.exists(optimized_path) or not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    if metadata != optimized_model_metadata(model_path, config):
+        print('stale optimized model {}, loading {}'.format(optimized_path, model_path))
+        return None
+    return optimized_path
+
+
+def save_optimized_model(model_path, **config):
+    """
+    Optimize the graph of model_path and store it with its metadata next to
+    the model, see find_optimized_model. With shared_weights the weights go
+    to a <optimized graph>.data file next to it.
+    """
+    config = resolve_config(model_path, config)
+    optimized_path, metadata_path = optimized_model_paths(model_path)
+    sess_options = build_session_options(config)
+    sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[OFFLINE_OPTIMIZATION_LEVEL]
+    sess_options.optimized_model_filepath = optimized_path
+    if shares_weights(config):
+        sess_options.add_session_config_entry(
+            'session.optimized_model_external_initializers_file_name', os.path.basename(optimized_path) + '.data')
+        sess_options.add_session_config_entry(
+            'session.optimized_model_external_initializers_min_size_in_bytes', str(SHARED_WEIGHTS_MIN_BYTES))
+    onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=build_providers(config))
+    with open(metadata_path, 'w') as f:
+        json.dump(optimized_model_metadata(model_path, config), f)
+    return optimized_path
+
+
+def warmup(session, shapes):
+    """
+    Run the session once on zero inputs. shapes is either a list with one
+    shape per session input, in order, or a dict from input name to shape.
+    """
+    if not shapes:
+        return
+    if not isinstance(shapes, dict):
+        shapes = {ort_input.name: shape for ort_input, shape in zip(session.get_inputs(), shapes)}
+    ort_inputs = {}
+    for ort_input in session.get_inputs():
+        dtype = INPUT_DTYPES.get(ort_input.type, np.float32)
+        ort_inputs[ort_input.name] = np.zeros(shapes[ort_input.name], dtype=dtype)
+    session.run(None, ort_inputs)
+
+
+class BoundRuns(object):
+    """
+    I/O bindings of a session, cached by the names, shapes and dtypes of the
+    inputs. A shape is bound on its second run, so shapes seen once, e.g.
+    the odd recognizer batch width, keep no buffers. The first bound run lets
+    onnxruntime allocate the outputs, later runs of the same shape write into
+    those arrays instead of allocating and copying new ones. On GPU the
+    inputs are copied into device buffers kept with the binding. The cache is
+    per thread, as the inference workers share sessions, and keeps the
+    max_shapes most recently used shapes whose outputs fit in max_bytes.
+    """
+
+    def __init__(self, session, max_shapes, max_bytes):
+        self.session = session
+        self.max_shapes = max_shapes
+        self.max_bytes = max_bytes
+        self.device = 'cuda' if 'CUDAExecutionProvider' in session.get_providers() else 'cpu'
+        self.output_names = [output.name for output in session.get_outputs()]
+        self.local = threading.local()
+
+    def thread_cache(self):
+        """
+        return:
+            (bindings, seen) of the current thread, the bindings by key and
+            the keys run once without a binding
+        """
+        if not hasattr(self.local, 'bindings'):
+            self.local.bindings = OrderedDict()
+            self.local.seen = OrderedDict()
+        return self.local.bindings, self.local.seen
+
+    def evict(self, bindings):
+        nbytes = sum(entry[4] for entry in bindings.values())
+        while bindings and (len(bindings) > self.max_shapes or nbytes > self.max_bytes):
+            _, entry = bindings.popitem(last=False)
+            nbytes -= entry[4]
+
+    def bind_inputs(self, binding, device_inputs, input_feed):
+        for name, value in input_feed.items():
+            if self.device == 'cuda':
+                device_inputs[name].update_inplace(value)
+            else:
+                binding.bind_cpu_input(name, value)
+
+    def first_run(self, output_names, input_feed):
+        binding = self.session.io_binding()
+        device_inputs = {}
+        for name, value in input_feed.items():
+            if self.device == 'cuda':
+                device_inputs[name] = onnxruntime.OrtValue.ortvalue_from_numpy(value, 'cuda', 0)
+                binding.bind_ortvalue_input(name, device_inputs[name])
+            else:
+                binding.bind_cpu_input(name, value)
+        for name in output_names:
+            binding.bind_output(name, 'cpu')
+        self.session.run_with_iobinding(binding)
+        outputs = binding.copy_outputs_to_cpu()
+        binding.clear_binding_outputs()
+        output_values = [onnxruntime.OrtValue.ortvalue_from_numpy(output) for output in outputs]
+        for name, output_value in zip(output_names, output_values):
+            binding.bind_ortvalue_output(name, output_value)
+        return binding, device_inputs, outputs, output_values, sum(output.nbytes for output in outputs)
+
+    def run(self, output_names, input_feed):
+        """
+        return:
+            the outputs like InferenceSession.run, arrays that the next run of
+            the same input shapes on this thread overwrites
+        """
+        output_names = list(output_names or self.output_names)
+        input_feed = {name: np.ascontiguousarray(value) for name, value in input_feed.items()}
+        key = (tuple(output_names),) + tuple(sorted(
+            (name, value.shape, value.dtype.str) for name, value in input_feed.items()))
+        bindings, seen = self.thread_cache()
+        if key not in bindings:
+            if key not in seen:
+                seen[key] = None
+                while len(seen) > 4 * self.max_shapes:
+                    seen.popitem(last=False)
+                return self.session.run(output_names, input_feed)
+            del seen[key]
+            entry = self.first_run(output_names, input_feed)
+            if entry[4] <= self.max_bytes:
+                bindings[key] = entry
+                self.evict(bindings)
+            return entry[2]
+        bindings.move_to_end(key)
+        binding, device_inputs, outputs = bindings[key][:3]
+        self.bind_inputs(binding, device_inputs, input_feed)
+        try:
+            self.session.run_with_iobinding(binding)
+        except Exception as e:
+            # outputs whose shape does not only depend on the input shapes
+            # do not fit the buffers of the first run
+            print('bound run failed, running unbound: {}'.format(e))
+            del bindings[key]
+            return self.session.run(output_names, input_feed)
+        return outputs
+
+
+class TimedSession(object):
+    """
+    Wrap an InferenceSession so each run is recorded as the run:<model name>
+    stage of the current request, see request_metrics. Everything else is
+    forwarded to the session.
+    """
+
+    def __init__(self, session, model_path, bound_runs=None):
+        self.session = session
+        self.stage_name = 'run:' + os.path.splitext(os.path.basename(model_path))[0]
+        self.bound_runs = bound_runs
+
+    def run(self, *args, **kwargs):
+        with request_metrics.stage(self.stage_name):
+            return self.session.run(*args, **kwargs)
+
+    def run_bound(self, output_names, input_feed):
+        """
+        Like run, through the I/O bindings of BoundRuns when io_binding is
+        set. The outputs are only valid until the next run_bound of the same
+        input shapes on the same thread, callers consume or copy them first.
+        """
+        if self.bound_runs is None:
+            return self.run(output_names, input_feed)
+        with request_metrics.stage(self.stage_name):
+            return self.bound_runs.run(output_names, input_feed)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def create_session(model_path, **config):
+    """
+    Build an onnxruntime InferenceSession with the session options, providers
+    and warm-up run described by the resolved config.
+    args:
+        model_path(str): path of the .onnx model
+        config: overrides of DEFAULT_CONFIG for this model
+    return:
+        TimedSession around the onnxruntime.InferenceSession
+    """
+    config = resolve_config(model_path, config)
+    # runs keep the stage name of the model whichever variant is loaded
+    load_path = select_model_variant(model_path, config)
+    session = None
+    optimized_path = find_optimized_model(load_path, config) if config['optimized_model_cache'] else None
+    if optimized_path is not None:
+        try:
+            session = onnxruntime.InferenceSession(
+                optimized_path,
+                sess_options=build_session_options(config),
+                providers=build_providers(config))
+        except Exception as e:
+            print('failed to load optimized model {}: {}'.format(optimized_path, e))
+    if session is None:
+        session = onnxruntime.InferenceSession(
+            load_path,
+            sess_options=build_session_options(config),
+            providers=build_providers(config))
+    warmup(session, config['warmup_shapes'])
+    bound_runs = None
+    if config['io_binding']:
+        bound_runs = BoundRuns(session, config['io_binding_shapes'], int(config['io_binding_max_mb'] * (1 << 20)))
+    return TimedSession(session, model_path, bound_runs)
+
+
+class LazyModelRegistry(object):
+    """
+    Build models the first time they are requested and keep the most recently
+    used ones while their model files fit in MODEL_MEMORY_BUDGET_MB, models
+    named in PRELOAD_MODELS (comma separated, '*' for all) are built up front.
+    Supports registry[name] so it can stand in for a dict of models.
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 0))
+        # 0 means no budget, models are never evicted
+        self.memory_budget = memory_budget_mb * (1 << 20)
+        self.factories = {}
+        self.sizes = {}
+        self.models = OrderedDict()
+        # guards models and build_locks, each model is built under its own
+        # lock so a slow build does not hold up requests for the others
+        self.lock = threading.Lock()
+        self.build_locks = {}
+
+    def register(self, name, factory, model_paths=()):
+        """
+        args:
+            name(str): key the model is requested with
+            factory(callable): builds the model without arguments
+            model_paths(list): files of the model, their size is charged
+                against the memory budget
+        """
+        self.factories[name] = factory
+        self.sizes[name] = sum(os.path.getsize(path) for path in model_paths if os.path.exists(path))
+
+    def get(self, name):
+        model = self.cached(name)
+        if model is not None:
+            return model
+        with self.lock:
+            build_lock = self.build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            # another request may have built it while this one waited
+            model = self.cached(name)
+            if model is not None:
+                return model
+            model = self.factories[name]()
+            with self.lock:
+                self.models[name] = model
+                self.evict()
+            return model
+
+    def cached(self, name):
+        with self.lock:
+            if name not in self.models:
+                return None
+            self.models.move_to_end(name)
+            return self.models[name]
+
+    def evict(self):
+        if not self.memory_budget:
+            return
+        loaded = sum(self.sizes[name] for name in self.models)
+        # the model just built stays even when it alone exceeds the budget
+        while loaded > self.memory_budget and len(self.models) > 1:
+            name, _ = self.models.popitem(last=False)
+            loaded -= self.sizes[name]
+            print('evicted model {}'.format(name))
+
+    def preload(self, names=None):
+        """
+        Build the models in names, by default the ones listed in the
+        PRELOAD_MODELS environment variable.
+        """
+        if names is None:
+            names = [name.strip() for name in os.environ.get('PRELOAD_MODELS', '').split(',') if name.strip()]
+        if '*' in names:
+            names = list(self.factories)
+        for name in names:
+            self.get(name)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self.factories
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        if os.path.isdir(path):
+            model_paths = sorted(glob(os.path.join(path, '**', '*.onnx'), recursive=True))
+        else:
+            model_paths = [path]
+        for model_path in model_paths:
+            if model_path.endswith(OPTIMIZED_MODEL_SUFFIX) or is_model_variant(model_path):
+                continue
+            # optimize the variant the sessions of this host load
+            config = resolve_config(model_path, {})
+            model_path = select_model_variant(model_path, config)
+            if find_optimized_model(model_path, config) is not None:
+                print('optimized model of {} is up to date'.format(model_path))
+                continue
+            print('optimized {} -> {}'.format(model_path, save_optimized_model(model_path, **config)))
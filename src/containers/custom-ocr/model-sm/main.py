@@ -1,14 +1,18 @@
+import bisect
 import copy
 import math
+import threading
 import time
 import os
 
+import cv2
 import numpy as np
-import onnxruntime
 from PIL import Image, ImageDraw
 
-from imaug import create_operators, transform
+from imaug import create_operators, transform, fuse_operators
 from postprocess import build_post_process
+from inference_runtime import create_session
+import request_metrics
 
 
 def draw_ocr_box_txt(image,
@@ -38,6 +42,114 @@ def draw_ocr_box_txt(image,
     img_show = Image.new('RGB', (w, h), (255, 255, 255))
     img_show.paste(img_left, (0, 0, w, h))
     return img_left
+class TextCrop():
+    """
+    A text box of an image that is warped straight into a slot of the
+    classifier or recognizer input at the size that model needs, instead of
+    being cut out at full resolution and resized again by each model.
+    Rotating a crop only changes its orientation flags.
+    """
+
+    max_reduce_factor = 4
+
+    def __init__(self, img, points):
+        self.img = img
+        self.points = np.asarray(points, dtype=np.float32)
+        width = int(
+            max(
+                np.linalg.norm(self.points[0] - self.points[1]),
+                np.linalg.norm(self.points[2] - self.points[3]),
+            )
+        )
+        height = int(
+            max(
+                np.linalg.norm(self.points[0] - self.points[3]),
+                np.linalg.norm(self.points[1] - self.points[2]),
+            )
+        )
+        self.crop_size = (width, height)
+        # tall boxes are read turned by 90 degrees
+        self.rot90 = height * 1.0 / width >= 1.5
+        if self.rot90:
+            width, height = height, width
+        # shape of the crop as an image, used for the aspect ratio
+        self.shape = (height, width, img.shape[2])
+        self.rot180 = False
+        self.border = 0
+
+    def rotate_180(self):
+        rotated = copy.copy(self)
+        rotated.rot180 = not self.rot180
+        return rotated
+
+    def with_border(self, border):
+        """
+        The crop with a white margin of border pixels on each side, as
+        cv2.copyMakeBorder would add to the cut out crop.
+        """
+        bordered = copy.copy(self)
+        bordered.border = self.border + border
+        height, width, channels = self.shape
+        bordered.shape = (height + 2 * border, width + 2 * border, channels)
+        return bordered
+
+    def warp_into(self, out, resized_w):
+        """
+        Warp the box into the first resized_w columns of out, a (C, H, W)
+        float32 slot, normalized to [-1, 1], and zero the rest of the slot.
+        """
+        imgC, imgH, imgW = out.shape
+        assert imgC == self.shape[2]
+        # corners of the box in the upright crop, the rotations flip them
+        # within the same 0..width and 0..height corner coordinates, so a
+        # rotated crop covers the pixels of the unrotated one
+        width, height = self.crop_size
+        dst = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        if self.rot90:
+            dst = np.stack([dst[:, 1], width - dst[:, 0]], axis=1)
+            width, height = height, width
+        if self.rot180:
+            dst = np.stack([width - dst[:, 0], height - dst[:, 1]], axis=1)
+        border = self.border
+        dst = dst + border
+        width, height = width + 2 * border, height + 2 * border
+        if height < imgH:
+            # small text is warped at its own size and scaled up linearly, a
+            # cubic warp straight to the target size costs several times more
+            warp_w, warp_h = width, height
+        else:
+            # large text is warped at an integer multiple of the target size
+            # and area averaged down, a direct warp would alias
+            factor = int(min(height // imgH, self.max_reduce_factor))
+            warp_w, warp_h = resized_w * factor, imgH * factor
+        # map crop pixel centers onto the pixel centers of the warp
+        dst = (dst + 0.5) * np.float32([warp_w / width, warp_h / height]) - 0.5
+        M = cv2.getPerspectiveTransform(self.points, dst.astype(np.float32))
+        warped = cv2.warpPerspective(
+            self.img,
+            M,
+            (warp_w, warp_h),
+            borderMode=cv2.BORDER_REPLICATE,
+            flags=cv2.INTER_CUBIC,
+        )
+        if border:
+            margin_x = int(round(border * warp_w / width))
+            margin_y = int(round(border * warp_h / height))
+            warped[:margin_y] = 255
+            warped[warp_h - margin_y:] = 255
+            warped[:, :margin_x] = 255
+            warped[:, warp_w - margin_x:] = 255
+        if warp_h != imgH:
+            interpolation = cv2.INTER_AREA if warp_h > imgH else cv2.INTER_LINEAR
+            warped = cv2.resize(warped, (resized_w, imgH), interpolation=interpolation)
+        # normalized contiguous and copied once, the slot is a strided view
+        # unless the crop fills its whole width
+        norm_img = warped.transpose((2, 0, 1)).astype(np.float32)
+        norm_img *= np.float32(2. / 255)
+        norm_img -= 1
+        out[:, :, :resized_w] = norm_img
+        out[:, :, resized_w:] = 0
+
 class TextClassifier():
     def __init__(self):
         self.weights_path = os.environ['MODEL_PATH'] + 'classifier.onnx'
@@ -52,10 +164,20 @@ class TextClassifier():
         }
         self.postprocess_op = build_post_process(postprocess_params)
 
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path)
+        self.ort_session = create_session(self.weights_path)
         
     def resize_norm_img(self, img):
         imgC, imgH, imgW = self.cls_image_shape
+        padding_im = np.zeros((imgC, imgH, imgW), dtype=np.float32)
+        self.resize_norm_img_into(img, padding_im)
+        return padding_im
+
+    def resize_norm_img_into(self, img, out):
+        """
+        Resize and normalize img, an image or a TextCrop, into out, a
+        (C, H, W) slot of the input batch.
+        """
+        imgC, imgH, imgW = out.shape
         h = img.shape[0]
         w = img.shape[1]
         ratio = w / float(h)
@@ -63,6 +185,9 @@ class TextClassifier():
             resized_w = imgW
         else:
             resized_w = int(math.ceil(imgH * ratio))
+        if isinstance(img, TextCrop):
+            img.warp_into(out, resized_w)
+            return
         resized_image = np.array(Image.fromarray(img).resize((resized_w, imgH)))
         #resized_image = cv2.resize(img, (resized_w, imgH))
         resized_image = resized_image.astype('float32')
@@ -73,12 +198,17 @@ class TextClassifier():
             resized_image = resized_image.transpose((2, 0, 1)) / 255
         resized_image -= 0.5
         resized_image /= 0.5
-        padding_im = np.zeros((imgC, imgH, imgW), dtype=np.float32)
-        padding_im[:, :, 0:resized_w] = resized_image
-        return padding_im
+        out[:, :, 0:resized_w] = resized_image
+        out[:, :, resized_w:] = 0
+
+    def rotate_180(self, img):
+        if isinstance(img, TextCrop):
+            return img.rotate_180()
+        return np.array(Image.fromarray(img).transpose(Image.ROTATE_180))
 
     def __call__(self, img_list):
-        img_list = copy.deepcopy(img_list)
+        # rotated crops replace their entry, the crops themselves are not copied
+        img_list = list(img_list)
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
         width_list = []
@@ -89,29 +219,23 @@ class TextClassifier():
 
         cls_res = [['', 0.0]] * img_num
         batch_num = self.cls_batch_num
+        imgC, imgH, imgW = self.cls_image_shape
         for beg_img_no in range(0, img_num, batch_num):
             end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
-            max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                norm_img = self.resize_norm_img(img_list[indices[ino]])
-                norm_img = norm_img[np.newaxis, :]
-                norm_img_batch.append(norm_img)
-            norm_img_batch = np.concatenate(norm_img_batch)
-            norm_img_batch = norm_img_batch.copy()
-            starttime = time.time()
+            norm_img_batch = np.empty(
+                (end_img_no - beg_img_no, imgC, imgH, imgW), dtype=np.float32)
+            with request_metrics.stage('cls_preprocess'):
+                for norm_img, ino in zip(norm_img_batch, indices[beg_img_no:end_img_no]):
+                    self.resize_norm_img_into(img_list[ino], norm_img)
             ort_inputs = {self.ort_session.get_inputs()[0].name: norm_img_batch}
             prob_out = self.ort_session.run(None, ort_inputs)[0]
-            cls_result = self.postprocess_op(prob_out)
+            with request_metrics.stage('cls_postprocess'):
+                cls_result = self.postprocess_op(prob_out)
             for rno in range(len(cls_result)):
                 label, score = cls_result[rno]
                 cls_res[indices[beg_img_no + rno]] = [label, score]
                 if '180' in label and score > self.cls_thresh:
-                    img_list[indices[beg_img_no + rno]] = np.array(Image.fromarray(img_list[indices[beg_img_no + rno]]).transpose(Image.ROTATE_180))
+                    img_list[indices[beg_img_no + rno]] = self.rotate_180(img_list[indices[beg_img_no + rno]])
         return img_list, cls_res
 
 class TextDetector():
@@ -149,56 +273,54 @@ class TextDetector():
         postprocess_params["max_candidates"] = 1000
         postprocess_params["unclip_ratio"] = 1.6
         postprocess_params["use_dilation"] = True
+        postprocess_params["num_workers"] = int(os.environ.get('DB_POSTPROCESS_WORKERS', 0))
         self.preprocess_op = create_operators(pre_process_list)
+        if os.environ.get('DET_FUSED_PREPROCESS', 'true').lower() == 'true':
+            # one pass into the input buffer, see DetPreprocess
+            self.preprocess_op = fuse_operators(self.preprocess_op)
         self.postprocess_op = build_post_process(postprocess_params)
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path)
-        _ = self.ort_session.run(None, {"backbone": np.zeros([1, 3, 64, 64], dtype='float32')})
+        self.ort_session = create_session(self.weights_path, warmup_shapes=[[1, 3, 64, 64]])
 
     # load_pytorch_weights
 
-    def order_points_clockwise(self, pts):
+    def order_points_clockwise(self, boxes):
         """
-        reference from: https://github.com/jrosebr1/imutils/blob/master/imutils/perspective.py
-        # sort the points based on their x-coordinates
+        Order the points of every box as top left, top right, bottom right,
+        bottom left: the two left-most points by y, then the two right-most
+        points by y, like https://github.com/jrosebr1/imutils/blob/master/imutils/perspective.py
+        args:
+            boxes(array): boxes with shape [N, 4, 2]
+        return:
+            ordered boxes(array) with shape [N, 4, 2]
         """
-        xSorted = pts[np.argsort(pts[:, 0]), :]
-
-        # grab the left-most and right-most points from the sorted
-        # x-roodinate points
-        leftMost = xSorted[:2, :]
-        rightMost = xSorted[2:, :]
-
-        # now, sort the left-most coordinates according to their
-        # y-coordinates so we can grab the top-left and bottom-left
-        # points, respectively
-        leftMost = leftMost[np.argsort(leftMost[:, 1]), :]
-        (tl, bl) = leftMost
-
-        rightMost = rightMost[np.argsort(rightMost[:, 1]), :]
-        (tr, br) = rightMost
-
-        rect = np.array([tl, tr, br, bl], dtype="float32")
-        return rect
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4, 2)
+        x_sorted = np.take_along_axis(boxes, np.argsort(boxes[:, :, 0], axis=1, kind='stable')[:, :, None], axis=1)
+        left_most, right_most = x_sorted[:, :2], x_sorted[:, 2:]
+        # a stable sort of two points by y only swaps when the first is lower
+        left_swap = left_most[:, 0, 1] > left_most[:, 1, 1]
+        right_swap = right_most[:, 0, 1] > right_most[:, 1, 1]
+        tl = np.where(left_swap[:, None], left_most[:, 1], left_most[:, 0])
+        bl = np.where(left_swap[:, None], left_most[:, 0], left_most[:, 1])
+        tr = np.where(right_swap[:, None], right_most[:, 1], right_most[:, 0])
+        br = np.where(right_swap[:, None], right_most[:, 0], right_most[:, 1])
+        return np.stack([tl, tr, br, bl], axis=1)
 
     def clip_det_res(self, points, img_height, img_width):
-        for pno in range(points.shape[0]):
-            points[pno, 0] = int(min(max(points[pno, 0], 0), img_width - 1))
-            points[pno, 1] = int(min(max(points[pno, 1], 0), img_height - 1))
-        return points
+        """
+        Clip the points, of shape [..., 2], to the image and round them down
+        to whole pixels.
+        """
+        points = np.asarray(points)
+        clipped = np.floor(np.clip(points, 0, [img_width - 1, img_height - 1]))
+        return clipped.astype(points.dtype, copy=False)
 
     def filter_tag_det_res(self, dt_boxes, image_shape):
         img_height, img_width = image_shape[0:2]
-        dt_boxes_new = []
-        for box in dt_boxes:
-            box = self.order_points_clockwise(box)
-            box = self.clip_det_res(box, img_height, img_width)
-            rect_width = int(np.linalg.norm(box[0] - box[1]))
-            rect_height = int(np.linalg.norm(box[0] - box[3]))
-            if rect_width <= 3 or rect_height <= 3:
-                continue
-            dt_boxes_new.append(box)
-        dt_boxes = np.array(dt_boxes_new)
-        return dt_boxes
+        dt_boxes = self.order_points_clockwise(dt_boxes)
+        dt_boxes = self.clip_det_res(dt_boxes, img_height, img_width)
+        rect_width = np.linalg.norm(dt_boxes[:, 0] - dt_boxes[:, 1], axis=1).astype(np.int64)
+        rect_height = np.linalg.norm(dt_boxes[:, 0] - dt_boxes[:, 3], axis=1).astype(np.int64)
+        return dt_boxes[(rect_width > 3) & (rect_height > 3)]
 
     def filter_tag_det_res_only_clip(self, dt_boxes, image_shape):
         img_height, img_width = image_shape[0:2]
@@ -211,24 +333,26 @@ class TextDetector():
 
     def __call__(self, img):
         ori_im = img.copy()
-        data = {'image': img}
-        data = transform(data, self.preprocess_op)
+        with request_metrics.stage('det_preprocess'):
+            data = {'image': img}
+            data = transform(data, self.preprocess_op)
         img, shape_list = data
         if img is None:
             return None, 0
         img = np.expand_dims(img, axis=0)
         shape_list = np.expand_dims(shape_list, axis=0)
-        img = img.copy()
+        img = np.ascontiguousarray(img)
         ort_inputs = {self.ort_session.get_inputs()[0].name: img}
         preds = {}
-        preds['maps'] = self.ort_session.run(None, ort_inputs)[0]
-
-        post_result = self.postprocess_op(preds, shape_list)
-        dt_boxes = post_result[0]['points']
-        if self.det_algorithm == "SAST" and self.det_sast_polygon:
-            dt_boxes = self.filter_tag_det_res_only_clip(dt_boxes, ori_im.shape)
-        else:
-            dt_boxes = self.filter_tag_det_res(dt_boxes, ori_im.shape)
+        preds['maps'] = self.ort_session.run_bound(None, ort_inputs)[0]
+
+        with request_metrics.stage('det_postprocess'):
+            post_result = self.postprocess_op(preds, shape_list)
+            dt_boxes = post_result[0]['points']
+            if self.det_algorithm == "SAST" and self.det_sast_polygon:
+                dt_boxes = self.filter_tag_det_res_only_clip(dt_boxes, ori_im.shape)
+            else:
+                dt_boxes = self.filter_tag_det_res(dt_boxes, ori_im.shape)
         return dt_boxes
 
 class TextRecognizer():
@@ -241,7 +365,12 @@ class TextRecognizer():
 
         self.rec_image_shape = [3, 32, 320]
         self.character_type = 'ch'
-        self.rec_batch_num = 6
+        # crops sorted by aspect ratio are cut into batches of one width
+        # bucket padded to the bucket width, so a crop is recognized the same
+        # whatever it is batched with, a batch is also closed before its
+        # padded size exceeds rec_batch_pixels
+        self.rec_width_buckets = [320, 384, 512, 768, 1024, 1280]
+        self.rec_batch_pixels = int(os.environ.get('REC_BATCH_PIXELS', 6 * 32 * 1280))
         self.rec_algorithm = 'CRNN'
         self.use_zero_copy_run = False
         postprocess_params = {
@@ -251,15 +380,30 @@ class TextRecognizer():
             "use_space_char": True
         }
         self.postprocess_op = build_post_process(postprocess_params)
+        # per thread input buffer reused by batch_buffer
+        self.local = threading.local()
 
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path)
-        _ = self.ort_session.run(None, {"backbone": np.zeros([1, 3, 32, 64], dtype='float32')})
+        self.ort_session = create_session(self.weights_path, warmup_shapes=[[1, 3, 32, 64]])
+
+    def padded_width(self, wh_ratio):
+        """ width a crop with aspect ratio wh_ratio is padded to """
+        imgC, imgH, imgW = self.rec_image_shape
+        wh_ratio = max(wh_ratio, imgW / imgH)
+        imgW = int((32 * wh_ratio))
+        return max(min(imgW, self.limited_max_width), self.limited_min_width)
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
-        max_wh_ratio = max(max_wh_ratio, imgW / imgH)
-        imgW = int((32 * max_wh_ratio))
-        imgW = max(min(imgW, self.limited_max_width), self.limited_min_width)
+        padding_im = np.zeros((imgC, imgH, self.padded_width(max_wh_ratio)), dtype=np.float32)
+        self.resize_norm_img_into(img, padding_im)
+        return padding_im
+
+    def resize_norm_img_into(self, img, out):
+        """
+        Resize and normalize img, an image or a TextCrop, into out, a
+        (C, H, W) slot of the input batch, and zero the padding on its right.
+        """
+        imgC, imgH, imgW = out.shape
         h, w = img.shape[:2]
         ratio = w / float(h)
         ratio_imgH = math.ceil(imgH * ratio)
@@ -268,49 +412,74 @@ class TextRecognizer():
             resized_w = imgW
         else:
             resized_w = int(math.ceil(imgH * ratio))
+        if isinstance(img, TextCrop):
+            img.warp_into(out, resized_w)
+            return
         resized_image = np.array(Image.fromarray(img).resize((resized_w, imgH)))
         #resized_image = cv2.resize(img, (resized_w, imgH))
         resized_image = resized_image.astype('float32')
         resized_image = resized_image.transpose((2, 0, 1)) / 255
         resized_image -= 0.5
         resized_image /= 0.5
-        padding_im = np.zeros((imgC, imgH, imgW), dtype=np.float32)
-        padding_im[:, :, 0:resized_w] = resized_image
-        return padding_im
+        out[:, :, :resized_w] = resized_image
+        out[:, :, resized_w:] = 0
+
+    def bucket_width(self, wh_ratio):
+        """ width the batch of a crop with aspect ratio wh_ratio is padded to """
+        width = self.padded_width(wh_ratio)
+        bucket = bisect.bisect_left(self.rec_width_buckets, width)
+        if bucket == len(self.rec_width_buckets):
+            return width
+        return min(self.rec_width_buckets[bucket], self.limited_max_width)
+
+    def rec_batches(self, img_list):
+        """
+        Group the crops, sorted by aspect ratio, into batches.
+        return:
+            list of (crop indices, padded width), one entry per batch
+        """
+        imgC, imgH, imgW = self.rec_image_shape
+        wh_ratios = np.array([img.shape[1] / float(img.shape[0]) for img in img_list])
+        batches = []
+        batch = []
+        batch_width = None
+        for ino in np.argsort(wh_ratios):
+            width = self.bucket_width(wh_ratios[ino])
+            if batch and (width != batch_width or
+                          (len(batch) + 1) * imgH * width > self.rec_batch_pixels):
+                batches.append((batch, batch_width))
+                batch = []
+            batch_width = width
+            batch.append(ino)
+        if batch:
+            batches.append((batch, batch_width))
+        return batches
+
+    def batch_buffer(self, batch_size, width):
+        """
+        (batch_size, C, H, width) float32 view of this thread's input buffer,
+        the buffer only grows when a single crop is wider than the budget.
+        """
+        imgC, imgH, imgW = self.rec_image_shape
+        size = batch_size * imgC * imgH * width
+        buffer = getattr(self.local, 'batch', None)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(max(size, imgC * self.rec_batch_pixels), dtype=np.float32)
+            self.local.batch = buffer
+        return buffer[:size].reshape(batch_size, imgC, imgH, width)
 
     def __call__(self, img_list):
-        img_num = len(img_list)
-        # Calculate the aspect ratio of all text bars
-        width_list = []
-        for img in img_list:
-            width_list.append(img.shape[1] / float(img.shape[0]))
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
-
-        # rec_res = []
-        rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
-            max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                # h, w = img_list[ino].shape[0:2]
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                # norm_img = self.resize_norm_img(img_list[ino], max_wh_ratio)
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
-                norm_img = norm_img[np.newaxis, :]
-                norm_img_batch.append(norm_img)
-            norm_img_batch = np.concatenate(norm_img_batch)
-            norm_img_batch = norm_img_batch.copy()
+        rec_res = [['', 0.0]] * len(img_list)
+        for indices, width in self.rec_batches(img_list):
+            norm_img_batch = self.batch_buffer(len(indices), width)
+            with request_metrics.stage('rec_preprocess'):
+                for norm_img, ino in zip(norm_img_batch, indices):
+                    self.resize_norm_img_into(img_list[ino], norm_img)
             ort_inputs = {self.ort_session.get_inputs()[0].name: norm_img_batch}
-            preds = self.ort_session.run(None, ort_inputs)[0]
+            preds = self.ort_session.run_bound(None, ort_inputs)[0]
 
-            rec_result = self.postprocess_op(preds)
-            for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+            with request_metrics.stage('rec_postprocess'):
+                rec_result = self.postprocess_op(preds)
+            for ino, result in zip(indices, rec_result):
+                rec_res[ino] = result
         return rec_res
\ No newline at end of file
@@ -41,34 +41,34 @@ class BaseRecLabelDecode(object):
         for i, char in enumerate(dict_character):
             self.dict[char] = i
         self.character = dict_character
+        self.character_array = np.array(dict_character, dtype=object)
 
     def add_special_char(self, dict_character):
         return dict_character
 
     def decode(self, text_index, text_prob=None, is_remove_duplicate=True):
-        """ convert text-index into text-label. """
+        """
+        convert text-index into text-label, the (batch, T) index matrix is
+        masked as a whole instead of step by step.
+        """
+        text_index = np.asarray(text_index)
+        # True for the steps that emit a character
+        keep = ~np.isin(text_index, self.get_ignored_tokens())
+        if is_remove_duplicate:
+            # only for predict
+            keep[:, 1:] &= text_index[:, 1:] != text_index[:, :-1]
+        char_count = keep.sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            # lines without characters get nan, as np.mean of an empty list
+            if text_prob is not None:
+                text_prob = np.asarray(text_prob)
+                conf = np.where(keep, text_prob, 0).sum(axis=1) / char_count.astype(text_prob.dtype)
+            else:
+                conf = char_count / char_count
         result_list = []
-        ignored_tokens = self.get_ignored_tokens()
-        batch_size = len(text_index)
-        for batch_idx in range(batch_size):
-            char_list = []
-            conf_list = []
-            for idx in range(len(text_index[batch_idx])):
-                if text_index[batch_idx][idx] in ignored_tokens:
-                    continue
-                if is_remove_duplicate:
-                    # only for predict
-                    if idx > 0 and text_index[batch_idx][idx - 1] == text_index[
-                            batch_idx][idx]:
-                        continue
-                char_list.append(self.character[int(text_index[batch_idx][
-                    idx])])
-                if text_prob is not None:
-                    conf_list.append(text_prob[batch_idx][idx])
-                else:
-                    conf_list.append(1)
-            text = ''.join(char_list)
-            result_list.append((text, np.mean(conf_list)))
+        for batch_idx in range(len(text_index)):
+            text = ''.join(self.character_array[text_index[batch_idx][keep[batch_idx]]])
+            result_list.append((text, conf[batch_idx]))
         return result_list
 
     def get_ignored_tokens(self):
@@ -2,6 +2,7 @@ import json
 import os
 import main
 from aikits_utils import readimg, lambda_return
+import request_metrics
 
 model_path = os.environ['MODEL_PATH']
 model = main.SCRFD(model_file = model_path + 'det.onnx')
@@ -19,6 +20,7 @@ def read_img(body):
             return str(k)
     return img
 
+@request_metrics.instrument('face-comparison')
 def handler(event, context):
     if 'body' not in event:
         return lambda_return(400, 'invalid param')
@@ -52,9 +54,10 @@ def handler(event, context):
         face.update(face_hash=face_hash)
         face_list.append(face)
 
-    output = {
-        "Faces": face_list,
-        "FaceModelVersion": "1.2.0"
-    }
+    with request_metrics.stage('serialize'):
+        output = {
+            "Faces": face_list,
+            "FaceModelVersion": "1.2.0"
+        }
 
-    return lambda_return(200, json.dumps(output))
\ No newline at end of file
+        return lambda_return(200, json.dumps(output))
\ No newline at end of file
@@ -1,6 +1,5 @@
 import datetime
 import numpy as np
-import onnxruntime
 import os
 import os.path as osp
 import cv2
@@ -9,10 +8,8 @@ import pickle
 import face_align
 import transform
 
-import GPUtil
-cuda_available = True if len(GPUtil.getGPUs()) else False
-if cuda_available:
-    print(GPUtil.getGPUs()[0].name)
+from inference_runtime import create_session
+import request_metrics
 
 def softmax(z):
     assert len(z.shape) == 2
@@ -70,7 +67,7 @@ class RetinaFace:
         self.model_file = model_file
         self.session = session
         self.taskname = 'detection'
-        self.session = onnxruntime.InferenceSession(self.model_file, providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+        self.session = create_session(self.model_file)
         self.center_cache = {}
         self.nms_thresh = 0.4
         self.det_thresh = 0.5
@@ -109,7 +106,7 @@ class RetinaFace:
         kpss_list = []
         input_size = tuple(img.shape[0:2][::-1])
         blob = cv2.dnn.blobFromImage(img, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
-        net_outs = self.session.run(self.output_names, {self.input_name : blob})
+        net_outs = self.session.run_bound(self.output_names, {self.input_name : blob})
 
         input_height = blob.shape[2]
         input_width = blob.shape[3]
@@ -255,7 +252,7 @@ class Landmark:
         self.model_file = model_file
         self.input_mean = 0.0
         self.input_std = 1.0
-        self.session = onnxruntime.InferenceSession(self.model_file, providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+        self.session = create_session(self.model_file)
         input_cfg = self.session.get_inputs()[0]
         input_shape = input_cfg.shape
         input_name = input_cfg.name
@@ -279,29 +276,31 @@ class Landmark:
             self.lmk_num = output_shape[1]//self.lmk_dim
         
     def get(self, img, bbox):
-        w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
-        center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
-        rotate = 0
-        _scale = self.input_size[0]  / (max(w, h)*1.5)
-        #print('param:', img.shape, bbox, center, self.input_size, _scale, rotate)
-        aimg, M = face_align.transform(img, center, self.input_size[0], _scale, rotate)
-        input_size = tuple(aimg.shape[0:2][::-1])
-        #assert input_size==self.input_size
-        blob = cv2.dnn.blobFromImage(aimg, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
+        with request_metrics.stage('landmark_preprocess'):
+            w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
+            center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
+            rotate = 0
+            _scale = self.input_size[0]  / (max(w, h)*1.5)
+            #print('param:', img.shape, bbox, center, self.input_size, _scale, rotate)
+            aimg, M = face_align.transform(img, center, self.input_size[0], _scale, rotate)
+            input_size = tuple(aimg.shape[0:2][::-1])
+            #assert input_size==self.input_size
+            blob = cv2.dnn.blobFromImage(aimg, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
         pred = self.session.run(self.output_names, {self.input_name : blob})[0][0]
-        if pred.shape[0] >= 3000:
-            pred = pred.reshape((-1, 3))
-        else:
-            pred = pred.reshape((-1, 2))
-        if self.lmk_num < pred.shape[0]:
-            pred = pred[self.lmk_num*-1:,:]
-        pred[:, 0:2] += 1
-        pred[:, 0:2] *= (self.input_size[0] // 2)
-        if pred.shape[1] == 3:
-            pred[:, 2] *= (self.input_size[0] // 2)
-
-        IM = cv2.invertAffineTransform(M)
-        pred = face_align.trans_points(pred, IM)
+        with request_metrics.stage('landmark_postprocess'):
+            if pred.shape[0] >= 3000:
+                pred = pred.reshape((-1, 3))
+            else:
+                pred = pred.reshape((-1, 2))
+            if self.lmk_num < pred.shape[0]:
+                pred = pred[self.lmk_num*-1:,:]
+            pred[:, 0:2] += 1
+            pred[:, 0:2] *= (self.input_size[0] // 2)
+            if pred.shape[1] == 3:
+                pred[:, 2] *= (self.input_size[0] // 2)
+
+            IM = cv2.invertAffineTransform(M)
+            pred = face_align.trans_points(pred, IM)
         if self.require_pose:
             P = transform.estimate_affine_matrix_3d23d(self.mean_lmk, pred)
             s, R, t = transform.P2sRt(P)
@@ -317,7 +316,7 @@ class Attribute:
         self.model_file = model_file
         self.input_mean = 0.0
         self.input_std = 1.0
-        self.session = onnxruntime.InferenceSession(self.model_file, providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+        self.session = create_session(self.model_file)
         input_cfg = self.session.get_inputs()[0]
         input_shape = input_cfg.shape
         input_name = input_cfg.name
@@ -342,26 +341,28 @@ class Attribute:
             'Emotions': ['HAPPY', 'SURPRISED', 'FEAR', 'SAD', 'CALM', 'DISGUSTED', 'ANGRY', 'CONFUSED']
         }
     def get(self, img, bbox):
-        w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
-        center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
-        rotate = 0
-        _scale = self.input_size[0]  / (max(w, h)*1.1)
-        aimg, M = face_align.transform(img, center, self.input_size[0], _scale, rotate)
-        input_size = tuple(aimg.shape[0:2][::-1])
+        with request_metrics.stage('attribute_preprocess'):
+            w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
+            center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
+            rotate = 0
+            _scale = self.input_size[0]  / (max(w, h)*1.1)
+            aimg, M = face_align.transform(img, center, self.input_size[0], _scale, rotate)
+            input_size = tuple(aimg.shape[0:2][::-1])
        
-        blob = cv2.dnn.blobFromImage(aimg, None, input_size, None, swapRB=True)/255
+            blob = cv2.dnn.blobFromImage(aimg, None, input_size, None, swapRB=True)/255
         pred = self.session.run(self.output_names, {self.input_name : blob})
-        rlt = {}
-        for i in range(len(self.output_names)):
-            if self.output_names[i] != 'AgeRange':
-                score = softmax(pred[i])
-                rlt[self.output_names[i]] = (
-                    self.label_map[self.output_names[i]][np.argmax(score, axis=1)[0]],
-                    int(np.round(np.max(score)*100, 3))
-                )
-            else:
-                age_range = (pred[i]*100).astype('uint8')[0]
-                rlt[self.output_names[i]] = (age_range[0], age_range[1])
+        with request_metrics.stage('attribute_postprocess'):
+            rlt = {}
+            for i in range(len(self.output_names)):
+                if self.output_names[i] != 'AgeRange':
+                    score = softmax(pred[i])
+                    rlt[self.output_names[i]] = (
+                        self.label_map[self.output_names[i]][np.argmax(score, axis=1)[0]],
+                        int(np.round(np.max(score)*100, 3))
+                    )
+                else:
+                    age_range = (pred[i]*100).astype('uint8')[0]
+                    rlt[self.output_names[i]] = (age_range[0], age_range[1])
         return rlt
     
 class ArcFaceONNX:
@@ -371,7 +372,7 @@ class ArcFaceONNX:
         self.taskname = 'recognition'
         self.input_mean = 0.0
         self.input_std = 1.0
-        self.session = onnxruntime.InferenceSession(self.model_file, providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+        self.session = create_session(self.model_file)
         input_cfg = self.session.get_inputs()[0]
         input_shape = input_cfg.shape
         input_name = input_cfg.name
@@ -387,7 +388,8 @@ class ArcFaceONNX:
         self.output_shape = outputs[0].shape
 
     def get(self, img, kps):
-        aimg = face_align.norm_crop(img, landmark=kps)
+        with request_metrics.stage('embed_preprocess'):
+            aimg = face_align.norm_crop(img, landmark=kps)
         return self.get_feat(aimg).flatten()
 
     def get_feat(self, imgs):
@@ -395,10 +397,12 @@ class ArcFaceONNX:
             imgs = [imgs]
         input_size = self.input_size
         
-        blob = cv2.dnn.blobFromImages(imgs, 1.0 / self.input_std, input_size,
-                                      (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
-        net_out = self.session.run(self.output_names, {self.input_name: blob})[0]
-        return net_out
+        with request_metrics.stage('embed_preprocess'):
+            blob = cv2.dnn.blobFromImages(imgs, 1.0 / self.input_std, input_size,
+                                          (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
+        net_out = self.session.run_bound(self.output_names, {self.input_name: blob})[0]
+        # the bound output is overwritten by the next run of the same shape
+        return net_out.copy()
 
 class SCRFD:
     def __init__(self, model_file=None, session=None):
@@ -409,7 +413,7 @@ class SCRFD:
         if self.session is None:
             assert self.model_file is not None
             assert osp.exists(self.model_file)
-            self.session = onnxruntime.InferenceSession(self.model_file, providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+            self.session = create_session(self.model_file)
         self.center_cache = {}
         self.nms_thresh = 0.4
         self.det_thresh = 0.5
@@ -481,125 +485,129 @@ class SCRFD:
         bboxes_list = []
         kpss_list = []
         input_size = tuple(img.shape[0:2][::-1])
-        blob = cv2.dnn.blobFromImage(img, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
-        net_outs = self.session.run(self.output_names, {self.input_name : blob})
-
-        input_height = blob.shape[2]
-        input_width = blob.shape[3]
-        fmc = self.fmc
-        for idx, stride in enumerate(self._feat_stride_fpn):
-            # If model support batch dim, take first output
-            if self.batched:
-                scores = net_outs[idx][0]
-                bbox_preds = net_outs[idx + fmc][0]
-                bbox_preds = bbox_preds * stride
-                if self.use_kps:
-                    kps_preds = net_outs[idx + fmc * 2][0] * stride
-            # If model doesn't support batching take output as is
-            else:
-                scores = net_outs[idx]
-                bbox_preds = net_outs[idx + fmc]
-                bbox_preds = bbox_preds * stride
+        with request_metrics.stage('det_preprocess'):
+            blob = cv2.dnn.blobFromImage(img, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
+        net_outs = self.session.run_bound(self.output_names, {self.input_name : blob})
+
+        with request_metrics.stage('det_postprocess'):
+            input_height = blob.shape[2]
+            input_width = blob.shape[3]
+            fmc = self.fmc
+            for idx, stride in enumerate(self._feat_stride_fpn):
+                # If model support batch dim, take first output
+                if self.batched:
+                    scores = net_outs[idx][0]
+                    bbox_preds = net_outs[idx + fmc][0]
+                    bbox_preds = bbox_preds * stride
+                    if self.use_kps:
+                        kps_preds = net_outs[idx + fmc * 2][0] * stride
+                # If model doesn't support batching take output as is
+                else:
+                    scores = net_outs[idx]
+                    bbox_preds = net_outs[idx + fmc]
+                    bbox_preds = bbox_preds * stride
+                    if self.use_kps:
+                        kps_preds = net_outs[idx + fmc * 2] * stride
+                height = input_height // stride
+                width = input_width // stride
+                K = height * width
+                key = (height, width, stride)
+                if key in self.center_cache:
+                    anchor_centers = self.center_cache[key]
+                else:
+                    #solution-1, c style:
+                    #anchor_centers = np.zeros( (height, width, 2), dtype=np.float32 )
+                    #for i in range(height):
+                    #    anchor_centers[i, :, 1] = i
+                    #for i in range(width):
+                    #    anchor_centers[:, i, 0] = i
+
+                    #solution-2:
+                    #ax = np.arange(width, dtype=np.float32)
+                    #ay = np.arange(height, dtype=np.float32)
+                    #xv, yv = np.meshgrid(np.arange(width), np.arange(height))
+                    #anchor_centers = np.stack([xv, yv], axis=-1).astype(np.float32)
+
+                    #solution-3:
+                    anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+                    #print(anchor_centers.shape)
+
+                    anchor_centers = (anchor_centers * stride).reshape( (-1, 2) )
+                    if self._num_anchors>1:
+                        anchor_centers = np.stack([anchor_centers]*self._num_anchors, axis=1).reshape( (-1,2) )
+                    if len(self.center_cache)<100:
+                        self.center_cache[key] = anchor_centers
+
+                pos_inds = np.where(scores>=threshold)[0]
+                bboxes = distance2bbox(anchor_centers, bbox_preds)
+                pos_scores = scores[pos_inds]
+                pos_bboxes = bboxes[pos_inds]
+                scores_list.append(pos_scores)
+                bboxes_list.append(pos_bboxes)
+                #print(anchor_centers.shape, kps_preds.shape)
                 if self.use_kps:
-                    kps_preds = net_outs[idx + fmc * 2] * stride
-            height = input_height // stride
-            width = input_width // stride
-            K = height * width
-            key = (height, width, stride)
-            if key in self.center_cache:
-                anchor_centers = self.center_cache[key]
-            else:
-                #solution-1, c style:
-                #anchor_centers = np.zeros( (height, width, 2), dtype=np.float32 )
-                #for i in range(height):
-                #    anchor_centers[i, :, 1] = i
-                #for i in range(width):
-                #    anchor_centers[:, i, 0] = i
-
-                #solution-2:
-                #ax = np.arange(width, dtype=np.float32)
-                #ay = np.arange(height, dtype=np.float32)
-                #xv, yv = np.meshgrid(np.arange(width), np.arange(height))
-                #anchor_centers = np.stack([xv, yv], axis=-1).astype(np.float32)
-
-                #solution-3:
-                anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
-                #print(anchor_centers.shape)
-
-                anchor_centers = (anchor_centers * stride).reshape( (-1, 2) )
-                if self._num_anchors>1:
-                    anchor_centers = np.stack([anchor_centers]*self._num_anchors, axis=1).reshape( (-1,2) )
-                if len(self.center_cache)<100:
-                    self.center_cache[key] = anchor_centers
-
-            pos_inds = np.where(scores>=threshold)[0]
-            bboxes = distance2bbox(anchor_centers, bbox_preds)
-            pos_scores = scores[pos_inds]
-            pos_bboxes = bboxes[pos_inds]
-            scores_list.append(pos_scores)
-            bboxes_list.append(pos_bboxes)
-            #print(anchor_centers.shape, kps_preds.shape)
-            if self.use_kps:
-                kpss = distance2kps(anchor_centers, kps_preds)
-                #kpss = kps_preds
-                kpss = kpss.reshape( (kpss.shape[0], -1, 2) )
-                pos_kpss = kpss[pos_inds]
-                kpss_list.append(pos_kpss)
+                    kpss = distance2kps(anchor_centers, kps_preds)
+                    #kpss = kps_preds
+                    kpss = kpss.reshape( (kpss.shape[0], -1, 2) )
+                    pos_kpss = kpss[pos_inds]
+                    kpss_list.append(pos_kpss)
         return scores_list, bboxes_list, kpss_list
 
     def detect(self, img, input_size = None, max_num=0, metric='default'):
         assert input_size is not None or self.input_size is not None
         input_size = self.input_size if input_size is None else input_size
             
-        im_ratio = float(img.shape[0]) / img.shape[1]
-        model_ratio = float(input_size[1]) / input_size[0]
-        if im_ratio>model_ratio:
-            new_height = input_size[1]
-            new_width = int(new_height / im_ratio)
-        else:
-            new_width = input_size[0]
-            new_height = int(new_width * im_ratio)
-        det_scale = float(new_height) / img.shape[0]
-        resized_img = cv2.resize(img, (new_width, new_height))
-        det_img = np.zeros( (input_size[1], input_size[0], 3), dtype=np.uint8 )
-        det_img[:new_height, :new_width, :] = resized_img
+        with request_metrics.stage('det_preprocess'):
+            im_ratio = float(img.shape[0]) / img.shape[1]
+            model_ratio = float(input_size[1]) / input_size[0]
+            if im_ratio>model_ratio:
+                new_height = input_size[1]
+                new_width = int(new_height / im_ratio)
+            else:
+                new_width = input_size[0]
+                new_height = int(new_width * im_ratio)
+            det_scale = float(new_height) / img.shape[0]
+            resized_img = cv2.resize(img, (new_width, new_height))
+            det_img = np.zeros( (input_size[1], input_size[0], 3), dtype=np.uint8 )
+            det_img[:new_height, :new_width, :] = resized_img
 
         scores_list, bboxes_list, kpss_list = self.forward(det_img, self.det_thresh)
 
-        scores = np.vstack(scores_list)
-        scores_ravel = scores.ravel()
-        order = scores_ravel.argsort()[::-1]
-        bboxes = np.vstack(bboxes_list) / det_scale
-        if self.use_kps:
-            kpss = np.vstack(kpss_list) / det_scale
-        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)
-        pre_det = pre_det[order, :]
-        keep = self.nms(pre_det)
-        det = pre_det[keep, :]
-        if self.use_kps:
-            kpss = kpss[order,:,:]
-            kpss = kpss[keep,:,:]
-        else:
-            kpss = None
-        if max_num > 0 and det.shape[0] > max_num:
-            area = (det[:, 2] - det[:, 0]) * (det[:, 3] -
-                                                    det[:, 1])
-            img_center = img.shape[0] // 2, img.shape[1] // 2
-            offsets = np.vstack([
-                (det[:, 0] + det[:, 2]) / 2 - img_center[1],
-                (det[:, 1] + det[:, 3]) / 2 - img_center[0]
-            ])
-            offset_dist_squared = np.sum(np.power(offsets, 2.0), 0)
-            if metric=='max':
-                values = area
+        with request_metrics.stage('det_postprocess'):
+            scores = np.vstack(scores_list)
+            scores_ravel = scores.ravel()
+            order = scores_ravel.argsort()[::-1]
+            bboxes = np.vstack(bboxes_list) / det_scale
+            if self.use_kps:
+                kpss = np.vstack(kpss_list) / det_scale
+            pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)
+            pre_det = pre_det[order, :]
+            keep = self.nms(pre_det)
+            det = pre_det[keep, :]
+            if self.use_kps:
+                kpss = kpss[order,:,:]
+                kpss = kpss[keep,:,:]
             else:
-                values = area - offset_dist_squared * 2.0  # some extra weight on the centering
-            bindex = np.argsort(
-                values)[::-1]  # some extra weight on the centering
-            bindex = bindex[0:max_num]
-            det = det[bindex, :]
-            if kpss is not None:
-                kpss = kpss[bindex, :]
+                kpss = None
+            if max_num > 0 and det.shape[0] > max_num:
+                area = (det[:, 2] - det[:, 0]) * (det[:, 3] -
+                                                        det[:, 1])
+                img_center = img.shape[0] // 2, img.shape[1] // 2
+                offsets = np.vstack([
+                    (det[:, 0] + det[:, 2]) / 2 - img_center[1],
+                    (det[:, 1] + det[:, 3]) / 2 - img_center[0]
+                ])
+                offset_dist_squared = np.sum(np.power(offsets, 2.0), 0)
+                if metric=='max':
+                    values = area
+                else:
+                    values = area - offset_dist_squared * 2.0  # some extra weight on the centering
+                bindex = np.argsort(
+                    values)[::-1]  # some extra weight on the centering
+                bindex = bindex[0:max_num]
+                det = det[bindex, :]
+                if kpss is not None:
+                    kpss = kpss[bindex, :]
         return det, kpss
 
     def nms(self, dets):
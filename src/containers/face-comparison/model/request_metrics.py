@@ -0,0 +1,218 @@
+"""
+Per-request stage timings. The same file is copied into every model
+container. Handlers are wrapped with instrument, code along the way records
+its stages with
+
+    with request_metrics.stage('postprocess'):
+        ...
+
+readimg of aikits_utils records the fetch and decode stages and the sessions
+built by inference_runtime.create_session record every run as
+run:<model name>. Stages may nest, so they do not add up to the total stage.
+
+The stages of each request are
+- printed as a CloudWatch embedded metric format line when METRICS_EMF is true
+- added to the histograms served by the /metrics/prometheus route of the
+  SageMaker servers
+- returned in the response, in milliseconds, when the request has
+  "metrics": true
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import environ
+
+METRICS_EMF = environ.get('METRICS_EMF', 'false').lower() == 'true'
+METRICS_NAMESPACE = environ.get('METRICS_NAMESPACE', 'AISolutionKit')
+# upper bounds in seconds of the Prometheus histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# contextvars follow gevent greenlets, so concurrent requests of the
+# SageMaker server do not mix up their stages
+current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics(object):
+    """ Stage durations of one request, a stage recorded twice adds up """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        """
+        return:
+            dict from stage name to milliseconds
+        """
+        with self.lock:
+            return OrderedDict((name, round(seconds * 1000, 3)) for name, seconds in self.stages.items())
+
+
+class StageHistograms(object):
+    """ Cumulative stage durations of all requests, per handler """
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = {}
+        self.sums = {}
+        self.lock = threading.Lock()
+
+    def observe(self, handler, stages):
+        with self.lock:
+            for name, seconds in stages.items():
+                key = (handler, name)
+                if key not in self.counts:
+                    self.counts[key] = [0] * (len(self.buckets) + 1)
+                    self.sums[key] = 0.0
+                counts = self.counts[key]
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        counts[i] += 1
+                counts[-1] += 1
+                self.sums[key] += seconds
+
+    def to_prometheus(self):
+        """
+        return:
+            the histograms in the Prometheus text exposition format
+        """
+        lines = [
+            '# HELP request_stage_seconds Duration of the stages of a request',
+            '# TYPE request_stage_seconds histogram',
+        ]
+        with self.lock:
+            for (handler, name), counts in sorted(self.counts.items()):
+                labels = 'handler="{}",stage="{}"'.format(handler, name)
+                for bound, count in zip(self.buckets, counts):
+                    lines.append('request_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append('request_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, counts[-1]))
+                lines.append('request_stage_seconds_sum{{{}}} {}'.format(labels, self.sums[(handler, name)]))
+                lines.append('request_stage_seconds_count{{{}}} {}'.format(labels, counts[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+histograms = StageHistograms()
+
+
+def record(name, seconds):
+    """ Add seconds to a stage of the current request, if any """
+    metrics = current.get()
+    if metrics is not None:
+        metrics.record(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """ Time the enclosed block as a stage of the current request """
+    metrics = current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(name, time.perf_counter() - start)
+
+
+def propagate(fn):
+    """
+    Bind fn to the current request, for work handed to a thread pool whose
+    threads do not share the context of the caller.
+    """
+    metrics = current.get()
+
+    def run(*args, **kwargs):
+        token = current.set(metrics)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current.reset(token)
+    return run
+
+
+def emit(handler, metrics):
+    stages = OrderedDict((name, seconds) for name, seconds in metrics.stages.items())
+    histograms.observe(handler, stages)
+    if METRICS_EMF:
+        line = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['Handler']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in stages],
+                }],
+            },
+            'Handler': handler,
+        }
+        line.update(metrics.to_dict())
+        print(json.dumps(line))
+
+
+def requested(event):
+    """ Whether the request body of a handler event asks for "metrics" """
+    if not isinstance(event, dict):
+        return False
+    body = event.get('body')
+    if isinstance(body, str):
+        if '"metrics"' not in body:
+            return False
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return False
+    return isinstance(body, dict) and body.get('metrics') is True
+
+
+def attach(response, metrics):
+    """
+    Add the stages to a JSON handler response, as a metrics field of object
+    results or as a trailing {"metrics": ...} entry of list results, like
+    the duration of the OCR handlers.
+    """
+    if not isinstance(response, dict) or response.get('statusCode') != 200 or not isinstance(response.get('body'), str):
+        return response
+    result = json.loads(response['body'])
+    if isinstance(result, dict):
+        result['metrics'] = metrics.to_dict()
+    elif isinstance(result, list):
+        result.append({'metrics': metrics.to_dict()})
+    else:
+        return response
+    response = dict(response)
+    response['body'] = json.dumps(result)
+    return response
+
+
+def instrument(handler):
+    """
+    Decorator recording the stages of each call of a request handler under
+    the name handler, see the module docstring. The total stage is the
+    whole call.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            metrics = RequestMetrics()
+            token = current.set(metrics)
+            start = time.perf_counter()
+            try:
+                response = fn(*args, **kwargs)
+            finally:
+                current.reset(token)
+                metrics.record('total', time.perf_counter() - start)
+                emit(handler, metrics)
+            if args and requested(args[0]):
+                response = attach(response, metrics)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+"""
+Pre-fork worker processes for the SageMaker servers. The same file is copied
+into every container with a SageMaker image. With SERVER_WORKERS greater than
+1, sm_predictor.py calls start before it imports the container modules,
+which load the models and import onnxruntime, whose threads do not survive a
+fork:
+
+    listener = prefork.start()
+    import infer_ocr_app
+
+The first process stores the optimized graphs with their weights in files
+onnxruntime maps into memory, see inference_runtime, binds port 8080 and
+forks the workers. Each worker then loads the models, which share the pages
+of those files, and serves the inherited socket. A worker busy with a
+request does not accept connections, so new ones go to the idle workers.
+The first process only restarts workers that die and stops them on SIGTERM.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from os import environ
+
+from gevent import socket as gevent_socket
+
+SERVER_WORKERS = int(environ.get('SERVER_WORKERS', 1))
+PORT = 8080
+LISTEN_BACKLOG = 2048
+# a worker dying sooner than this after it started fails the container
+# instead of being restarted in a loop
+WORKER_STARTUP_SECONDS = 60
+
+
+def prepare_models(model_dir):
+    """
+    Store the shared weights graph of every model in model_dir, in a child
+    process so no onnxruntime thread pool is forked.
+    """
+    if not model_dir or not os.path.isdir(model_dir):
+        return
+    runtime = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inference_runtime.py')
+    try:
+        subprocess.check_call([sys.executable, runtime, model_dir])
+    except (OSError, subprocess.CalledProcessError) as e:
+        # the workers then load the models without sharing their weights
+        print('failed to prepare the shared weights: {}'.format(e))
+
+
+def listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', PORT))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn(workers):
+    """
+    Fork one worker.
+    return:
+        True in the worker, False in the first process
+    """
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        return True
+    workers[pid] = time.monotonic()
+    return False
+
+
+def supervise(num_workers):
+    """
+    Run num_workers workers until SIGTERM, restarting the ones that die.
+    return:
+        only in the workers
+    """
+    workers = {}
+    stopping = []
+    failed = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(num_workers):
+        if spawn(workers):
+            return
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print('worker {} exited with status {}'.format(pid, status))
+        if time.monotonic() - started < WORKER_STARTUP_SECONDS:
+            failed.append(pid)
+            stop(signal.SIGTERM, None)
+            continue
+        if spawn(workers):
+            return
+    sys.exit(1 if failed else 0)
+
+
+def start():
+    """
+    Fork SERVER_WORKERS workers, see the module docstring.
+    return:
+        the socket bound to port 8080 in the workers, None when
+        SERVER_WORKERS is 1 and the server binds the port itself
+    """
+    if SERVER_WORKERS <= 1:
+        return None
+    prepare_models(environ.get('MODEL_PATH'))
+    sock = listen()
+    supervise(SERVER_WORKERS)
+    return sock
+
+
+def wsgi_listener(sock):
+    """
+    return:
+        what the gevent WSGIServer listens on, port 8080 or the socket of a
+        worker wrapped for gevent
+    """
+    if sock is None:
+        return ('0.0.0.0', PORT)
+    return gevent_socket.socket(fileno=sock.detach())
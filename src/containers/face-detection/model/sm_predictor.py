@@ -2,7 +2,15 @@ from gevent import pywsgi
 import flask
 import json
 
+import prefork
+
+# the workers are forked before any module loads models, see prefork
+listener = prefork.start()
+
+from aikits_utils import BINARY_CONTENT_TYPES, binary_body
+import async_server
 import face_detection_app
+import request_metrics
 
 app = flask.Flask(__name__)
 
@@ -16,6 +24,14 @@ def ping():
     status = 200
     return flask.Response(response='\n', status=status, mimetype='application/json')
     
+@app.route('/metrics/prometheus', methods=['GET'])
+def prometheus_metrics():
+    """
+    Report the stage durations of the requests served so far in the Prometheus text format.
+    :return:
+    """
+    return flask.Response(response=request_metrics.histograms.to_prometheus(), status=200, mimetype='text/plain')
+
 @app.route('/invocations', methods=['POST'])
 def transformation():
     """
@@ -26,14 +42,19 @@ def transformation():
     if flask.request.content_type == 'application/json':
         request_body = flask.request.data.decode('utf-8')
         body = json.loads(request_body)
-        req = face_detection_app.handler({'body':body}, None)
-        return flask.Response(
-            response=req['body'],
-            status=req['statusCode'], mimetype='application/json')
+    elif flask.request.mimetype in BINARY_CONTENT_TYPES:
+        body = binary_body(flask.request.mimetype, flask.request.get_data(), flask.request.args.to_dict())
     else:
         return flask.Response(
-            response='Only supports application/json data',
+            response='Only supports application/json, image/jpeg, image/png and application/x-npy data',
             status=415, mimetype='application/json')
+    req = face_detection_app.handler({'body':body}, None)
+    return flask.Response(
+        response=req['body'],
+        status=req['statusCode'], mimetype='application/json')
             
-server = pywsgi.WSGIServer(('0.0.0.0', 8080), app)
-server.serve_forever()
\ No newline at end of file
+if async_server.SERVER_MODE == 'async':
+    async_server.serve(face_detection_app.handler, sock=listener)
+else:
+    server = pywsgi.WSGIServer(prefork.wsgi_listener(listener), app)
+    server.serve_forever()
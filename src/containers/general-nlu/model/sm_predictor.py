@@ -2,7 +2,14 @@ from gevent import pywsgi
 import flask
 import json
 
+import prefork
+
+# the workers are forked before any module loads models, see prefork
+listener = prefork.start()
+
+import async_server
 import nlu_llm_app
+import request_metrics
 
 app = flask.Flask(__name__)
 
@@ -16,6 +23,14 @@ def ping():
     status = 200
     return flask.Response(response='\n', status=status, mimetype='application/json')
     
+@app.route('/metrics/prometheus', methods=['GET'])
+def prometheus_metrics():
+    """
+    Report the stage durations of the requests served so far in the Prometheus text format.
+    :return:
+    """
+    return flask.Response(response=request_metrics.histograms.to_prometheus(), status=200, mimetype='text/plain')
+
 @app.route('/invocations', methods=['POST'])
 def transformation():
     """
@@ -35,5 +50,8 @@ def transformation():
             response='Only supports application/json data',
             status=415, mimetype='application/json')
             
-server = pywsgi.WSGIServer(('0.0.0.0', 8080), app)
-server.serve_forever()
\ No newline at end of file
+if async_server.SERVER_MODE == 'async':
+    async_server.serve(nlu_llm_app.handler, sock=listener)
+else:
+    server = pywsgi.WSGIServer(prefork.wsgi_listener(listener), app)
+    server.serve_forever()
@@ -206,4 +206,52 @@ class DetResizeForTest(object):
         ratio_h = resize_h / float(h)
         ratio_w = resize_w / float(w)
 
-        return img, [ratio_h, ratio_w]
\ No newline at end of file
+        return img, [ratio_h, ratio_w]
+
+
+class DetPreprocess(object):
+    """ DetResizeForTest, NormalizeImage, ToCHWImage and KeepKeys(['image', 'shape'])
+    fused, see imaug.fuse_operators. The resized image is normalized straight
+    into a [c, h, w] float32 buffer with one multiply and add per channel,
+    instead of allocating a float32 image in each operator. The result equals
+    the operator chain up to float rounding.
+    """
+
+    def __init__(self, resize_op, normalize_op, **kwargs):
+        self.resize_op = resize_op
+        # (img * scale - mean) / std == img * channel_scale + channel_offset
+        self.channel_scale = (normalize_op.scale / normalize_op.std).reshape(-1)
+        self.channel_offset = (-normalize_op.mean / normalize_op.std).reshape(-1)
+
+    def resize(self, img):
+        """
+        return:
+            (img, shape), the resized [h, w, c] image, None when it would be
+            empty, and the [src_h, src_w, ratio_h, ratio_w] row of the resize
+        """
+        # OpenCV copies strided views such as img[:, :, ::-1] before resizing,
+        # the contiguous image is resized and flipped back instead
+        flipped = img.ndim == 3 and img.strides[2] < 0
+        data = self.resize_op({'image': img[:, :, ::-1] if flipped else img})
+        img = data['image']
+        if img is not None and flipped:
+            img = img[:, :, ::-1]
+        return img, data['shape']
+
+    def normalize(self, img, out=None):
+        """
+        Normalize the [h, w, c] image img into out, a new [c, h, w] float32
+        array by default, e.g. a slice of a padded batch.
+        """
+        if out is None:
+            out = np.empty((img.shape[2],) + img.shape[:2], dtype=np.float32)
+        for cno in range(out.shape[0]):
+            np.multiply(img[:, :, cno], self.channel_scale[cno], out=out[cno])
+            np.add(out[cno], self.channel_offset[cno], out=out[cno])
+        return out
+
+    def __call__(self, data):
+        img, shape = self.resize(data['image'])
+        if img is None:
+            return [None, shape]
+        return [self.normalize(img), shape]
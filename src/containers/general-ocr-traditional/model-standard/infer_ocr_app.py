@@ -4,6 +4,9 @@ from os import environ
 
 import cv2
 from aikits_utils import readimg, lambda_return
+import reading_order
+import request_metrics
+import result_cache
 
 from main import *
 
@@ -14,26 +17,7 @@ if environ["MODEL_PATH"] is None:
     environ["MODEL_PATH"] = "/opt/program/model/"
 
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
-
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
+CLS_MODES = ['always', 'never', 'adaptive']
 
 
 class TextSystem:
@@ -42,6 +26,9 @@ class TextSystem:
         self.text_recognizer = TextRecognizer()
         self.drop_score = 0.3
         self.text_classifier = TextClassifier()
+        # default of the per-request cls_mode, see classify
+        self.cls_mode = environ.get('CLS_MODE', 'always')
+        self.cls_sample_num = int(environ.get('CLS_SAMPLE_NUM', 8))
 
     def get_rotate_crop_image(self, img, points):
         """
@@ -87,20 +74,42 @@ class TextSystem:
             dst_img = np.rot90(dst_img)
         return dst_img
 
-    def __call__(self, img):
-        ori_im = img.copy()
+    def classify(self, img_crop_list, cls_mode=None):
+        """
+        Turn the upside down crops of one image with the orientation
+        classifier.
+        args:
+            cls_mode(str): 'always' classifies every crop, 'never' skips the
+                classifier, 'adaptive' classifies the cls_sample_num widest
+                crops first and the others only when one of them is upside
+                down. Defaults to self.cls_mode.
+        """
+        cls_mode = cls_mode or self.cls_mode
+        if cls_mode == 'never':
+            return img_crop_list
+        if cls_mode == 'adaptive' and len(img_crop_list) > self.cls_sample_num:
+            # long lines carry the most text to tell the orientation from
+            sample = np.argsort([-crop.shape[1] for crop in img_crop_list])[:self.cls_sample_num]
+            _, cls_res = self.text_classifier([img_crop_list[ino] for ino in sample])
+            if not any('180' in label and score > self.text_classifier.cls_thresh
+                       for label, score in cls_res):
+                return img_crop_list
+        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        return img_crop_list
+
+    def __call__(self, img, cls_mode=None):
         dt_boxes = self.text_detector(img)
         if dt_boxes is None:
             return None, None
-        img_crop_list = []
 
-        dt_boxes = sorted_boxes(dt_boxes)
+        dt_boxes = reading_order.sorted_boxes(dt_boxes)
 
-        for bno in range(len(dt_boxes)):
-            tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
-        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, the boxes are not copied and the image at most once, as
+        # OpenCV would copy a strided view such as img[:, :, ::-1] per crop
+        img = np.ascontiguousarray(img)
+        img_crop_list = [TextCrop(img, box) for box in dt_boxes]
+        img_crop_list = self.classify(img_crop_list, cls_mode)
 
         rec_res = self.text_recognizer(img_crop_list)
         filter_boxes, filter_rec_res = [], []
@@ -113,6 +122,14 @@ class TextSystem:
 
 
 text_sys = TextSystem()
+# what the results depend on besides the request, see result_cache
+CACHE_MODELS = [
+    text_sys.text_detector.weights_path,
+    text_sys.text_recognizer.weights_path,
+    text_sys.text_classifier.weights_path,
+    environ['MODEL_PATH'] + 'keys_v1.txt',
+]
+CACHE_SETTINGS = {'cls_mode': text_sys.cls_mode, 'cls_sample_num': text_sys.cls_sample_num}
 
 def read_img(body):
     if 'url' in body:
@@ -126,6 +143,8 @@ def read_img(body):
             return str(k)
     return img
 
+@request_metrics.instrument('general-ocr-traditional-standard')
+@result_cache.cached('general-ocr-traditional-standard', CACHE_MODELS, CACHE_SETTINGS)
 def handler(event, context):
     start_time = time.time()
     if "body" not in event:
@@ -137,31 +156,35 @@ def handler(event, context):
             body = event["body"]
         if 'url' in body and 'img' in body:
             return lambda_return(400, '`url` and `img` cannot be used at the same time')
+        if body.get('cls_mode', text_sys.cls_mode) not in CLS_MODES:
+            return lambda_return(400, '`cls_mode` must be one of always, never, adaptive')
         img = read_img(body)
         if isinstance(img, str):
             return lambda_return(400, f'`parameter `{img}` illegal')
         img = img[:,:,::-1]
     except:
         return lambda_return(400, 'invalid param')
-    dt_boxes, rec_res = text_sys(img)
+    dt_boxes, rec_res = text_sys(img, body.get('cls_mode'))
     dt_results = list(zip(dt_boxes, rec_res))
-    dt_results.sort(key=lambda x: (x[0].min(0)[1]))
-
-    result = []
-    for row in dt_results:
-        row = {
-            "words": row[1][0],
-            "location": {
-                "top": int(row[0][0][1]),
-                "left": int(row[0][0][0]),
-                "width": int(row[0][2][0] - row[0][0][0]),
-                "height": int(row[0][2][1] - row[0][0][1]),
-            },
-            "score": float(row[1][1]),
-        }
-        result.append(row)
+
+    with request_metrics.stage('serialize'):
+        result = []
+        for row in dt_results:
+            row = {
+                "words": row[1][0],
+                "location": {
+                    "top": int(row[0][0][1]),
+                    "left": int(row[0][0][0]),
+                    "width": int(row[0][2][0] - row[0][0][0]),
+                    "height": int(row[0][2][1] - row[0][0][1]),
+                },
+                "score": float(row[1][1]),
+            }
+            result.append(row)
+        if body.get('paragraphs'):
+            result = reading_order.with_paragraphs(dt_boxes, result)
     
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
         
-    return lambda_return(200, json.dumps(result))
+        return lambda_return(200, json.dumps(result))
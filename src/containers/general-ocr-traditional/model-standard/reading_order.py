@@ -0,0 +1,141 @@
+"""
+Reading order of detected text boxes. The same file is copied into every
+container with a text detector and replaces their own sorted_boxes:
+
+    from reading_order import sorted_boxes
+
+Boxes are grouped into lines by their vertical overlap, lines are read top
+to bottom and the boxes of a line left to right, so the boxes of a skewed
+line stay together however much its ends differ in height. Consecutive lines
+are grouped into paragraphs when they overlap horizontally and the gap
+between them is small. Everything is computed with NumPy array operations,
+without a Python loop over the boxes.
+"""
+import numpy as np
+
+# boxes whose vertical ranges overlap by at least this fraction of the
+# lower box height are on the same line
+LINE_OVERLAP = 0.5
+# a gap between two lines larger than this fraction of the median box
+# height starts a new paragraph
+PARAGRAPH_GAP = 0.8
+
+
+def box_extents(dt_boxes):
+    """
+    args:
+        dt_boxes(array): text boxes with shape [N, 4, 2]
+    return:
+        array [N, 4] of the x_min, y_min, x_max, y_max of each box
+    """
+    boxes = np.asarray(dt_boxes, dtype=np.float32).reshape(-1, 4, 2)
+    return np.concatenate([boxes.min(axis=1), boxes.max(axis=1)], axis=1)
+
+
+def line_ids(extents, line_overlap=LINE_OVERLAP):
+    """
+    Group boxes into lines. Sorted by their vertical center, each box joins
+    the line of the previous one when their vertical ranges overlap by at
+    least line_overlap of the lower height.
+    args:
+        extents(array): box extents, see box_extents
+    return:
+        array [N] of the line of each box, lines numbered top to bottom
+    """
+    if len(extents) == 0:
+        return np.zeros(0, dtype=np.int64)
+    y_min, y_max = extents[:, 1], extents[:, 3]
+    by_center = np.argsort(y_min + y_max, kind='stable')
+    y_min, y_max = y_min[by_center], y_max[by_center]
+    height = y_max - y_min
+    overlap = np.minimum(y_max[1:], y_max[:-1]) - np.maximum(y_min[1:], y_min[:-1])
+    new_line = overlap < line_overlap * np.minimum(height[1:], height[:-1])
+    lines = np.empty(len(extents), dtype=np.int64)
+    lines[by_center] = np.concatenate([[0], np.cumsum(new_line)])
+    return lines
+
+
+def reading_order(dt_boxes, line_overlap=LINE_OVERLAP):
+    """
+    args:
+        dt_boxes(array): text boxes with shape [N, 4, 2]
+    return:
+        (order, lines), the indices of the boxes in reading order and the
+        line of each box in that order, numbered from 0
+    """
+    extents = box_extents(dt_boxes)
+    lines = line_ids(extents, line_overlap)
+    # the boxes of a line by x, ties by y for a stable order
+    order = np.lexsort((extents[:, 1], extents[:, 0], lines))
+    return order, lines[order]
+
+
+def sorted_boxes(dt_boxes):
+    """
+    Sort text boxes in reading order, lines from top to bottom and the boxes
+    of a line from left to right
+    args:
+        dt_boxes(array): detected text boxes with shape [N, 4, 2]
+    return:
+        list of the boxes(array) with shape [4, 2], in reading order
+    """
+    dt_boxes = np.asarray(dt_boxes)
+    order, _ = reading_order(dt_boxes)
+    return list(dt_boxes[order])
+
+
+def paragraph_ids(extents, lines, paragraph_gap=PARAGRAPH_GAP):
+    """
+    Group the lines of boxes in reading order into paragraphs. A line
+    continues the paragraph of the previous line when they overlap
+    horizontally and the vertical gap between them is at most
+    paragraph_gap times the median box height.
+    args:
+        extents(array): extents of the boxes in reading order
+        lines(array): line of each of those boxes, numbered from 0 in
+            reading order, see reading_order
+    return:
+        array [N] of the paragraph of each box
+    """
+    if len(extents) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # the boxes of a line are contiguous in reading order
+    starts = np.flatnonzero(np.concatenate([[True], lines[1:] != lines[:-1]]))
+    x_min = np.minimum.reduceat(extents[:, 0], starts)
+    y_min = np.minimum.reduceat(extents[:, 1], starts)
+    x_max = np.maximum.reduceat(extents[:, 2], starts)
+    y_max = np.maximum.reduceat(extents[:, 3], starts)
+    max_gap = paragraph_gap * np.median(extents[:, 3] - extents[:, 1])
+    gap = y_min[1:] - y_max[:-1]
+    apart = (x_min[1:] > x_max[:-1]) | (x_max[1:] < x_min[:-1])
+    line_paragraphs = np.concatenate([[0], np.cumsum((gap > max_gap) | apart)])
+    return line_paragraphs[lines]
+
+
+def layout(dt_boxes):
+    """
+    args:
+        dt_boxes(array): text boxes with shape [N, 4, 2]
+    return:
+        (order, lines, paragraphs), the indices of the boxes in reading
+        order and the line and paragraph of each box in that order, both
+        numbered from 0
+    """
+    order, lines = reading_order(dt_boxes)
+    return order, lines, paragraph_ids(box_extents(dt_boxes)[order], lines)
+
+
+def with_paragraphs(dt_boxes, rows):
+    """
+    Number the lines and paragraphs of the rows of an OCR response.
+    args:
+        dt_boxes(list): the boxes of the rows
+        rows(list): one dict per box
+    return:
+        the rows in reading order, each with its line and paragraph
+    """
+    if not rows:
+        return rows
+    order, lines, paragraphs = layout(dt_boxes)
+    return [dict(rows[index], line=int(line), paragraph=int(paragraph))
+            for index, line, paragraph in zip(order, lines, paragraphs)]
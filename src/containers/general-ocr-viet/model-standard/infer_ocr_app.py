@@ -4,6 +4,9 @@ from os import environ
 
 import cv2
 from aikits_utils import readimg, lambda_return
+import reading_order
+import request_metrics
+import result_cache
 
 from main import *
 
@@ -14,28 +17,6 @@ if environ["MODEL_PATH"] is None:
     environ["MODEL_PATH"] = "/opt/program/model/"
 
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
-
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
-
-
 class TextSystem:
     def __init__(self):
         self.text_detector = TextDetector()
@@ -88,18 +69,18 @@ class TextSystem:
         return dst_img
 
     def __call__(self, img):
-        ori_im = img.copy()
         dt_boxes = self.text_detector(img)
         if dt_boxes is None:
             return None, None
-        img_crop_list = []
 
-        dt_boxes = sorted_boxes(dt_boxes)
+        dt_boxes = reading_order.sorted_boxes(dt_boxes)
 
-        for bno in range(len(dt_boxes)):
-            tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, the boxes are not copied and the image at most once, as
+        # OpenCV would copy a strided view such as img[:, :, ::-1] per crop
+        with request_metrics.stage('rec_preprocess'):
+            img = np.ascontiguousarray(img)
+            img_crop_list = [TextCrop(img, box) for box in dt_boxes]
         img_crop_list, angle_list = self.text_classifier(img_crop_list)
 
         rec_res = self.text_recognizer(img_crop_list)
@@ -113,6 +94,13 @@ class TextSystem:
 
 
 text_sys = TextSystem()
+# what the results depend on besides the request, see result_cache
+CACHE_MODELS = [
+    text_sys.text_detector.weights_path,
+    text_sys.text_recognizer.weights_path,
+    text_sys.text_classifier.weights_path,
+    environ['MODEL_PATH'] + 'keys_v1.txt',
+]
 
 def read_img(body):
     if 'url' in body:
@@ -126,6 +114,8 @@ def read_img(body):
             return str(k)
     return img
 
+@request_metrics.instrument('general-ocr-viet-standard')
+@result_cache.cached('general-ocr-viet-standard', CACHE_MODELS)
 def handler(event, context):
     start_time = time.time()
     if "body" not in event:
@@ -145,23 +135,25 @@ def handler(event, context):
         return lambda_return(400, 'invalid param')
     dt_boxes, rec_res = text_sys(img)
     dt_results = list(zip(dt_boxes, rec_res))
-    dt_results.sort(key=lambda x: (x[0].min(0)[1]))
-
-    result = []
-    for row in dt_results:
-        row = {
-            "words": row[1][0],
-            "location": {
-                "top": int(row[0][0][1]),
-                "left": int(row[0][0][0]),
-                "width": int(row[0][2][0] - row[0][0][0]),
-                "height": int(row[0][2][1] - row[0][0][1]),
-            },
-            "score": float(row[1][1]),
-        }
-        result.append(row)
+
+    with request_metrics.stage('serialize'):
+        result = []
+        for row in dt_results:
+            row = {
+                "words": row[1][0],
+                "location": {
+                    "top": int(row[0][0][1]),
+                    "left": int(row[0][0][0]),
+                    "width": int(row[0][2][0] - row[0][0][0]),
+                    "height": int(row[0][2][1] - row[0][0][1]),
+                },
+                "score": float(row[1][1]),
+            }
+            result.append(row)
+        if body.get('paragraphs'):
+            result = reading_order.with_paragraphs(dt_boxes, result)
     
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
         
-    return lambda_return(200, json.dumps(result))
+        return lambda_return(200, json.dumps(result))
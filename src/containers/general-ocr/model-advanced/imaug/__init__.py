@@ -45,4 +45,21 @@ def create_operators(op_param_list, global_config=None):
             param.update(global_config)
         op = eval(op_name)(**param)
         ops.append(op)
-    return ops
\ No newline at end of file
+    return ops
+
+
+def fuse_operators(ops):
+    """
+    Replace the detector preprocess DetResizeForTest, NormalizeImage with the
+    hwc order, ToCHWImage and KeepKeys(['image', 'shape']) by the equivalent
+    DetPreprocess. The configuration stays the operator list, other lists are
+    returned as they are.
+    """
+    if len(ops) != 4:
+        return ops
+    resize_op, normalize_op, chw_op, keep_op = ops
+    if not (isinstance(resize_op, DetResizeForTest) and isinstance(normalize_op, NormalizeImage)
+            and normalize_op.mean.shape == (1, 1, 3) and isinstance(chw_op, ToCHWImage)
+            and isinstance(keep_op, KeepKeys) and list(keep_op.keep_keys) == ['image', 'shape']):
+        return ops
+    return [DetPreprocess(resize_op, normalize_op)]
@@ -5,9 +5,11 @@ import time
 from os import environ
 
 import cv2
-from aikits_utils import readimg
+from aikits_utils import BINARY_CONTENT_TYPES, binary_body, readimg
 
 from main import *
+import reading_order
+import request_metrics
 
 app = flask.Flask(__name__)
 
@@ -30,26 +32,8 @@ def read_img(body):
             return str(k)
     return img
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
 
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
+CLS_MODES = ['always', 'never', 'adaptive']
 
 
 class TextSystem:
@@ -58,6 +42,9 @@ class TextSystem:
         self.text_recognizer = TextRecognizer()
         self.drop_score = 0.3
         self.text_classifier = TextClassifier()
+        # default of the per-request cls_mode, see classify
+        self.cls_mode = environ.get('CLS_MODE', 'always')
+        self.cls_sample_num = int(environ.get('CLS_SAMPLE_NUM', 8))
 
     def get_rotate_crop_image(self, img, points):
         """
@@ -103,20 +90,42 @@ class TextSystem:
             dst_img = np.rot90(dst_img)
         return dst_img
 
-    def __call__(self, img):
-        ori_im = img.copy()
+    def classify(self, img_crop_list, cls_mode=None):
+        """
+        Turn the upside down crops of one image with the orientation
+        classifier.
+        args:
+            cls_mode(str): 'always' classifies every crop, 'never' skips the
+                classifier, 'adaptive' classifies the cls_sample_num widest
+                crops first and the others only when one of them is upside
+                down. Defaults to self.cls_mode.
+        """
+        cls_mode = cls_mode or self.cls_mode
+        if cls_mode == 'never':
+            return img_crop_list
+        if cls_mode == 'adaptive' and len(img_crop_list) > self.cls_sample_num:
+            # long lines carry the most text to tell the orientation from
+            sample = np.argsort([-crop.shape[1] for crop in img_crop_list])[:self.cls_sample_num]
+            _, cls_res = self.text_classifier([img_crop_list[ino] for ino in sample])
+            if not any('180' in label and score > self.text_classifier.cls_thresh
+                       for label, score in cls_res):
+                return img_crop_list
+        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        return img_crop_list
+
+    def __call__(self, img, cls_mode=None):
         dt_boxes = self.text_detector(img)
         if dt_boxes is None:
             return None, None
-        img_crop_list = []
 
-        dt_boxes = sorted_boxes(dt_boxes)
+        dt_boxes = reading_order.sorted_boxes(dt_boxes)
 
-        for bno in range(len(dt_boxes)):
-            tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
-        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, the boxes are not copied and the image at most once, as
+        # OpenCV would copy a strided view such as img[:, :, ::-1] per crop
+        img = np.ascontiguousarray(img)
+        img_crop_list = [TextCrop(img, box) for box in dt_boxes]
+        img_crop_list = self.classify(img_crop_list, cls_mode)
 
         rec_res = self.text_recognizer(img_crop_list)
         filter_boxes, filter_rec_res = [], []
@@ -146,7 +155,16 @@ def ping():
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
 
+@app.route('/metrics/prometheus', methods=['GET'])
+def prometheus_metrics():
+    """
+    Report the stage durations of the requests served so far in the Prometheus text format.
+    :return:
+    """
+    return flask.Response(response=request_metrics.histograms.to_prometheus(), status=200, mimetype='text/plain')
+
 @app.route('/invocations', methods=['POST'])
+@request_metrics.instrument('general-ocr-standard-sm')
 def transformation():
     """
     Do an inference on a single batch of data. In this sample server, we take image data as base64 formation,
@@ -159,49 +177,57 @@ def transformation():
         body = json.loads(request_body)
         if "body" in body:
             body = body["body"]
-        try:
-            if 'url' in body and 'img' in body:
-                return flask.Response(
-                    response='`url` and `img` cannot be used at the same time',
-                    status=400, mimetype='application/json')
-            img = read_img(body)
-            if isinstance(img, str):
-                return flask.Response(
-                    response=f'`parameter `{img}` illegal',
-                    status=400, mimetype='application/json')
-            img = img[:,:,::-1]
-        except:
-            return flask.Response(
-                    response='invalid param',
-                    status=400, mimetype='application/json')
+    elif flask.request.mimetype in BINARY_CONTENT_TYPES:
+        body = binary_body(flask.request.mimetype, flask.request.get_data(), flask.request.args.to_dict())
     else:
         return flask.Response(
-            response='Object detector only supports application/json data',
+            response='Object detector only supports application/json, image/jpeg, image/png and application/x-npy data',
             status=415, mimetype='application/json')
+    try:
+        if 'url' in body and 'img' in body:
+            return flask.Response(
+                response='`url` and `img` cannot be used at the same time',
+                status=400, mimetype='application/json')
+        if body.get('cls_mode', text_sys.cls_mode) not in CLS_MODES:
+            return flask.Response(
+                response='`cls_mode` must be one of always, never, adaptive',
+                status=400, mimetype='application/json')
+        img = read_img(body)
+        if isinstance(img, str):
+            return flask.Response(
+                response=f'`parameter `{img}` illegal',
+                status=400, mimetype='application/json')
+        img = img[:,:,::-1]
+    except:
+        return flask.Response(
+                response='invalid param',
+                status=400, mimetype='application/json')
 
-    dt_boxes, rec_res = text_sys(img)
+    dt_boxes, rec_res = text_sys(img, body.get('cls_mode'))
     dt_results = list(zip(dt_boxes, rec_res))
-    dt_results.sort(key=lambda x: (x[0].min(0)[1]))
-
-    result = []
-    for row in dt_results:
-        row = {
-            "words": row[1][0],
-            "location": {
-                "top": int(row[0][0][1]),
-                "left": int(row[0][0][0]),
-                "width": int(row[0][2][0] - row[0][0][0]),
-                "height": int(row[0][2][1] - row[0][0][1]),
-            },
-            "score": float(row[1][1]),
-        }
-        result.append(row)
+
+    with request_metrics.stage('serialize'):
+        result = []
+        for row in dt_results:
+            row = {
+                "words": row[1][0],
+                "location": {
+                    "top": int(row[0][0][1]),
+                    "left": int(row[0][0][0]),
+                    "width": int(row[0][2][0] - row[0][0][0]),
+                    "height": int(row[0][2][1] - row[0][0][1]),
+                },
+                "score": float(row[1][1]),
+            }
+            result.append(row)
+        if body.get('paragraphs'):
+            result = reading_order.with_paragraphs(dt_boxes, result)
     
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
-    return flask.Response(
-        response=json.dumps(result),
-        status=200, mimetype='application/json')
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
+        return flask.Response(
+            response=json.dumps(result),
+            status=200, mimetype='application/json')
 
 server = pywsgi.WSGIServer(('0.0.0.0', 8080), app)
 server.serve_forever()
\ No newline at end of file
@@ -3,7 +3,10 @@ import time
 from os import environ
 
 import cv2
-from aikits_utils import readimg, lambda_return
+from aikits_utils import fetch_pool, readimg, lambda_return
+import reading_order
+import request_metrics
+import result_cache
 
 from main import *
 
@@ -26,26 +29,9 @@ def read_img(body):
             return str(k)
     return img
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
 
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
+CLS_MODES = ['always', 'never', 'adaptive']
+DET_MODES = ['single', 'tiled']
 
 
 class TextSystem:
@@ -54,6 +40,11 @@ class TextSystem:
         self.text_recognizer = TextRecognizer()
         self.drop_score = 0.3
         self.text_classifier = TextClassifier()
+        # default of the per-request cls_mode, see classify
+        self.cls_mode = environ.get('CLS_MODE', 'always')
+        self.cls_sample_num = int(environ.get('CLS_SAMPLE_NUM', 8))
+        # default of the per-request det_mode, see detect
+        self.det_mode = environ.get('DET_MODE', 'single')
 
     def get_rotate_crop_image(self, img, points):
         """
@@ -99,22 +90,65 @@ class TextSystem:
             dst_img = np.rot90(dst_img)
         return dst_img
 
-    def __call__(self, img):
-        ori_im = img.copy()
-        dt_boxes = self.text_detector(img)
+    def classify(self, img_crop_list, cls_mode=None):
+        """
+        Turn the upside down crops of one image with the orientation
+        classifier.
+        args:
+            cls_mode(str): 'always' classifies every crop, 'never' skips the
+                classifier, 'adaptive' classifies the cls_sample_num widest
+                crops first and the others only when one of them is upside
+                down. Defaults to self.cls_mode.
+        """
+        cls_mode = cls_mode or self.cls_mode
+        if cls_mode == 'never':
+            return img_crop_list
+        if cls_mode == 'adaptive' and len(img_crop_list) > self.cls_sample_num:
+            # long lines carry the most text to tell the orientation from
+            sample = np.argsort([-crop.shape[1] for crop in img_crop_list])[:self.cls_sample_num]
+            _, cls_res = self.text_classifier([img_crop_list[ino] for ino in sample])
+            if not any('180' in label and score > self.text_classifier.cls_thresh
+                       for label, score in cls_res):
+                return img_crop_list
+        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        return img_crop_list
+
+    def detect(self, img, det_mode=None):
+        """
+        args:
+            det_mode(str): 'single' resizes the whole image for one detector
+                run, 'tiled' detects on full resolution tiles, see
+                TextDetector.detect_tiled. Defaults to self.det_mode.
+        """
+        if (det_mode or self.det_mode) == 'tiled':
+            return self.text_detector.detect_tiled(img)
+        return self.text_detector(img)
+
+    def __call__(self, img, cls_mode=None, det_mode=None):
+        dt_boxes = self.detect(img, det_mode)
         if dt_boxes is None:
             return None, None
-        img_crop_list = []
+        return self.recognize(img, dt_boxes, cls_mode)
 
-        dt_boxes = sorted_boxes(dt_boxes)
+    def recognize(self, img, dt_boxes, cls_mode=None):
+        """
+        Classify and recognize the text boxes of one image.
+        return:
+            (filter_boxes, filter_rec_res) in reading order
+        """
+        dt_boxes = reading_order.sorted_boxes(dt_boxes)
 
-        for bno in range(len(dt_boxes)):
-            tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
-        img_crop_list, angle_list = self.text_classifier(img_crop_list)
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, the boxes are not copied and the image at most once, as
+        # OpenCV would copy a strided view such as img[:, :, ::-1] per crop
+        img = np.ascontiguousarray(img)
+        img_crop_list = [TextCrop(img, box) for box in dt_boxes]
+        img_crop_list = self.classify(img_crop_list, cls_mode)
 
         rec_res = self.text_recognizer(img_crop_list)
+        return self.filter_results(dt_boxes, rec_res)
+
+    def filter_results(self, dt_boxes, rec_res):
         filter_boxes, filter_rec_res = [], []
         for box, rec_reuslt in zip(dt_boxes, rec_res):
             text, score = rec_reuslt
@@ -123,30 +157,203 @@ class TextSystem:
                 filter_rec_res.append(rec_reuslt)
         return filter_boxes, filter_rec_res
 
+    def batch(self, img_list, cls_modes=None, det_modes=None):
+        """
+        Run the whole pipeline on several images at once. Detection runs in
+        padded batches, see TextDetector.predict_maps, and the crops of all
+        images share the classifier and recognizer batches, each crop keeps
+        the index of its image so the results are split back per image.
+        A crop gets the same input whatever it is batched with, so the
+        results of an image do not depend on the other images.
+        args:
+            cls_modes(list): cls_mode of each image, see classify
+            det_modes(list): det_mode of each image, see detect
+        return:
+            list with one entry per image, (filter_boxes, filter_rec_res) or
+            the exception the image failed with
+        """
+        if cls_modes is None:
+            cls_modes = [None] * len(img_list)
+        cls_modes = [cls_mode or self.cls_mode for cls_mode in cls_modes]
+        if det_modes is None:
+            det_modes = [None] * len(img_list)
+        det_modes = [det_mode or self.det_mode for det_mode in det_modes]
+        # tiled images are batched over their tiles instead
+        single = [ino for ino, det_mode in enumerate(det_modes) if det_mode != 'tiled']
+        dt_boxes_list = [None] * len(img_list)
+        if single:
+            try:
+                detected = self.text_detector.detect_batch([img_list[ino] for ino in single])
+            except Exception as e:
+                # the image failing the batch fails alone, the others are detected again one by one
+                print('batch detection failed, detecting the images one by one: {}'.format(e))
+                detected = [self.detect_alone(img_list[ino]) for ino in single]
+            for ino, dt_boxes in zip(single, detected):
+                dt_boxes_list[ino] = dt_boxes
+
+        results = [None] * len(img_list)
+        # crops per image index, of the images detected without error
+        crop_lists = {}
+        for ino, (img, dt_boxes) in enumerate(zip(img_list, dt_boxes_list)):
+            try:
+                if det_modes[ino] == 'tiled':
+                    dt_boxes = self.text_detector.detect_tiled(img)
+                if isinstance(dt_boxes, Exception):
+                    raise dt_boxes
+                if dt_boxes is None:
+                    raise ValueError('the image is too small to detect text on')
+                dt_boxes_list[ino] = reading_order.sorted_boxes(dt_boxes)
+                img = np.ascontiguousarray(img)
+                img_crop_list = [TextCrop(img, box) for box in dt_boxes_list[ino]]
+                if cls_modes[ino] != 'always':
+                    img_crop_list = self.classify(img_crop_list, cls_modes[ino])
+                crop_lists[ino] = img_crop_list
+            except Exception as e:
+                results[ino] = e
+
+        # the crops of the images classified in full share classifier batches
+        always = {ino: crops for ino, crops in crop_lists.items() if cls_modes[ino] == 'always'}
+        crop_lists.update(self.run_pooled(lambda crops: self.text_classifier(crops)[0], always))
+        rec_res_lists = self.run_pooled(self.text_recognizer, {
+            ino: crops for ino, crops in crop_lists.items() if not isinstance(crops, Exception)})
+        for ino, crops in crop_lists.items():
+            rec_res = rec_res_lists.get(ino, crops)
+            if isinstance(rec_res, Exception):
+                results[ino] = rec_res
+            else:
+                results[ino] = self.filter_results(dt_boxes_list[ino], rec_res)
+        return results
+
+    def run_pooled(self, fn, crop_lists):
+        """
+        Run fn, the classifier or recognizer, on the crops of all images in
+        shared batches, and on the crops of each image alone when that
+        fails, so a failure stays with its image.
+        args:
+            fn: takes a list of crops and returns one output per crop
+            crop_lists(dict): list of crops per image index
+        return:
+            dict of the list of outputs per image index, or of the
+            exception the image failed with
+        """
+        owners = [ino for ino, crops in crop_lists.items() for _ in crops]
+        try:
+            outputs = fn([crop for crops in crop_lists.values() for crop in crops])
+        except Exception as e:
+            print('batch of {} images failed, running them one by one: {}'.format(len(crop_lists), e))
+            return {ino: self.run_alone(fn, crops) for ino, crops in crop_lists.items()}
+        output_lists = {ino: [] for ino in crop_lists}
+        for ino, output in zip(owners, outputs):
+            output_lists[ino].append(output)
+        return output_lists
+
+    def run_alone(self, fn, crops):
+        """
+        return:
+            fn(crops), or the exception it raised
+        """
+        try:
+            return fn(crops)
+        except Exception as e:
+            return e
+
+    def detect_alone(self, img):
+        """
+        return:
+            the boxes of detect_batch for img alone, or the exception it
+            raised
+        """
+        try:
+            return self.text_detector.detect_batch([img])[0]
+        except Exception as e:
+            return e
+
 
 text_sys = TextSystem()
+MAX_BATCH_IMAGES = int(environ.get('MAX_BATCH_IMAGES', 32))
+# what the results depend on besides the request, see result_cache
+CACHE_MODELS = [
+    text_sys.text_detector.weights_path,
+    text_sys.text_recognizer.weights_path,
+    text_sys.text_classifier.weights_path,
+    environ['MODEL_PATH'] + 'keys_v1.txt',
+]
+CACHE_SETTINGS = {'cls_mode': text_sys.cls_mode, 'cls_sample_num': text_sys.cls_sample_num, 'det_mode': text_sys.det_mode}
 
 
-def handler(event, context):
-    start_time = time.time()
+def parse_event(event):
+    """
+    Decode the request image from the event.
+    return:
+        (body, img) on success, (None, error response) otherwise, img is
+        the list of images for batch requests with `images`
+    """
     if "body" not in event:
-        return lambda_return(400, 'invalid param')
+        return None, lambda_return(400, 'invalid param')
     try:
         if isinstance(event["body"], str):
             body = json.loads(event["body"])
         else:
             body = event["body"]
         if 'url' in body and 'img' in body:
-            return lambda_return(400, '`url` and `img` cannot be used at the same time')
+            return None, lambda_return(400, '`url` and `img` cannot be used at the same time')
+        if body.get('cls_mode', text_sys.cls_mode) not in CLS_MODES:
+            return None, lambda_return(400, '`cls_mode` must be one of always, never, adaptive')
+        if body.get('det_mode', text_sys.det_mode) not in DET_MODES:
+            return None, lambda_return(400, '`det_mode` must be one of single, tiled')
+        if 'images' in body:
+            return parse_images(body)
         img = read_img(body)
         if isinstance(img, str):
-            return lambda_return(400, f'`parameter `{img}` illegal')
+            return None, lambda_return(400, f'`parameter `{img}` illegal')
         img = img[:,:,::-1]
     except:
-        return lambda_return(400, 'invalid param')
-    dt_boxes, rec_res = text_sys(img)
+        return None, lambda_return(400, 'invalid param')
+    return body, img
+
+
+def parse_images(body):
+    """
+    Fetch and decode the images of a batch request concurrently. Each entry
+    of `images` takes `url` or `img` and optionally its own `cls_mode` and
+    `det_mode`.
+    return:
+        (body, img_list) on success, (None, error response) otherwise, the
+        images that failed to load are a ValueError in img_list
+    """
+    entries = body['images']
+    if not isinstance(entries, list) or not entries:
+        return None, lambda_return(400, '`images` must be a non-empty list')
+    if len(entries) > MAX_BATCH_IMAGES:
+        return None, lambda_return(400, f'`images` takes at most {MAX_BATCH_IMAGES} entries')
+    for ino, entry in enumerate(entries):
+        if 'url' in entry and 'img' in entry:
+            return None, lambda_return(400, f'`images[{ino}]`: `url` and `img` cannot be used at the same time')
+        if entry.get('cls_mode', text_sys.cls_mode) not in CLS_MODES:
+            return None, lambda_return(400, f'`images[{ino}]`: `cls_mode` must be one of always, never, adaptive')
+        if entry.get('det_mode', text_sys.det_mode) not in DET_MODES:
+            return None, lambda_return(400, f'`images[{ino}]`: `det_mode` must be one of single, tiled')
+    img_list = list(fetch_pool.map(request_metrics.propagate(read_entry), entries))
+    return body, [img if isinstance(img, Exception) else img[:,:,::-1] for img in img_list]
+
+
+def read_entry(entry):
+    """ read_img of one entry of `images`, with its failure as a ValueError """
+    try:
+        img = read_img(entry)
+    except Exception:
+        img = 'url' if 'url' in entry else 'img'
+    if isinstance(img, str):
+        return ValueError(f'parameter `{img}` illegal')
+    return img
+
+
+def format_rows(dt_boxes, rec_res, paragraphs=False):
+    """
+    One row per text box, in the reading order of the boxes, with their
+    line and paragraph numbers when paragraphs is true.
+    """
     dt_results = list(zip(dt_boxes, rec_res))
-    dt_results.sort(key=lambda x: (x[0].min(0)[1]))
 
     result = []
     for row in dt_results:
@@ -161,8 +368,63 @@ def handler(event, context):
             "score": float(row[1][1]),
         }
         result.append(row)
-    
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
-    return lambda_return(200, json.dumps(result))
+    if paragraphs:
+        result = reading_order.with_paragraphs(dt_boxes, result)
+    return result
+
+
+def format_result(body, dt_boxes, rec_res, start_time):
+    with request_metrics.stage('serialize'):
+        result = format_rows(dt_boxes, rec_res, body.get('paragraphs'))
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
+        return lambda_return(200, json.dumps(result))
+
+
+def format_batch_result(body, results, start_time):
+    """
+    one list of rows per image, in the order of `images`, or an error entry
+    for the images that failed, see TextSystem.batch
+    """
+    with request_metrics.stage('serialize'):
+        result = []
+        for ino, (image_result, entry) in enumerate(zip(results, body['images'])):
+            if isinstance(image_result, Exception):
+                result.append({"error": f'`images[{ino}]`: {image_result}'})
+                continue
+            dt_boxes, rec_res = image_result
+            result.append(format_rows(dt_boxes, rec_res, entry.get('paragraphs', body.get('paragraphs'))))
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
+        return lambda_return(200, json.dumps(result))
+
+
+def batch_handler(body, img_list, start_time):
+    cls_modes = [entry.get('cls_mode', body.get('cls_mode')) for entry in body['images']]
+    det_modes = [entry.get('det_mode', body.get('det_mode')) for entry in body['images']]
+    # the images that failed to load keep their error, the others are run
+    results = list(img_list)
+    loaded = [ino for ino, img in enumerate(img_list) if not isinstance(img, Exception)]
+    if loaded:
+        try:
+            batch_results = text_sys.batch([img_list[ino] for ino in loaded],
+                                           [cls_modes[ino] for ino in loaded],
+                                           [det_modes[ino] for ino in loaded])
+        except Exception as e:
+            batch_results = [e] * len(loaded)
+        for ino, result in zip(loaded, batch_results):
+            results[ino] = result
+    return format_batch_result(body, results, start_time)
 
+
+@request_metrics.instrument('general-ocr-standard')
+@result_cache.cached('general-ocr-standard', CACHE_MODELS, CACHE_SETTINGS)
+def handler(event, context):
+    start_time = time.time()
+    body, img = parse_event(event)
+    if body is None:
+        return img
+    if 'images' in body:
+        return batch_handler(body, img, start_time)
+    dt_boxes, rec_res = text_sys(img, body.get('cls_mode'), body.get('det_mode'))
+    return format_result(body, dt_boxes, rec_res, start_time)
@@ -0,0 +1,143 @@
+import json
+import time
+from os import environ
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+
+
+class BatchStats(object):
+    """ Running counters of the batches run by a MicroBatcher """
+
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_size = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.total_run_time = 0.0
+
+    def record(self, batch_size, queue_waits, run_time):
+        self.batches += 1
+        self.requests += batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.total_queue_wait += sum(queue_waits)
+        self.max_queue_wait = max(self.max_queue_wait, max(queue_waits))
+        self.total_run_time += run_time
+
+    def to_dict(self):
+        batches = max(self.batches, 1)
+        requests = max(self.requests, 1)
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": self.requests / batches,
+            "max_batch_size": self.max_batch_size,
+            "avg_queue_wait_ms": self.total_queue_wait / requests * 1000,
+            "max_queue_wait_ms": self.max_queue_wait * 1000,
+            "avg_batch_run_ms": self.total_run_time / batches * 1000,
+        }
+
+
+class MicroBatcher(object):
+    """
+    Group concurrent requests of a gevent server into batches. A batch is
+    closed when it holds max_batch_size items or when max_wait_ms passed since
+    its first item was queued, whichever comes first. batch_fn runs on the hub
+    threadpool so the server keeps accepting requests during inference.
+
+    batch_fn returns one output per item, an exception among them fails that
+    item only. When batch_fn raises, the items of the batch are run again one
+    by one, so one bad input does not fail the requests sharing its batch.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.stats = BatchStats()
+        self.queue = Queue()
+        self.worker = gevent.spawn(self.run)
+
+    def submit(self, item):
+        """
+        Queue one item and block the calling greenlet until its batch is done.
+        return:
+            the entry of batch_fn's output matching the item
+        """
+        result = AsyncResult()
+        self.queue.put((item, result, time.time()))
+        return result.get()
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # items that queued up during the previous batch are taken
+            # without waiting once the window is over
+            timeout = max(deadline - time.time(), 0)
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def run(self):
+        threadpool = gevent.get_hub().threadpool
+        while True:
+            batch = self.collect()
+            start_time = time.time()
+            queue_waits = [start_time - queued_time for _, _, queued_time in batch]
+            self.run_batch(threadpool, batch)
+            run_time = time.time() - start_time
+            self.stats.record(len(batch), queue_waits, run_time)
+            print(json.dumps({
+                "batch_size": len(batch),
+                "max_queue_wait_ms": max(queue_waits) * 1000,
+                "batch_run_ms": run_time * 1000,
+            }))
+
+
+    def run_batch(self, threadpool, batch):
+        """ Run batch_fn on the items of batch and hand out the outputs """
+        try:
+            outputs = list(threadpool.apply(self.batch_fn, ([item for item, _, _ in batch],)))
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            print('batch of {} items failed, running them one by one: {}'.format(len(batch), e))
+            for entry in batch:
+                self.run_batch(threadpool, [entry])
+            return
+        for (_, result, _), output in zip(batch, outputs):
+            if isinstance(output, Exception):
+                result.set_exception(output)
+            else:
+                result.set(output)
+        if len(outputs) != len(batch):
+            # the items without an output would otherwise wait forever
+            error = RuntimeError('batch_fn returned {} outputs for {} items'.format(len(outputs), len(batch)))
+            print(error)
+            for _, result, _ in batch[len(outputs):]:
+                result.set_exception(error)
+
+
+def enabled():
+    return environ.get('ENABLE_MICRO_BATCHING', 'false').lower() == 'true'
+
+
+def from_environ(batch_fn):
+    """
+    Build a MicroBatcher from the container environment, micro-batching is
+    opt-in through ENABLE_MICRO_BATCHING.
+    return:
+        MicroBatcher, or None when batching is disabled
+    """
+    if not enabled():
+        return None
+    return MicroBatcher(
+        batch_fn,
+        max_batch_size=int(environ.get('BATCH_MAX_SIZE', 8)),
+        max_wait_ms=float(environ.get('BATCH_MAX_WAIT_MS', 10)))
@@ -0,0 +1,357 @@
+"""
+Content addressed cache of handler responses. The same file is copied into
+the containers whose results only depend on the input images and request
+parameters. It is opt-in through RESULT_CACHE=true and wraps a handler with
+
+    @request_metrics.instrument('object-recognition')
+    @result_cache.cached('object-recognition', [model_path + '/yolox_l.onnx'])
+    def handler(event, context):
+        ...
+
+The key of a request hashes the bytes of its images, each with the field
+it was given in, together with the handler name, the model files, the
+settings given to cached, the other request fields and
+RESULT_CACHE_VERSION, which deployments bump when a code change alters the
+results. url inputs are fetched to hash them and handed to
+the handler as img, so they are not fetched twice.
+
+Responses are looked up in an in-process LRU of RESULT_CACHE_SIZE entries,
+then in the shared backend chosen by RESULT_CACHE_BACKEND:
+- disk: one file per entry under RESULT_CACHE_DIR
+- redis: a Redis compatible server at RESULT_CACHE_URL, needs the redis
+  package
+Entries of the shared backend expire after RESULT_CACHE_TTL seconds.
+Requests asking for the duration are not cached, their response measures
+the request itself.
+"""
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+
+import numpy as np
+
+import request_metrics
+from aikits_utils import IMAGE_LIST_KEY, fetch_pool, image_fields, image_key, is_image_key, load_image, replace_images
+from inference_runtime import model_fingerprint, selected_model_path
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RESULT_CACHE = environ.get('RESULT_CACHE', 'false').lower() == 'true'
+RESULT_CACHE_SIZE = int(environ.get('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_BACKEND = environ.get('RESULT_CACHE_BACKEND', '')
+RESULT_CACHE_DIR = environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'result_cache'))
+RESULT_CACHE_DISK_MAX_ENTRIES = int(environ.get('RESULT_CACHE_DISK_MAX_ENTRIES', 10000))
+RESULT_CACHE_URL = environ.get('RESULT_CACHE_URL', 'redis://localhost:6379/0')
+RESULT_CACHE_TTL = int(environ.get('RESULT_CACHE_TTL', 24 * 3600))
+RESULT_CACHE_VERSION = environ.get('RESULT_CACHE_VERSION', '1')
+# request fields that do not change the result
+IGNORED_FIELDS = ('metrics',)
+
+
+class CacheStats(object):
+    """ Running counters of the cache lookups """
+
+    def __init__(self):
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+            }
+
+    def to_prometheus(self):
+        """
+        return:
+            the counters in the Prometheus text exposition format
+        """
+        lines = [
+            '# HELP result_cache_requests_total Requests by result cache outcome',
+            '# TYPE result_cache_requests_total counter',
+        ]
+        for outcome, count in self.to_dict().items():
+            lines.append('result_cache_requests_total{{outcome="{}"}} {}'.format(outcome, count))
+        return '\n'.join(lines) + '\n'
+
+
+class LRUCache(object):
+    """ In-process cache of the maxsize most recently used entries """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class DiskCache(object):
+    """
+    One JSON file per entry, sharded by the first two characters of the key.
+    Expired entries are removed when read, the oldest entries when there are
+    more than max_entries.
+    """
+
+    # the entries are counted every prune_every writes
+    prune_every = 100
+
+    def __init__(self, directory, ttl, max_entries):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # readers never see a partly written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        paths = []
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if os.path.isdir(shard_dir):
+                paths += [os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith('.json')]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class RedisCache(object):
+    """ Entries of a Redis compatible server, expired by the server """
+
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise ImportError('RESULT_CACHE_BACKEND=redis needs the redis package')
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+
+def build_shared_backend():
+    if not RESULT_CACHE or not RESULT_CACHE_BACKEND:
+        return None
+    if RESULT_CACHE_BACKEND == 'disk':
+        return DiskCache(RESULT_CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_DISK_MAX_ENTRIES)
+    if RESULT_CACHE_BACKEND == 'redis':
+        return RedisCache(RESULT_CACHE_URL, RESULT_CACHE_TTL)
+    raise ValueError('unsupported RESULT_CACHE_BACKEND {}'.format(RESULT_CACHE_BACKEND))
+
+
+stats = CacheStats()
+lru = LRUCache(RESULT_CACHE_SIZE)
+shared_backend = build_shared_backend()
+
+
+def digest(data):
+    sha256 = hashlib.sha256()
+    if isinstance(data, np.ndarray):
+        sha256.update('{}{}'.format(data.dtype, data.shape).encode('utf-8'))
+        sha256.update(np.ascontiguousarray(data).tobytes())
+    else:
+        sha256.update(data)
+    return sha256.hexdigest()
+
+
+def field_paths(body, fields):
+    """
+    return:
+        name of each of the image_fields of body, e.g. img_1 or
+        images[0].img, url inputs named like the img key they are loaded to
+    """
+    entries = body.get(IMAGE_LIST_KEY) if isinstance(body.get(IMAGE_LIST_KEY), list) else []
+    indexes = {id(entry): index for index, entry in enumerate(entries)}
+    return [image_key(key) if container is body else '{}[{}].{}'.format(IMAGE_LIST_KEY, indexes[id(container)], image_key(key))
+            for container, key in fields]
+
+
+def resolve_images(body):
+    """
+    Load the image inputs of body and of the entries of its image list.
+    return:
+        (body with the loaded images under img keys, (field path, digest)
+        per image), or (None, None) when an input cannot be loaded or is
+        given twice, the handler then answers the request itself
+    """
+    fields = image_fields(body)
+    if fields is None:
+        return None, None
+    load = request_metrics.propagate(lambda field: load_image(field[0][field[1]], field[1]))
+    try:
+        if len(fields) > 1:
+            images = list(fetch_pool.map(load, fields))
+        else:
+            images = [load(field) for field in fields]
+    except Exception as e:
+        print('result cache failed to load the inputs: {}'.format(e))
+        return None, None
+    return replace_images(body, fields, images), list(zip(field_paths(body, fields), [digest(image) for image in images]))
+
+
+def request_params(body):
+    """ Request fields besides the images, which the result depends on """
+    params = {key: value for key, value in body.items()
+              if not is_image_key(key) and key not in IGNORED_FIELDS and key != IMAGE_LIST_KEY}
+    if isinstance(body.get(IMAGE_LIST_KEY), list):
+        params[IMAGE_LIST_KEY] = [{key: value for key, value in entry.items() if not is_image_key(key)}
+                                  for entry in body[IMAGE_LIST_KEY]]
+    return params
+
+
+def lookup(key):
+    response = lru.get(key)
+    if response is not None:
+        stats.count('hits')
+        return response
+    if shared_backend is None:
+        return None
+    try:
+        response = shared_backend.get(key)
+    except Exception as e:
+        print('result cache lookup failed: {}'.format(e))
+        return None
+    if response is not None:
+        stats.count('shared_hits')
+        lru.set(key, response)
+    return response
+
+
+def store(key, response):
+    lru.set(key, response)
+    if shared_backend is None:
+        return
+    try:
+        shared_backend.set(key, response)
+    except Exception as e:
+        print('result cache store failed: {}'.format(e))
+
+
+def with_cache_header(response, outcome):
+    response = dict(response)
+    response['headers'] = dict(response.get('headers') or {}, **{'X-Cache': outcome})
+    return response
+
+
+def cached(handler, model_paths=(), settings=None):
+    """
+    Decorator caching the successful JSON responses of a request handler,
+    see the module docstring. Does nothing unless RESULT_CACHE is true.
+    args:
+        handler(str): name of the handler, part of the key
+        model_paths(list): model files the results depend on
+        settings(dict): configuration the results depend on, e.g. the
+            default cls_mode of the OCR handlers
+    """
+    def decorator(fn):
+        if not RESULT_CACHE:
+            return fn
+        namespace = json.dumps({
+            'handler': handler,
+            # the INT8 or FP16 variant when the sessions load one
+            'models': [model_fingerprint(selected_model_path(path)) for path in model_paths if os.path.exists(path)],
+            'settings': settings or {},
+            'version': RESULT_CACHE_VERSION,
+        }, sort_keys=True)
+
+        @functools.wraps(fn)
+        def wrapper(event, *args, **kwargs):
+            body = event.get('body') if isinstance(event, dict) else None
+            if isinstance(body, str):
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    body = None
+            if not isinstance(body, dict) or body.get('duration'):
+                stats.count('bypassed')
+                return fn(event, *args, **kwargs)
+            resolved, digests = resolve_images(body)
+            if resolved is None or not digests:
+                stats.count('bypassed')
+                return fn(event, *args, **kwargs)
+
+            with request_metrics.stage('cache_lookup'):
+                sha256 = hashlib.sha256(namespace.encode('utf-8'))
+                sha256.update(json.dumps(request_params(body), sort_keys=True, default=str).encode('utf-8'))
+                # the field of each image is part of the key, swapped inputs are a different request
+                for path, image_digest in sorted(digests):
+                    sha256.update('{}={};'.format(path, image_digest).encode('utf-8'))
+                key = sha256.hexdigest()
+                response = lookup(key)
+            if response is not None:
+                return with_cache_header(response, 'hit')
+
+            stats.count('misses')
+            event = dict(event, body=resolved)
+            response = fn(event, *args, **kwargs)
+            if isinstance(response, dict) and response.get('statusCode') == 200 and isinstance(response.get('body'), str):
+                with request_metrics.stage('cache_store'):
+                    store(key, response)
+                response = with_cache_header(response, 'miss')
+            return response
+        return wrapper
+    return decorator
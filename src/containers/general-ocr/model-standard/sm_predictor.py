@@ -1,11 +1,35 @@
 from gevent import pywsgi
 import flask
 import json
+import time
 
+import prefork
+
+# the workers are forked before any module loads models, see prefork
+listener = prefork.start()
+
+from aikits_utils import BINARY_CONTENT_TYPES, binary_body
+import async_server
 import infer_ocr_app
+import micro_batcher
+import request_metrics
+import result_cache
 
 app = flask.Flask(__name__)
 
+def run_batch(items):
+    img_list, cls_modes, det_modes = zip(*items)
+    return infer_ocr_app.text_sys.batch(list(img_list), list(cls_modes), list(det_modes))
+
+if async_server.SERVER_MODE == 'async':
+    # the scheduler runs on the gevent hub, the async server runs every
+    # request on its own on the inference workers
+    batcher = None
+    if micro_batcher.enabled():
+        print('ENABLE_MICRO_BATCHING is ignored with SERVER_MODE=async, requests are not micro-batched')
+else:
+    batcher = micro_batcher.from_environ(run_batch)
+
 @app.route('/ping', methods=['GET'])
 def ping():
     """
@@ -15,7 +39,41 @@ def ping():
     """
     status = 200
     return flask.Response(response='\n', status=status, mimetype='application/json')
-    
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Report the batch size and queue wait counters of the micro-batching scheduler.
+    :return:
+    """
+    stats = batcher.stats.to_dict() if batcher is not None else {}
+    return flask.Response(response=json.dumps(stats), status=200, mimetype='application/json')
+
+@request_metrics.instrument('general-ocr-standard')
+@result_cache.cached('general-ocr-standard', infer_ocr_app.CACHE_MODELS, infer_ocr_app.CACHE_SETTINGS)
+def batched_handler(event):
+    start_time = time.time()
+    body, img = infer_ocr_app.parse_event(event)
+    if body is None:
+        return img
+    if 'images' in body:
+        # already a batch, it does not wait for other requests
+        return infer_ocr_app.batch_handler(body, img, start_time)
+    # the batch runs on the hub threadpool, its queue wait and run are one stage
+    with request_metrics.stage('micro_batch'):
+        dt_boxes, rec_res = batcher.submit((img, body.get('cls_mode'), body.get('det_mode')))
+    return infer_ocr_app.format_result(body, dt_boxes, rec_res, start_time)
+
+@app.route('/metrics/prometheus', methods=['GET'])
+def prometheus_metrics():
+    """
+    Report the stage durations of the requests served so far in the Prometheus text format.
+    :return:
+    """
+    return flask.Response(
+        response=request_metrics.histograms.to_prometheus() + result_cache.stats.to_prometheus(),
+        status=200, mimetype='text/plain')
+
 @app.route('/invocations', methods=['POST'])
 def transformation():
     """
@@ -26,14 +84,22 @@ def transformation():
     if flask.request.content_type == 'application/json':
         request_body = flask.request.data.decode('utf-8')
         body = json.loads(request_body)
-        req = infer_ocr_app.handler({'body':body}, None)
-        return flask.Response(
-            response=req['body'],
-            status=req['statusCode'], mimetype='application/json')
+    elif flask.request.mimetype in BINARY_CONTENT_TYPES:
+        body = binary_body(flask.request.mimetype, flask.request.get_data(), flask.request.args.to_dict())
     else:
         return flask.Response(
-            response='Only supports application/json data',
+            response='Only supports application/json, image/jpeg, image/png and application/x-npy data',
             status=415, mimetype='application/json')
-            
-server = pywsgi.WSGIServer(('0.0.0.0', 8080), app)
-server.serve_forever()
\ No newline at end of file
+    if batcher is not None:
+        req = batched_handler({'body':body})
+    else:
+        req = infer_ocr_app.handler({'body':body}, None)
+    return flask.Response(
+        response=req['body'],
+        status=req['statusCode'], mimetype='application/json')
+
+if async_server.SERVER_MODE == 'async':
+    async_server.serve(infer_ocr_app.handler, extra_metrics=result_cache.stats.to_prometheus, sock=listener)
+else:
+    server = pywsgi.WSGIServer(prefork.wsgi_listener(listener), app)
+    server.serve_forever()
@@ -0,0 +1,75 @@
+"""
+Requests micro-batched by sm_predictor must get the result they get alone.
+Runs on the stand-in models of the benchmarks:
+
+    python -m pytest src/containers/general-ocr/model-standard/tests
+"""
+import os
+import sys
+import tempfile
+
+import gevent
+import numpy as np
+
+CONTAINER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(CONTAINER_DIR, os.pardir, os.pardir, os.pardir, os.pardir, 'benchmarks')
+sys.path[:0] = [CONTAINER_DIR, os.path.abspath(BENCHMARKS_DIR)]
+
+import payloads  # noqa: E402
+import targets  # noqa: E402
+
+MODEL_DIR = tempfile.mkdtemp(prefix='general-ocr-standard-')
+targets.ocr_standins('standard')(MODEL_DIR)
+os.environ.update({'MODEL_NAME': 'standard', 'MODEL_PATH': MODEL_DIR + os.sep})
+
+import infer_ocr_app  # noqa: E402
+import micro_batcher  # noqa: E402
+
+
+def run_batch(items):
+    """ batch_fn of sm_predictor, which serves on import """
+    img_list, cls_modes, det_modes = zip(*items)
+    return infer_ocr_app.text_sys.batch(list(img_list), list(cls_modes), list(det_modes))
+
+
+def assert_same_result(result, expected):
+    (boxes, rec_res), (expected_boxes, expected_rec_res) = result, expected
+    assert len(boxes) == len(expected_boxes) > 0
+    for box, expected_box in zip(boxes, expected_boxes):
+        np.testing.assert_array_equal(box, expected_box)
+    assert [text for text, _ in rec_res] == [text for text, _ in expected_rec_res]
+    np.testing.assert_allclose([score for _, score in rec_res], [score for _, score in expected_rec_res], rtol=1e-5)
+
+
+def record_batch_sizes(monkeypatch, session, method):
+    """ batch size of every call of session.method, in call order """
+    run, batch_sizes = getattr(session, method), []
+
+    def recording_run(output_names, feeds, *args, **kwargs):
+        batch_sizes.append(next(iter(feeds.values())).shape[0])
+        return run(output_names, feeds, *args, **kwargs)
+    monkeypatch.setattr(session, method, recording_run)
+    return batch_sizes
+
+
+def test_requests_of_different_sizes_share_a_batch(monkeypatch):
+    text_sys = infer_ocr_app.text_sys
+    rs = np.random.RandomState(0)
+    # resized to 720x960 and 768x960, both padded to the 800x960 bucket
+    images = [payloads.document_image(rs, 1280, 960), payloads.document_image(rs, 1200, 960)]
+    rec_batch_sizes = record_batch_sizes(monkeypatch, text_sys.text_recognizer.ort_session, 'run_bound')
+    expected = [text_sys(img) for img in images]
+    rec_runs_alone = len(rec_batch_sizes)
+    del rec_batch_sizes[:]
+    det_batch_sizes = record_batch_sizes(monkeypatch, text_sys.text_detector.ort_session, 'run')
+
+    batcher = micro_batcher.MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=1000)
+    greenlets = [gevent.spawn(batcher.submit, (img, None, None)) for img in images]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert batcher.stats.max_batch_size == 2
+    assert det_batch_sizes == [2]
+    # the crops of both requests share the recognizer batches
+    assert len(rec_batch_sizes) < rec_runs_alone
+    for greenlet, result in zip(greenlets, expected):
+        assert_same_result(greenlet.value, result)
@@ -10,9 +10,10 @@ import numpy as np
 from os import environ
 from PIL import Image
 import cv2
-from aikits_utils import readimg
-import onnxruntime
+from aikits_utils import BINARY_CONTENT_TYPES, binary_accept, binary_body, binary_image_return, readimg
+from inference_runtime import create_session
 import time
+import request_metrics
 
 app = flask.Flask(__name__)
 
@@ -28,8 +29,7 @@ def read_img(body):
             return str(k)
     return img
 
-ort_session = onnxruntime.InferenceSession(os.environ['MODEL_PATH'] + 'chroma-key.onnx', providers=['CUDAExecutionProvider'])
-_ = ort_session.run(None, {"input": np.zeros([1, 3, 64, 64], dtype='float32')})
+ort_session = create_session(os.environ['MODEL_PATH'] + 'chroma-key.onnx', device='cuda', warmup_shapes={'input': [1, 3, 64, 64]})
 
 print('load success')
 @app.route('/ping', methods=['GET'])
@@ -47,7 +47,16 @@ def ping():
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
 
+@app.route('/metrics/prometheus', methods=['GET'])
+def prometheus_metrics():
+    """
+    Report the stage durations of the requests served so far in the Prometheus text format.
+    :return:
+    """
+    return flask.Response(response=request_metrics.histograms.to_prometheus(), status=200, mimetype='text/plain')
+
 @app.route('/invocations', methods=['POST'])
+@request_metrics.instrument('green-screen-matting')
 def transformation():
     """
     Do an inference on a single batch of data. In this sample server, we take image data as base64 formation,
@@ -59,53 +68,63 @@ def transformation():
         body = json.loads(request_body)
         if "body" in body:
             body = body["body"]
-        if 'url' in body and 'img' in body:
-            return lambda_return(400, '`url` and `img` cannot be used at the same time')
-        img = read_img(body)
-        if isinstance(img, str):
-            return lambda_return(400, f'`parameter `{img}` illegal')
-        pil_image = img
-        src = np.array(img)[:, :, :3]
+    elif flask.request.mimetype in BINARY_CONTENT_TYPES:
+        body = binary_body(flask.request.mimetype, flask.request.get_data(), flask.request.args.to_dict())
     else:
         return flask.Response(
-            response='Object detector only supports application/json data',
+            response='Object detector only supports application/json, image/jpeg, image/png and application/x-npy data',
             status=415, mimetype='application/json')
+    if 'url' in body and 'img' in body:
+        return lambda_return(400, '`url` and `img` cannot be used at the same time')
+    img = read_img(body)
+    if isinstance(img, str):
+        return lambda_return(400, f'`parameter `{img}` illegal')
+    pil_image = img
+    src = np.array(img)[:, :, :3]
 
-    output_size = 1024
-    h, w = src.shape[:2]
-    new_h, new_w = output_size, output_size
-    img = cv2.resize(src, (new_w,new_h))/255
-    img = img-0.5 
-    in_frame = (np.ascontiguousarray(np.transpose(img, (2, 0, 1)))).astype('float32')
+    with request_metrics.stage('preprocess'):
+        output_size = 1024
+        h, w = src.shape[:2]
+        new_h, new_w = output_size, output_size
+        img = cv2.resize(src, (new_w,new_h))/255
+        img = img-0.5 
+        in_frame = (np.ascontiguousarray(np.transpose(img, (2, 0, 1)))).astype('float32')
     ort_inputs = {ort_session.get_inputs()[0].name: np.expand_dims(in_frame, 0)}
 
     ort_outs = ort_session.run(None, ort_inputs)
-    result = ort_outs[0][0][0]
-    result = cv2.resize(result, (w,h))
-    ma = result.max()
-    mi = result.min()
-    result = ((result-mi)/(ma-mi))
-    result = np.clip(result, 0.02, 0.98)
-    output = (result - result.min()) / (result.max() - result.min())
+    with request_metrics.stage('postprocess'):
+        result = ort_outs[0][0][0]
+        result = cv2.resize(result, (w,h))
+        ma = result.max()
+        mi = result.min()
+        result = ((result-mi)/(ma-mi))
+        result = np.clip(result, 0.02, 0.98)
+        output = (result - result.min()) / (result.max() - result.min())
 
-    im = Image.fromarray((output * 255).astype('uint8'))
-    buffered = BytesIO()
-    im.save(buffered, format="png")
+        im = Image.fromarray((output * 255).astype('uint8'))
+    with request_metrics.stage('serialize'):
+        body.setdefault('accept', flask.request.headers.get('Accept'))
+        accept = binary_accept(body)
+        if accept:
+            req = binary_image_return(im, accept)
+            return flask.Response(response=req['body'], status=req['statusCode'], headers=req['headers'])
+        buffered = BytesIO()
+        im.save(buffered, format="png")
 
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-    result = {'result': img_str}
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST,GET'
-        },
+        result = {'result': img_str}
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST,GET'
+            },
 
-        'body': json.dumps(result)
-    }
+            'body': json.dumps(result)
+        }
 
 server = pywsgi.WSGIServer(('0.0.0.0', 8080), app)
 server.serve_forever()
\ No newline at end of file
@@ -2,17 +2,16 @@ import json
 import os
 
 import numpy as np
-import onnxruntime
 import cv2
 from aikits_utils import readimg, lambda_return
+import request_metrics
+import result_cache
 
-import GPUtil
-cuda_available = True if len(GPUtil.getGPUs()) else False
-if cuda_available:
-    print(GPUtil.getGPUs()[0].name)
+from inference_runtime import create_session
 
 model_path = os.environ['MODEL_PATH']
-ort_session = onnxruntime.InferenceSession(model_path + '/image-similarity.onnx', providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+ort_session = create_session(model_path + '/image-similarity.onnx')
+INPUT_SIZE = (448, 448)
 
 def get_cos_similar(v1, v2):
     num = float(np.dot(v1, v2))
@@ -20,11 +19,14 @@ def get_cos_similar(v1, v2):
     return 0.5 + 0.5 * (num / denom)
     
 def get_embedding(img):
-    img = cv2.resize(img/255, (448,448))
-    img = img.transpose((2,0,1))[np.newaxis,:].astype('float32')
+    with request_metrics.stage('preprocess'):
+        img = cv2.resize(img/255, INPUT_SIZE)
+        img = img.transpose((2,0,1))[np.newaxis,:].astype('float32')
     img_embedding = ort_session.run(['output'], {'input': img})[0][0]
     return img_embedding
 
+@request_metrics.instrument('image-similarity')
+@result_cache.cached('image-similarity', [model_path + '/image-similarity.onnx'])
 def handler(event, context):
     try:
         if isinstance(event['body'], str):
@@ -35,19 +37,19 @@ def handler(event, context):
             return lambda_return(400, '`url` and `img` cannot be used at the same time')
         if 'url_1' in body:
             task = 'multi'
-            inputs = readimg(body, ['url_1', 'url_2'])
+            inputs = readimg(body, ['url_1', 'url_2'], min_size=INPUT_SIZE)
             img_1, img_2 = inputs['url_1'], inputs['url_2']
         elif 'img_1' in body:
             task = 'multi'
-            inputs = readimg(body, ['img_1', 'img_2'])
+            inputs = readimg(body, ['img_1', 'img_2'], min_size=INPUT_SIZE)
             img_1, img_2 = inputs['img_1'], inputs['img_2']
         elif 'url' in body:
             task = 'single'
-            inputs = readimg(body, ['url'])
+            inputs = readimg(body, ['url'], min_size=INPUT_SIZE)
             img = inputs['url']
         else:
             task = 'single'
-            inputs = readimg(body, ['img'])
+            inputs = readimg(body, ['img'], min_size=INPUT_SIZE)
             img = inputs['img']
         for k, v in inputs.items():
             if v is None:
@@ -62,4 +64,5 @@ def handler(event, context):
         img_embedding_1 = get_embedding(img_1)
         img_embedding_2 = get_embedding(img_2)
         result = {'similarity': float(get_cos_similar(img_embedding_1, img_embedding_2).round(6))}
-    return lambda_return(200, json.dumps(result))
\ No newline at end of file
+    with request_metrics.stage('serialize'):
+        return lambda_return(200, json.dumps(result))
\ No newline at end of file
@@ -0,0 +1,391 @@
+"""
+Job mode for requests that run longer than API Gateway and Lambda allow, e.g.
+large documents or x4 super resolution. The same file is copied into the
+containers whose requests can take that long. It is opt-in through
+JOB_MODE=true and wraps a handler with
+
+    @job_queue.jobs('layout-analysis')
+    @request_metrics.instrument('layout-analysis')
+    def handler(event, context):
+        ...
+
+A request with "async": true is answered at once with 202 and a job id,
+"priority" (default 0, higher runs first) and "callback_url" are optional:
+
+    {"url": "s3://bucket/doc.png", "async": true, "priority": 1, "callback_url": "https://..."}
+    -> {"JobId": "3f2c...", "JobStatus": "QUEUED"}
+
+A request with the job id reports the job, with the handler's result once
+it SUCCEEDED and its error once it FAILED:
+
+    {"job_id": "3f2c..."}
+    -> {"JobId": "3f2c...", "JobStatus": "SUCCEEDED", "StatusCode": 200, "Result": [...]}
+
+Jobs are recorded in the store chosen by JOB_STORE:
+- disk: one file per job under JOB_DIR, shared by the worker processes of a
+  SageMaker container
+- s3: objects under s3://JOB_BUCKET/JOB_PREFIX, needed on Lambda or when
+  several containers serve the same jobs
+On SageMaker, jobs wait in a queue of at most JOB_QUEUE_SIZE jobs and run on
+JOB_WORKERS threads. On Lambda the function invokes itself asynchronously
+for each job and reads the request back from the store, priorities do not
+apply there. When the job has a callback_url, its final record is POSTed
+there as JSON.
+"""
+import functools
+import itertools
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+from os import environ
+
+import boto3
+
+from aikits_utils import get_s3_client, http, lambda_return
+
+JOB_MODE = environ.get('JOB_MODE', 'false').lower() == 'true'
+JOB_STORE = environ.get('JOB_STORE', 'disk')
+JOB_DIR = environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'jobs'))
+JOB_BUCKET = environ.get('JOB_BUCKET', '')
+JOB_PREFIX = environ.get('JOB_PREFIX', 'jobs/')
+JOB_TTL = int(environ.get('JOB_TTL', 24 * 3600))
+JOB_QUEUE_SIZE = int(environ.get('JOB_QUEUE_SIZE', 16))
+JOB_WORKERS = int(environ.get('JOB_WORKERS', 1))
+# 'lambda' runs each job in an asynchronous invocation of the function
+JOB_RUNNER = environ.get('JOB_RUNNER', 'lambda' if 'AWS_LAMBDA_FUNCTION_NAME' in environ else 'thread')
+
+QUEUED = 'QUEUED'
+IN_PROGRESS = 'IN_PROGRESS'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+# request fields of job mode, they are not passed on to the handler
+JOB_FIELDS = ('async', 'priority', 'callback_url')
+# key of the event a Lambda function sends itself to run a job
+JOB_EVENT_KEY = 'aikits_job'
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobStats(object):
+    """ Running counters of the jobs by final status """
+
+    def __init__(self):
+        self.counts = {QUEUED: 0, SUCCEEDED: 0, FAILED: 0}
+        self.lock = threading.Lock()
+
+    def count(self, status):
+        with self.lock:
+            self.counts[status] += 1
+
+    def to_prometheus(self, queue_depth=0):
+        """
+        return:
+            the counters and the queue depth in the Prometheus text
+            exposition format
+        """
+        lines = [
+            '# HELP jobs_total Jobs submitted and finished',
+            '# TYPE jobs_total counter',
+        ]
+        with self.lock:
+            for status, count in self.counts.items():
+                lines.append('jobs_total{{status="{}"}} {}'.format(status.lower(), count))
+        lines += [
+            '# HELP job_queue_depth Jobs waiting for a worker',
+            '# TYPE job_queue_depth gauge',
+            'job_queue_depth {}'.format(queue_depth),
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+class DiskJobStore(object):
+    """
+    One JSON file per key, written atomically. Files older than ttl are
+    removed every prune_every writes.
+    """
+
+    prune_every = 100
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self.path(key))
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class S3JobStore(object):
+    """ One JSON object per key, expired by a lifecycle rule of the bucket """
+
+    def __init__(self, bucket, prefix):
+        if not bucket:
+            raise ValueError('JOB_STORE=s3 needs JOB_BUCKET')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            response = get_s3_client().get_object(Bucket=self.bucket, Key=self.prefix + key + '.json')
+        except get_s3_client().exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def put(self, key, value):
+        get_s3_client().put_object(
+            Bucket=self.bucket, Key=self.prefix + key + '.json',
+            Body=json.dumps(value).encode('utf-8'), ContentType='application/json')
+
+    def delete(self, key):
+        get_s3_client().delete_object(Bucket=self.bucket, Key=self.prefix + key + '.json')
+
+
+class JobQueue(object):
+    """
+    Bounded priority queue of jobs, run by worker threads started with the
+    first job. Jobs of the same priority run in submission order.
+    """
+
+    def __init__(self, maxsize, workers):
+        self.queue = queue.PriorityQueue(maxsize)
+        self.order = itertools.count()
+        self.workers = workers
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, priority, job):
+        """
+        args:
+            job(callable): runs the job without arguments
+        raise:
+            queue.Full when maxsize jobs are waiting
+        """
+        self.start()
+        self.queue.put_nowait((-priority, next(self.order), job))
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            try:
+                job()
+            except Exception as e:
+                print('job failed: {}'.format(e))
+            finally:
+                self.queue.task_done()
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+def build_store():
+    if not JOB_MODE:
+        return None
+    if JOB_STORE == 'disk':
+        if JOB_RUNNER == 'lambda':
+            raise ValueError('JOB_MODE on Lambda needs JOB_STORE=s3')
+        return DiskJobStore(JOB_DIR, JOB_TTL)
+    if JOB_STORE == 's3':
+        return S3JobStore(JOB_BUCKET, JOB_PREFIX)
+    raise ValueError('unsupported JOB_STORE {}'.format(JOB_STORE))
+
+
+stats = JobStats()
+store = build_store()
+job_queue = JobQueue(JOB_QUEUE_SIZE, JOB_WORKERS)
+lambda_client = None
+
+
+def to_prometheus():
+    return stats.to_prometheus(job_queue.depth())
+
+
+def valid_job_id(job_id):
+    return isinstance(job_id, str) and JOB_ID_PATTERN.match(job_id) is not None
+
+
+def finish(record, response):
+    """ Add the outcome of a handler response to the job record """
+    record = dict(record, FinishedAt=time.time())
+    status_code = response.get('statusCode', 500) if isinstance(response, dict) else 500
+    body = response.get('body') if isinstance(response, dict) else None
+    record['StatusCode'] = status_code
+    if status_code != 200:
+        record['JobStatus'] = FAILED
+        record['StatusMessage'] = body if isinstance(body, str) else 'the handler failed'
+        return record
+    record['JobStatus'] = SUCCEEDED
+    try:
+        record['Result'] = json.loads(body)
+    except (TypeError, ValueError):
+        record['JobStatus'] = FAILED
+        record['StatusMessage'] = 'the handler returned no JSON result'
+    return record
+
+
+def notify(callback_url, record):
+    try:
+        response = http.request(
+            'POST', callback_url, body=json.dumps(record).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        if response.status >= 300:
+            print('job callback {} returned status {}'.format(callback_url, response.status))
+    except Exception as e:
+        print('job callback {} failed: {}'.format(callback_url, e))
+
+
+def run_job(fn, job_id, body, callback_url=None):
+    record = dict(store.get(job_id) or {'JobId': job_id}, JobStatus=IN_PROGRESS, StartedAt=time.time())
+    store.put(job_id, record)
+    try:
+        response = fn({'body': body}, None)
+    except Exception as e:
+        print('job {} failed: {}'.format(job_id, e))
+        response = lambda_return(500, 'the handler failed')
+    record = finish(record, response)
+    store.put(job_id, record)
+    stats.count(record['JobStatus'])
+    if callback_url:
+        notify(callback_url, record)
+
+
+def invoke_self(job_id, callback_url):
+    global lambda_client
+    if lambda_client is None:
+        lambda_client = boto3.client('lambda')
+    lambda_client.invoke(
+        FunctionName=environ['AWS_LAMBDA_FUNCTION_NAME'], InvocationType='Event',
+        Payload=json.dumps({JOB_EVENT_KEY: {'job_id': job_id, 'callback_url': callback_url}}).encode('utf-8'))
+
+
+def run_invoked_job(fn, job):
+    """ Run a job sent by invoke_self, its request is kept in the store """
+    job_id = job.get('job_id')
+    if not valid_job_id(job_id):
+        return lambda_return(400, 'invalid job')
+    request_key = job_id + '.request'
+    body = store.get(request_key)
+    if body is None:
+        return lambda_return(404, 'job request not found')
+    run_job(fn, job_id, body, job.get('callback_url'))
+    store.delete(request_key)
+    return lambda_return(200, json.dumps({'JobId': job_id}))
+
+
+def submit(fn, body):
+    try:
+        priority = int(body.get('priority', 0))
+    except (TypeError, ValueError):
+        return lambda_return(400, '`priority` must be an integer')
+    callback_url = body.get('callback_url')
+    if callback_url is not None and not (isinstance(callback_url, str) and callback_url.startswith('http')):
+        return lambda_return(400, '`callback_url` must be an http(s) url')
+    # job results are stored as JSON, so raw image outputs are not available
+    body = {key: value for key, value in body.items() if key not in JOB_FIELDS and key != 'accept'}
+    job_id = uuid.uuid4().hex
+    record = {'JobId': job_id, 'JobStatus': QUEUED, 'Priority': priority, 'SubmittedAt': time.time()}
+    store.put(job_id, record)
+    if JOB_RUNNER == 'lambda':
+        store.put(job_id + '.request', body)
+        try:
+            invoke_self(job_id, callback_url)
+        except Exception:
+            store.delete(job_id + '.request')
+            store.delete(job_id)
+            raise
+    else:
+        try:
+            job_queue.submit(priority, functools.partial(run_job, fn, job_id, body, callback_url))
+        except queue.Full:
+            store.delete(job_id)
+            return lambda_return(503, 'job queue is full')
+    stats.count(QUEUED)
+    return lambda_return(202, json.dumps({'JobId': job_id, 'JobStatus': QUEUED}))
+
+
+def status(job_id):
+    if not valid_job_id(job_id):
+        return lambda_return(400, '`job_id` illegal')
+    record = store.get(job_id)
+    if record is None:
+        return lambda_return(404, 'job not found')
+    return lambda_return(200, json.dumps(record))
+
+
+def jobs(handler):
+    """
+    Decorator adding job mode to a request handler, see the module
+    docstring. Does nothing unless JOB_MODE is true.
+    args:
+        handler(str): name of the handler, used in the logs
+    """
+    def decorator(fn):
+        if not JOB_MODE:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(event, *args, **kwargs):
+            if isinstance(event, dict) and JOB_EVENT_KEY in event:
+                return run_invoked_job(fn, event[JOB_EVENT_KEY])
+            body = event.get('body') if isinstance(event, dict) else None
+            if isinstance(body, str):
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    body = None
+            if not isinstance(body, dict):
+                return fn(event, *args, **kwargs)
+            if 'job_id' in body:
+                return status(body['job_id'])
+            if body.get('async') is True:
+                try:
+                    return submit(fn, body)
+                except Exception as e:
+                    print('{} failed to submit a job: {}'.format(handler, e))
+                    return lambda_return(500, 'failed to submit the job')
+            return fn(event, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,20 +1,18 @@
 import base64
 import json
 import os
+from functools import partial
 from io import BytesIO
 
 import numpy as np
-import onnxruntime
 from PIL import Image
 import base64
-from aikits_utils import readimg, lambda_return
+from aikits_utils import binary_accept, binary_image_return, readimg, lambda_return
+import job_queue
+import request_metrics
+from inference_runtime import create_session, LazyModelRegistry
 import cv2
 
-import GPUtil
-cuda_available = True if len(GPUtil.getGPUs()) else False
-if cuda_available:
-    print(GPUtil.getGPUs()[0].name)
-    
 def read_img(body):
     if 'url' in body:
         inputs = readimg(body, ['url'])
@@ -36,10 +34,15 @@ def tensor2img(tensor, out_type=np.uint8, min_max=(0, 1)):
 
 
 model_path = os.environ['MODEL_PATH']
-ort_session_x2 = onnxruntime.InferenceSession(model_path + '/Real_ESRGAN_x2.onnx', providers=[("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"})] if cuda_available else ['CPUExecutionProvider'])
-ort_session_x4 = onnxruntime.InferenceSession(model_path + '/Real_ESRGAN_x4.onnx', providers=[("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"})] if cuda_available else ['CPUExecutionProvider'])
+ort_sessions = LazyModelRegistry()
+for scale in [2, 4]:
+    model_file = model_path + '/Real_ESRGAN_x%d.onnx' % scale
+    ort_sessions.register('x%d' % scale, partial(create_session, model_file, provider_options={'cudnn_conv_algo_search': 'HEURISTIC'}), [model_file])
+ort_sessions.preload()
 
 
+@job_queue.jobs('image-super-resolution')
+@request_metrics.instrument('image-super-resolution')
 def handler(event, context):
     if "body" not in event:
         return lambda_return(400, 'invalid param')
@@ -58,21 +61,27 @@ def handler(event, context):
     
     scale = int(body.get('scale', 2))
     if scale == 4:
-        ort_session = ort_session_x4
+        ort_session = ort_sessions['x4']
     else:
-        ort_session = ort_session_x2
+        ort_session = ort_sessions['x2']
     h,w,_ = img.shape
-    img = cv2.resize(img, (w//scale*scale, h//scale*scale))
-    in_frame = (np.ascontiguousarray(np.transpose(img, (2, 0, 1))) / 255).astype('float32')
+    with request_metrics.stage('preprocess'):
+        img = cv2.resize(img, (w//scale*scale, h//scale*scale))
+        in_frame = (np.ascontiguousarray(np.transpose(img, (2, 0, 1))) / 255).astype('float32')
 
     ort_inputs = {ort_session.get_inputs()[0].name: np.expand_dims(in_frame, 0)}
     ort_outs = ort_session.run(None, ort_inputs)
-    rlt = tensor2img(ort_outs[0][0])
-    rlt = cv2.resize(rlt, (w*scale, h*scale))
-    imo = Image.fromarray(rlt)
-    buffered = BytesIO()
-    imo.save(buffered, format="png")
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    with request_metrics.stage('postprocess'):
+        rlt = tensor2img(ort_outs[0][0])
+        rlt = cv2.resize(rlt, (w*scale, h*scale))
+        imo = Image.fromarray(rlt)
+    with request_metrics.stage('serialize'):
+        accept = binary_accept(body)
+        if accept:
+            return binary_image_return(imo, accept)
+        buffered = BytesIO()
+        imo.save(buffered, format="png")
+        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-    result = {'result': img_str}
-    return lambda_return(200, json.dumps(result))
\ No newline at end of file
+        result = {'result': img_str}
+        return lambda_return(200, json.dumps(result))
\ No newline at end of file
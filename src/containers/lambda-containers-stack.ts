@@ -1,12 +1,23 @@
 #!/usr/bin/env node
 import {
+  Duration,
+  RemovalPolicy,
   Stack,
   StackProps,
 } from 'aws-cdk-lib';
+import {
+  Policy,
+  PolicyStatement,
+} from 'aws-cdk-lib/aws-iam';
 import {
   DockerImageCode,
   DockerImageFunction,
 } from 'aws-cdk-lib/aws-lambda';
+import {
+  BlockPublicAccess,
+  Bucket,
+  BucketEncryption,
+} from 'aws-cdk-lib/aws-s3';
 import { Construct } from 'constructs';
 import 'source-map-support/register';
 
@@ -26,6 +37,15 @@ export class LambdaContainersStack extends Stack {
         ),
       },
     );
+    // job mode, see the layout analysis README
+    const LayoutAnalysisJobs = new Bucket(this, 'layout-analysis-jobs', {
+      encryption: BucketEncryption.S3_MANAGED,
+      blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+      enforceSSL: true,
+      removalPolicy: RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [{ expiration: Duration.days(1) }],
+    });
     const LayoutAnalysis = new DockerImageFunction(
       this,
       'layout-analysis',
@@ -36,7 +56,23 @@ export class LambdaContainersStack extends Stack {
             file: 'Dockerfile.lambda',
           },
         ),
+        timeout: Duration.minutes(5),
+        environment: {
+          JOB_MODE: 'true',
+          JOB_STORE: 's3',
+          JOB_BUCKET: LayoutAnalysisJobs.bucketName,
+        },
       },
     );
+    LayoutAnalysisJobs.grantReadWrite(LayoutAnalysis);
+    // a policy of its own, the function already depends on the default
+    // policy of its role
+    new Policy(this, 'layout-analysis-invoke-self', {
+      roles: [LayoutAnalysis.role!],
+      statements: [new PolicyStatement({
+        actions: ['lambda:InvokeFunction'],
+        resources: [LayoutAnalysis.functionArn],
+      })],
+    });
   }
 }
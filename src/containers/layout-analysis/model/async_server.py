@@ -0,0 +1,207 @@
+"""
+asyncio SageMaker server, chosen with SERVER_MODE=async instead of the
+gevent server of sm_predictor.py. The same file is copied into every
+container with a SageMaker image and serves the same routes:
+
+    if async_server.SERVER_MODE == 'async':
+        async_server.serve(infer_ocr_app.handler)
+
+The event loop only reads requests, loads and decodes their image inputs on
+the fetch pool of aikits_utils and writes responses. Handlers run on a pool of
+INFERENCE_WORKERS threads sharing the model sessions, so the inputs of the
+next requests are loaded while the current ones are inferred, and /ping and
+/metrics/prometheus answer while every worker is busy.
+
+- MAX_PENDING_REQUESTS bounds the requests being loaded, queued or run,
+  further requests get 503 until one finishes
+- /ping answers 503 once a handler has run for more than PING_STALL_SECONDS,
+  so SageMaker replaces a stuck container
+- the prefetch and queue_wait stages of every request are added to the
+  histograms of request_metrics under the async-server handler
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import aikits_utils
+import request_metrics
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+SERVER_MODE = environ.get('SERVER_MODE', 'gevent')
+INFERENCE_WORKERS = int(environ.get('INFERENCE_WORKERS', 2))
+MAX_PENDING_REQUESTS = int(environ.get('MAX_PENDING_REQUESTS', 64))
+PING_STALL_SECONDS = float(environ.get('PING_STALL_SECONDS', 300))
+MAX_REQUEST_BYTES = int(environ.get('MAX_REQUEST_BYTES', 64 << 20))
+PORT = 8080
+METRICS_HANDLER = 'async-server'
+
+
+class InflightRequests(object):
+    """ Start times of the handlers running on the inference workers """
+
+    def __init__(self):
+        self.started = {}
+        self.lock = threading.Lock()
+
+    def start(self, token):
+        with self.lock:
+            self.started[token] = time.monotonic()
+
+    def finish(self, token):
+        with self.lock:
+            self.started.pop(token, None)
+
+    def longest(self):
+        """
+        return:
+            seconds the oldest running handler has been running, 0 if none
+        """
+        with self.lock:
+            if not self.started:
+                return 0.0
+            return time.monotonic() - min(self.started.values())
+
+
+def json_response(text, status):
+    return web.Response(text=text, status=status, content_type='application/json')
+
+
+def unsupported_message():
+    if hasattr(aikits_utils, 'binary_body'):
+        return 'Only supports application/json, image/jpeg, image/png and application/x-npy data'
+    return 'Only supports application/json data'
+
+
+async def prefetch(loop, body, min_size=None):
+    """
+    Load and decode the image inputs of body on the fetch pool, the handler
+    then reads them from img keys like the raw bytes of binary requests, see
+    aikits_utils.preload_image.
+    args:
+        min_size(tuple): min_size the handler reads its images with
+    return:
+        body with the loaded inputs, or body as it is when it has none, one
+        of them cannot be loaded or is given twice, the handler then answers
+        the request itself
+    """
+    if not isinstance(body, dict) or not hasattr(aikits_utils, 'image_fields'):
+        return body
+    fields = aikits_utils.image_fields(body)
+    if not fields:
+        return body
+    try:
+        images = await asyncio.gather(*[
+            loop.run_in_executor(aikits_utils.fetch_pool, request_metrics.propagate(aikits_utils.preload_image),
+                                 container[key], key, min_size)
+            for container, key in fields])
+    except Exception as e:
+        print('async server failed to load the inputs: {}'.format(e))
+        return body
+    return aikits_utils.replace_images(body, fields, images)
+
+
+def build_app(handler, forward_accept=False, extra_metrics=None, min_size=None):
+    """
+    args:
+        handler(callable): handler(event, context) of the container
+        forward_accept(bool): pass an image Accept header to the handler as
+            the accept field, for handlers returning raw images
+        extra_metrics(callable): returns Prometheus text appended to the
+            stage histograms, e.g. the result cache counters
+        min_size(tuple): min_size the handler passes to readimg, the inputs
+            are decoded with it ahead of the handler
+    return:
+        the aiohttp application
+    """
+    if web is None:
+        raise ImportError('SERVER_MODE=async needs the aiohttp package')
+    workers = ThreadPoolExecutor(INFERENCE_WORKERS)
+    inflight = InflightRequests()
+    pending = [0]
+
+    def run_handler(body, queued_at):
+        token = object()
+        inflight.start(token)
+        try:
+            request_metrics.histograms.observe(METRICS_HANDLER, {'queue_wait': time.perf_counter() - queued_at})
+            return handler({'body': body}, None)
+        finally:
+            inflight.finish(token)
+
+    async def ping(request):
+        """
+        Healthy unless a handler has been running for more than PING_STALL_SECONDS.
+        """
+        if inflight.longest() > PING_STALL_SECONDS:
+            return json_response('\n', 503)
+        return json_response('\n', 200)
+
+    async def prometheus_metrics(request):
+        """
+        Report the stage durations of the requests served so far in the Prometheus text format.
+        """
+        text = request_metrics.histograms.to_prometheus()
+        if extra_metrics is not None:
+            text += extra_metrics()
+        return web.Response(text=text, status=200, content_type='text/plain')
+
+    async def transformation(request):
+        """
+        Load the inputs of the request, run the handler on an inference worker and return its response.
+        """
+        if request.content_type == 'application/json':
+            body = json.loads(await request.text())
+        elif request.content_type in getattr(aikits_utils, 'BINARY_CONTENT_TYPES', ()):
+            body = aikits_utils.binary_body(request.content_type, await request.read(), dict(request.query))
+        else:
+            return json_response(unsupported_message(), 415)
+        if pending[0] >= MAX_PENDING_REQUESTS:
+            return json_response('Too many pending requests', 503)
+        if forward_accept and request.headers.get('Accept') in aikits_utils.BINARY_IMAGE_TYPES:
+            body.setdefault('accept', request.headers['Accept'])
+
+        pending[0] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            body = await prefetch(loop, body, min_size)
+            queued_at = time.perf_counter()
+            request_metrics.histograms.observe(METRICS_HANDLER, {'prefetch': queued_at - start})
+            req = await loop.run_in_executor(workers, run_handler, body, queued_at)
+        finally:
+            pending[0] -= 1
+
+        headers = req.get('headers') or {}
+        response_body = req['body']
+        return web.Response(
+            body=response_body.encode('utf-8') if isinstance(response_body, str) else response_body,
+            status=req['statusCode'], content_type=headers.get('Content-Type', 'application/json'),
+            headers={k: v for k, v in headers.items() if k.startswith('X-Image-')})
+
+    app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    app.router.add_get('/ping', ping)
+    app.router.add_get('/metrics/prometheus', prometheus_metrics)
+    app.router.add_post('/invocations', transformation)
+    return app
+
+
+def serve(handler, forward_accept=False, extra_metrics=None, sock=None, min_size=None):
+    """
+    Serve handler until the process is stopped, see build_app.
+    args:
+        sock(socket): listening socket of a prefork worker, by default the
+            server binds port 8080
+    """
+    app = build_app(handler, forward_accept, extra_metrics, min_size)
+    if sock is not None:
+        web.run_app(app, sock=sock, print=None)
+    else:
+        web.run_app(app, host='0.0.0.0', port=PORT, print=None)
+
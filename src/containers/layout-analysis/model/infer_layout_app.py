@@ -4,6 +4,8 @@ from os import environ
 
 import cv2
 from aikits_utils import readimg, lambda_return
+import job_queue
+import request_metrics
 
 from main import structure_predict
 
@@ -22,6 +24,8 @@ def read_img(body):
             return str(k)
     return img
 
+@job_queue.jobs('layout-analysis')
+@request_metrics.instrument('layout-analysis')
 def handler(event, context):
     start_time = time.time()
     if "body" not in event:
@@ -43,7 +47,8 @@ def handler(event, context):
     output_format = body.get("output_format", 'json')
     table_format = body.get("table_format", 'html')
     result = structure_predict(img, lang, output_format, table_format)
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
-    return lambda_return(200, json.dumps(result))
+    with request_metrics.stage('serialize'):
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
+        return lambda_return(200, json.dumps(result))
 
@@ -18,18 +18,16 @@ import numpy as np
 import time
 
 from utils import preprocess, multiclass_nms, postprocess
-import onnxruntime
-import GPUtil
-if len(GPUtil.getGPUs()):
-    provider = [("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"}), "CPUExecutionProvider"]
+from inference_runtime import create_session, cuda_available
+import request_metrics
+if cuda_available:
     model = 'layout.onnx'
 else:
-    provider = ["CPUExecutionProvider"]
     model = 'layout_s.onnx'
 
 class LayoutPredictor(object):
     def __init__(self):
-        self.ort_session = onnxruntime.InferenceSession(os.path.join(os.environ['MODEL_PATH'], model), providers=provider)
+        self.ort_session = create_session(os.path.join(os.environ['MODEL_PATH'], model), provider_options={'cudnn_conv_algo_search': 'HEURISTIC'})
         #_ = self.ort_session.run(['output'], {'images': np.zeros((1,3,640,640), dtype='float32')})[0]
         self.categorys = ['text', 'title', 'figure', 'table']
     def __call__(self, img):
@@ -40,21 +38,23 @@ class LayoutPredictor(object):
         h,w,_ = img.shape
         h_ori, w_ori, _ = img.shape
         h, w = (640, 640)
-        image, ratio = preprocess(img, (h, w))
-        res = self.ort_session.run(['output'], {'images': image[np.newaxis,:]})[0]
-        predictions = postprocess(res, (h, w), p6=False)[0]
-        boxes = predictions[:, :4]
+        with request_metrics.stage('layout_preprocess'):
+            image, ratio = preprocess(img, (h, w))
+        res = self.ort_session.run_bound(['output'], {'images': image[np.newaxis,:]})[0]
+        with request_metrics.stage('layout_postprocess'):
+            predictions = postprocess(res, (h, w), p6=False)[0]
+            boxes = predictions[:, :4]
         
-        scores = predictions[:, 4, None] * predictions[:, 5:]
+            scores = predictions[:, 4, None] * predictions[:, 5:]
         
-        boxes_xyxy = np.ones_like(boxes)
-        boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2]/2.
-        boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3]/2.
-        boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2]/2.
-        boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3]/2.
-        boxes_xyxy /= ratio
+            boxes_xyxy = np.ones_like(boxes)
+            boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2]/2.
+            boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3]/2.
+            boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2]/2.
+            boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3]/2.
+            boxes_xyxy /= ratio
         
-        dets = multiclass_nms(boxes_xyxy, scores, nms_thr=0.15, score_thr=0.3)
+            dets = multiclass_nms(boxes_xyxy, scores, nms_thr=0.15, score_thr=0.3)
         if dets is None:
             return [], time.time() - starttime
         scores = dets[:, 4]
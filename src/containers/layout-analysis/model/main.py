@@ -15,6 +15,7 @@ from markdownify import markdownify as md
 from utils import check_and_read
 from xycut import recursive_xy_cut
 import time
+import request_metrics
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -98,6 +99,9 @@ class StructureSystem(object):
             })
         end = time.time()
         time_dict['all'] = end - start
+        for name, elapse in time_dict.items():
+            if name != 'all' and elapse:
+                request_metrics.record('structure_' + name, elapse)
         return res_list, time_dict
 
 structure_engine = StructureSystem()
@@ -119,94 +123,96 @@ def remove_symbols(text):
 def structure_predict(img, lang, output_type=None, table_type='markdown') -> str:
 
     all_res = []
-    result, _ = structure_engine(img, lang=lang)
-    if result != []:
-        boxes = [row["bbox"] for row in result]
-        res = []
-        recursive_xy_cut(np.asarray(boxes).astype(int), np.arange(len(boxes)), res)
-        all_res = [result[idx] for idx in res]
-    if output_type=='json':
-        result = []
-        for row in all_res:
-            if row['type'] == 'table':
+    result, time_dict = structure_engine(img, lang=lang)
+    with request_metrics.stage('postprocess'):
+        if result != []:
+            boxes = [row["bbox"] for row in result]
+            res = []
+            recursive_xy_cut(np.asarray(boxes).astype(int), np.arange(len(boxes)), res)
+            all_res = [result[idx] for idx in res]
+    with request_metrics.stage('serialize'):
+        if output_type=='json':
+            result = []
+            for row in all_res:
+                if row['type'] == 'table':
+                    if table_type == 'html':
+                        region_text = row["res"]["html"]
+                    else:
+                        region_text = md(
+                            row["res"]["html"],
+                            strip=["b", "img"],
+                            heading_style="ATX",
+                            newline_style="BACKSLASH",
+                        )
+                else:
+                    region_text = ""
+                    for _, line in enumerate(row['res']):
+                        region_text += line["text"] + (" " if lang == 'en' else '')
+                row = {
+                    "BlockType": row['type'],
+                    "Geometry": {
+                        "BoundingBox": {
+                            'Width': row['bbox'][2]-row['bbox'][0],
+                            'Height': row['bbox'][3]-row['bbox'][1],
+                            'Left': row['bbox'][0],
+                            'Top': row['bbox'][1]
+                        }
+                    },
+                    "Text": region_text.strip()
+                }
+                result.append(row)
+            return result
+        doc = ""
+        prev_region_text = ""
+
+        for _, region in enumerate(all_res):
+            if len(region["res"]) == 0:
+                continue
+            if region["type"].lower() == "figure":
+                region_text = ""
+                for _, line in enumerate(region["res"]):
+                    region_text += line["text"]
+            elif region["type"].lower() == "title":
+                region_text = ''
+                for i, line in enumerate(region['res']):
+                    region_text += line['text'] + ''
+                if remove_symbols(region_text) != remove_symbols(prev_region_text):
+                    doc += '## ' + region_text + '\n\n'
+                    prev_region_text = region_text
+            elif region["type"].lower() == "table":
+                if "<thead>" not in region["res"]["html"]:
+                    region["res"]["html"] = (
+                        region["res"]["html"]
+                        .replace("<tr>", "<thead><tr>", 1)
+                        .replace("</tr>", "</thead></tr>", 1)
+                    )
                 if table_type == 'html':
-                    region_text = row["res"]["html"]
+                    doc += (
+                        region["res"]["html"] + "\n\n"
+                    )
                 else:
-                    region_text = md(
-                        row["res"]["html"],
-                        strip=["b", "img"],
-                        heading_style="ATX",
-                        newline_style="BACKSLASH",
+                    doc += (
+                        md(
+                            region["res"]["html"],
+                            strip=["b", "img"],
+                            heading_style="ATX",
+                            newline_style="BACKSLASH",
+                        )
+                        + "\n\n"
                     )
+            elif region["type"].lower() in ("header", "footer"):
+                continue
             else:
                 region_text = ""
-                for _, line in enumerate(row['res']):
-                    region_text += line["text"] + (" " if lang == 'en' else '')
-            row = {
-                "BlockType": row['type'],
-                "Geometry": {
-                    "BoundingBox": {
-                        'Width': row['bbox'][2]-row['bbox'][0],
-                        'Height': row['bbox'][3]-row['bbox'][1],
-                        'Left': row['bbox'][0],
-                        'Top': row['bbox'][1]
-                    }
-                },
-                "Text": region_text.strip()
-            }
-            result.append(row)
-        return result
-    doc = ""
-    prev_region_text = ""
-
-    for _, region in enumerate(all_res):
-        if len(region["res"]) == 0:
-            continue
-        if region["type"].lower() == "figure":
-            region_text = ""
-            for _, line in enumerate(region["res"]):
-                region_text += line["text"]
-        elif region["type"].lower() == "title":
-            region_text = ''
-            for i, line in enumerate(region['res']):
-                region_text += line['text'] + ''
-            if remove_symbols(region_text) != remove_symbols(prev_region_text):
-                doc += '## ' + region_text + '\n\n'
-                prev_region_text = region_text
-        elif region["type"].lower() == "table":
-            if "<thead>" not in region["res"]["html"]:
-                region["res"]["html"] = (
-                    region["res"]["html"]
-                    .replace("<tr>", "<thead><tr>", 1)
-                    .replace("</tr>", "</thead></tr>", 1)
-                )
-            if table_type == 'html':
-                doc += (
-                    region["res"]["html"] + "\n\n"
-                )
-            else:
-                doc += (
-                    md(
-                        region["res"]["html"],
-                        strip=["b", "img"],
-                        heading_style="ATX",
-                        newline_style="BACKSLASH",
-                    )
-                    + "\n\n"
-                )
-        elif region["type"].lower() in ("header", "footer"):
-            continue
-        else:
-            region_text = ""
-            for _, line in enumerate(region["res"]):
-                region_text += line["text"] + " "
-            if remove_symbols(region_text) != remove_symbols(prev_region_text):
-                doc += region_text
-                prev_region_text = region_text
+                for _, line in enumerate(region["res"]):
+                    region_text += line["text"] + " "
+                if remove_symbols(region_text) != remove_symbols(prev_region_text):
+                    doc += region_text
+                    prev_region_text = region_text
 
-        doc += "\n\n"
-    doc = re.sub("\n{2,}", "\n\n", doc.strip())
-    return {'Markdown': doc}
+            doc += "\n\n"
+        doc = re.sub("\n{2,}", "\n\n", doc.strip())
+        return {'Markdown': doc}
 
 def readimg(body, keys=None):
     if keys is None:
@@ -2,11 +2,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import cv2
 import numpy as np
 import pyclipper
 from shapely.geometry import Polygon
 
+# below this many contours the thread hand-off costs more than it saves
+MIN_PARALLEL_CANDIDATES = 32
+
 
 class DBPostProcess(object):
     """
@@ -19,6 +26,7 @@ class DBPostProcess(object):
                  max_candidates=1000,
                  unclip_ratio=2.0,
                  use_dilation=False,
+                 num_workers=0,
                  **kwargs):
         self.thresh = thresh
         self.box_thresh = box_thresh
@@ -27,6 +35,11 @@ class DBPostProcess(object):
         self.min_size = 3
         self.dilation_kernel = None if not use_dilation else np.array(
             [[1, 1], [1, 1]])
+        # contours are scored and unclipped on this pool when num_workers > 0,
+        # the OpenCV calls release the GIL
+        self.executor = ThreadPoolExecutor(num_workers) if num_workers > 0 else None
+        # per thread mask buffer reused by box_score_fast
+        self.local = threading.local()
 
     def boxes_from_bitmap(self, pred, _bitmap, dest_width, dest_height):
         '''
@@ -46,32 +59,51 @@ class DBPostProcess(object):
 
         num_contours = min(len(contours), self.max_candidates)
 
+        box_from_contour = partial(self.box_from_contour, pred, width, height,
+                                   dest_width, dest_height)
+        if self.executor is not None and num_contours >= MIN_PARALLEL_CANDIDATES:
+            # map keeps the contour order, so the output matches the serial path
+            results = self.executor.map(box_from_contour, contours[:num_contours])
+        else:
+            results = map(box_from_contour, contours[:num_contours])
+
         boxes = []
         scores = []
-        for index in range(num_contours):
-            contour = contours[index]
-            points, sside = self.get_mini_boxes(contour)
-            if sside < self.min_size:
+        for result in results:
+            if result is None:
                 continue
-            points = np.array(points)
-            score = self.box_score_fast(pred, points.reshape(-1, 2))
-            if self.box_thresh > score:
-                continue
-
-            box = self.unclip(points).reshape(-1, 1, 2)
-            box, sside = self.get_mini_boxes(box)
-            if sside < self.min_size + 2:
-                continue
-            box = np.array(box)
-
-            box[:, 0] = np.clip(
-                np.round(box[:, 0] / width * dest_width), 0, dest_width)
-            box[:, 1] = np.clip(
-                np.round(box[:, 1] / height * dest_height), 0, dest_height)
-            boxes.append(box.astype(np.int16))
-            scores.append(score)
+            boxes.append(result[0])
+            scores.append(result[1])
         return np.array(boxes, dtype=np.int16), scores
 
+    def box_from_contour(self, pred, width, height, dest_width, dest_height,
+                         contour):
+        """
+        Score and unclip a single contour.
+        return:
+            (box, score) with the box scaled to dest_width x dest_height, or
+            None when the contour is too small or scores below box_thresh
+        """
+        points, sside = self.get_mini_boxes(contour)
+        if sside < self.min_size:
+            return None
+        points = np.array(points)
+        score = self.box_score_fast(pred, points.reshape(-1, 2))
+        if self.box_thresh > score:
+            return None
+
+        box = self.unclip(points).reshape(-1, 1, 2)
+        box, sside = self.get_mini_boxes(box)
+        if sside < self.min_size + 2:
+            return None
+        box = np.array(box)
+
+        box[:, 0] = np.clip(
+            np.round(box[:, 0] / width * dest_width), 0, dest_width)
+        box[:, 1] = np.clip(
+            np.round(box[:, 1] / height * dest_height), 0, dest_height)
+        return box.astype(np.int16), score
+
     def unclip(self, box):
         unclip_ratio = self.unclip_ratio
         poly = Polygon(box)
@@ -107,16 +139,31 @@ class DBPostProcess(object):
     def box_score_fast(self, bitmap, _box):
         h, w = bitmap.shape[:2]
         box = _box.copy()
-        xmin = np.clip(np.floor(box[:, 0].min()).astype(np.int32), 0, w - 1)
-        xmax = np.clip(np.ceil(box[:, 0].max()).astype(np.int32), 0, w - 1)
-        ymin = np.clip(np.floor(box[:, 1].min()).astype(np.int32), 0, h - 1)
-        ymax = np.clip(np.ceil(box[:, 1].max()).astype(np.int32), 0, h - 1)
+        # plain int clipping, np.clip on scalars dominates the cost per box
+        xmin = min(max(int(np.floor(box[:, 0].min())), 0), w - 1)
+        xmax = min(max(int(np.ceil(box[:, 0].max())), 0), w - 1)
+        ymin = min(max(int(np.floor(box[:, 1].min())), 0), h - 1)
+        ymax = min(max(int(np.ceil(box[:, 1].max())), 0), h - 1)
 
-        mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
+        mask = self.score_mask(h, w, ymax - ymin + 1, xmax - xmin + 1)
         box[:, 0] = box[:, 0] - xmin
         box[:, 1] = box[:, 1] - ymin
         cv2.fillPoly(mask, box.reshape(1, -1, 2).astype(np.int32), 1)
-        return cv2.mean(bitmap[ymin:ymax + 1, xmin:xmax + 1], mask)[0]
+        score = cv2.mean(bitmap[ymin:ymax + 1, xmin:xmax + 1], mask)[0]
+        mask[:] = 0
+        return score
+
+    def score_mask(self, h, w, mask_h, mask_w):
+        """
+        Zeroed (mask_h, mask_w) view of this thread's mask buffer, sized for
+        an (h, w) map. Callers clear the view after use so no mask is
+        allocated per box.
+        """
+        buffer = getattr(self.local, 'mask', None)
+        if buffer is None or buffer.shape[0] < h or buffer.shape[1] < w:
+            buffer = np.zeros((h, w), dtype=np.uint8)
+            self.local.mask = buffer
+        return buffer[:mask_h, :mask_w]
 
     def __call__(self, outs_dict, shape_list):
         pred = outs_dict['maps']
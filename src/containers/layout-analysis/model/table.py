@@ -6,33 +6,10 @@ import copy
 from imaug import create_operators, transform
 import numpy as np
 import os
-import onnxruntime as ort
-
-sess_options = ort.SessionOptions()
-
-sess_options.intra_op_num_threads = 8
-sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
-
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
+from inference_runtime import create_session
+import request_metrics
+from reading_order import sorted_boxes
+
 class TableStructurer(object):
     def __init__(self):
         self.use_onnx = True #args.use_onnx
@@ -46,17 +23,17 @@ class TableStructurer(object):
         self.preprocess_op = create_operators(pre_process_list)
         self.postprocess_op = build_post_process(postprocess_params)
         
-        sess = ort.InferenceSession(os.environ['MODEL_PATH'] + 'table_sim.onnx', providers=['CPUExecutionProvider']) #, sess_options=sess_options, providers=[("CUDAExecutionProvider", {"cudnn_conv_algo_search": "DEFAULT"})]
-        _ = sess.run(None, {'x': np.zeros((1, 3, 488, 488), dtype='float32')})
+        sess = create_session(os.environ['MODEL_PATH'] + 'table_sim.onnx', device='cpu', warmup_shapes={'x': [1, 3, 488, 488]})
         self.predictor, self.input_tensor, self.output_tensors, self.config = sess, sess.get_inputs()[0], None, None
 
 
     def __call__(self, img):
         starttime = time.time()
         ori_im = img.copy()
-        data = {'image': img}
-        data = transform(data, self.preprocess_op)
-        img = data[0]
+        with request_metrics.stage('table_preprocess'):
+            data = {'image': img}
+            data = transform(data, self.preprocess_op)
+            img = data[0]
         if img is None:
             return None, 0
         img = np.expand_dims(img, axis=0)
@@ -67,15 +44,16 @@ class TableStructurer(object):
         preds = {}
         preds['structure_probs'] = outputs[1]
         preds['loc_preds'] = outputs[0]
-        shape_list = np.expand_dims(data[-1], axis=0)
-        post_result = self.postprocess_op(preds, [shape_list])
-
-        structure_str_list = post_result['structure_batch_list'][0]
-        bbox_list = post_result['bbox_batch_list'][0]
-        structure_str_list = structure_str_list[0]
-        structure_str_list = [
-            '<html>', '<body>', '<table>'
-        ] + structure_str_list + ['</table>', '</body>', '</html>']
+        with request_metrics.stage('table_postprocess'):
+            shape_list = np.expand_dims(data[-1], axis=0)
+            post_result = self.postprocess_op(preds, [shape_list])
+
+            structure_str_list = post_result['structure_batch_list'][0]
+            bbox_list = post_result['bbox_batch_list'][0]
+            structure_str_list = structure_str_list[0]
+            structure_str_list = [
+                '<html>', '<body>', '<table>'
+            ] + structure_str_list + ['</table>', '</body>', '</html>']
         elapse = time.time() - starttime
         return (structure_str_list, bbox_list), elapse
 def expand(pix, det_box, shape):
@@ -117,7 +95,8 @@ class TableSystem(object):
             result['rec_res'] = rec_res
 
         tic = time.time()
-        pred_html = self.match(structure_res, dt_boxes, rec_res)
+        with request_metrics.stage('table_postprocess'):
+            pred_html = self.match(structure_res, dt_boxes, rec_res)
         toc = time.time()
         time_dict['match'] = toc - tic
         result['html'] = pred_html
@@ -147,12 +126,13 @@ class TableSystem(object):
         if dt_boxes is None:
             return None, None
 
-        img_crop_list = []
-        for i in range(len(dt_boxes)):
-            det_box = dt_boxes[i]
-            x0, y0, x1, y1 = expand(2, det_box, img.shape)
-            text_rect = img[int(y0):int(y1), int(x0):int(x1), :]
-            img_crop_list.append(text_rect)
+        with request_metrics.stage('rec_preprocess'):
+            img_crop_list = []
+            for i in range(len(dt_boxes)):
+                det_box = dt_boxes[i]
+                x0, y0, x1, y1 = expand(2, det_box, img.shape)
+                text_rect = img[int(y0):int(y1), int(x0):int(x1), :]
+                img_crop_list.append(text_rect)
         rec_res = self.text_recognizer[lang](img_crop_list)
 
         return dt_boxes, rec_res, 0, 0
\ No newline at end of file
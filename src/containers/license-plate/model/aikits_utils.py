@@ -1,45 +1,302 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from os import environ
+import threading
 import boto3
 import base64
+import json
+import botocore.config
 import numpy as np
+import urllib3
+import request_metrics
 from PIL import Image
 import cv2
 try:
-    import urllib.request as urllib2
     from urllib.parse import urlparse
 except ImportError:
-    import urllib2
     from urlparse import urlparse
-    
-def readimg(body, keys=None):
+
+FETCH_CONNECT_TIMEOUT = float(environ.get('FETCH_CONNECT_TIMEOUT', 3))
+FETCH_READ_TIMEOUT = float(environ.get('FETCH_READ_TIMEOUT', 10))
+# inputs above this size are rejected before they are decoded
+FETCH_MAX_BYTES = int(environ.get('FETCH_MAX_BYTES', 20 << 20))
+FETCH_WORKERS = int(environ.get('FETCH_WORKERS', 8))
+# decode JPEGs at reduced scale when the caller passes min_size
+REDUCED_DECODE = environ.get('REDUCED_DECODE', 'true').lower() == 'true'
+# raw request bodies accepted by /invocations besides application/json
+BINARY_CONTENT_TYPES = ('image/jpeg', 'image/png', 'application/x-npy')
+# raw image outputs a request can ask for through its accept field
+BINARY_IMAGE_TYPES = ('image/png', 'application/x-npy')
+# the Lambda runtime cannot return bytes, raw image outputs are left to the
+# SageMaker server there, as job results are
+ON_LAMBDA = 'AWS_LAMBDA_FUNCTION_NAME' in environ
+# batch requests of the OCR handlers carry their images in this list
+IMAGE_LIST_KEY = 'images'
+
+# connections are kept alive between requests of a warm container
+http = urllib3.PoolManager(
+    maxsize=FETCH_WORKERS,
+    timeout=urllib3.Timeout(connect=FETCH_CONNECT_TIMEOUT, read=FETCH_READ_TIMEOUT),
+    retries=urllib3.Retry(total=2, backoff_factor=0.1))
+fetch_pool = ThreadPoolExecutor(FETCH_WORKERS)
+s3_client = None
+s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """
+    Build the shared S3 client on first use, boto3 sessions are not thread
+    safe so it is created under a lock and only the client is shared.
+    """
+    global s3_client
+    with s3_client_lock:
+        if s3_client is None:
+            s3_client = boto3.client('s3', config=botocore.config.Config(
+                connect_timeout=FETCH_CONNECT_TIMEOUT,
+                read_timeout=FETCH_READ_TIMEOUT,
+                max_pool_connections=FETCH_WORKERS,
+                retries={'max_attempts': 3}))
+    return s3_client
+
+def read_limited(stream, content_length=None):
+    if content_length is not None and int(content_length) > FETCH_MAX_BYTES:
+        raise ValueError('input of {} bytes exceeds FETCH_MAX_BYTES'.format(content_length))
+    data = stream.read(FETCH_MAX_BYTES + 1)
+    if len(data) > FETCH_MAX_BYTES:
+        raise ValueError('input exceeds FETCH_MAX_BYTES')
+    return data
+
+def fetch(url):
+    """
+    Download an http(s) url or s3://bucket/key through the pooled clients.
+    return:
+        the raw bytes of the object
+    """
+    if url.startswith('http'): # http url
+        response = http.request('GET', url, preload_content=False)
+        try:
+            if response.status != 200:
+                raise ValueError('{} returned status {}'.format(url, response.status))
+            return read_limited(response, response.headers.get('Content-Length'))
+        except Exception:
+            # drop the connection instead of draining the rest of the body
+            response.close()
+            raise
+        finally:
+            response.release_conn()
+    elif url.startswith('s3'): # s3 key
+        o = urlparse(url)
+        obj = get_s3_client().get_object(Bucket=o.netloc, Key=o.path.lstrip('/'))
+        try:
+            return read_limited(obj['Body'], obj.get('ContentLength'))
+        finally:
+            obj['Body'].close()
+    raise ValueError('unsupported url {}'.format(url))
+
+def open_image(image_string):
+    if isinstance(image_string, np.ndarray):
+        return Image.fromarray(image_string)
+    return Image.open(BytesIO(image_string))
+
+def decode_image(image_string, min_size=None):
+    """
+    args:
+        image_string(bytes): encoded image, or the array of an
+            application/x-npy request
+        min_size(tuple): (width, height) the image may be reduced to, JPEGs
+            are then decoded at 1/2, 1/4 or 1/8 scale while both sides stay
+            at least min_size, other formats are decoded at full size
+    """
+    img = open_image(image_string)
+    if min_size is not None and REDUCED_DECODE:
+        img.draft('RGB', tuple(min_size))
+    width, height = img.size
+    img = img.resize((width * 2, height * 2))
+    return np.array(img)[:, :, :3]
+
+def load_image(value, key):
+    """
+    return:
+        the raw bytes of an url or base64 input, the arrays and raw bytes of
+        binary requests as they are
+    """
+    if key.startswith('url'): # url形式
+        with request_metrics.stage('fetch'):
+            return fetch(value)
+    elif key.startswith('img'): # base64形式
+        # binary requests carry the raw bytes or array
+        if isinstance(value, str):
+            with request_metrics.stage('decode'):
+                return base64.b64decode(value)
+        return value
+    raise ValueError('unsupported key {}'.format(key))
+
+class DecodedImage(bytes):
+    """
+    Encoded input loaded and decoded ahead of its handler, see preload_image.
+    Its bytes stand for the input, e.g. in the result cache key.
+    """
+
+def preload_image(value, key, min_size=None):
+    """
+    load_image and decode_image of one input before its handler runs, e.g.
+    by the async server while the inference workers are busy
+    return:
+        DecodedImage carrying the decoded image, which read_input returns for
+        the same min_size, the arrays of binary requests and inputs that
+        cannot be decoded as load_image returns them
+    """
+    image_string = load_image(value, key)
+    if not isinstance(image_string, bytes):
+        return image_string
+    try:
+        with request_metrics.stage('decode'):
+            image = decode_image(image_string, min_size)
+    except Exception:
+        # the handler reports the input
+        return image_string
+    decoded = DecodedImage(image_string)
+    decoded.image, decoded.min_size = image, min_size
+    return decoded
+
+def read_input(body, key, min_size=None):
+    try:
+        image_string = load_image(body[key], key)
+        if isinstance(image_string, DecodedImage) and image_string.min_size == min_size:
+            return image_string.image
+        with request_metrics.stage('decode'):
+            return decode_image(image_string, min_size)
+    except Exception as e:
+        print('failed to read {}: {}'.format(key, e))
+        return None
+
+def readimg(body, keys=None, min_size=None):
+    """
+    Fetch and decode the images of body[key] for each key, several keys are
+    read concurrently on fetch_pool.
+    args:
+        min_size(tuple): smallest (width, height) the model needs, see
+            decode_image
+    return:
+        dict from key to image, None for the inputs that could not be read
+    """
     if keys is None:
-        keys = body.keys()
-    inputs = dict()
-    for key in keys:
+        keys = list(body.keys())
+    if len(keys) > 1:
+        images = fetch_pool.map(request_metrics.propagate(lambda key: read_input(body, key, min_size)), keys)
+    else:
+        # a single key is read in the calling thread, which may itself be a
+        # fetch_pool worker
+        images = [read_input(body, key, min_size) for key in keys]
+    return dict(zip(keys, images))
+
+def is_image_key(key):
+    return key.startswith('url') or key.startswith('img')
+
+def image_key(key):
+    """ img key of an url input once it is loaded, e.g. img_1 for url_1 """
+    return 'img' + key[len('url'):] if key.startswith('url') else key
+
+def image_fields(body):
+    """
+    Find the image inputs of body and of the entries of its image list.
+    return:
+        list of (dict, key) pairs, None when the image list is malformed or
+        an input is given both as url and img, e.g. url_1 and img_1
+    """
+    containers = [body]
+    entries = body.get(IMAGE_LIST_KEY)
+    if isinstance(entries, list):
+        if not all(isinstance(entry, dict) for entry in entries):
+            return None
+        containers += entries
+    fields = []
+    for container in containers:
+        keys = [key for key in container if is_image_key(key)]
+        if len(set(image_key(key) for key in keys)) != len(keys):
+            return None
+        fields += [(container, key) for key in keys]
+    return fields
+
+def replace_images(body, fields, images):
+    """
+    Hand loaded inputs on to a handler, which reads raw bytes from img keys
+    like those of binary requests.
+    args:
+        fields(list): image_fields of body
+        images(list): load_image or preload_image of each field
+    return:
+        a copy of body with the images of fields under img keys
+    """
+    loaded = {}
+    for (container, key), image in zip(fields, images):
+        loaded.setdefault(id(container), {})[image_key(key)] = image
+
+    def replace(container):
+        replaced = {key: value for key, value in container.items() if not is_image_key(key)}
+        replaced.update(loaded.get(id(container), {}))
+        return replaced
+
+    replaced = replace(body)
+    if isinstance(body.get(IMAGE_LIST_KEY), list):
+        replaced[IMAGE_LIST_KEY] = [replace(entry) for entry in body[IMAGE_LIST_KEY]]
+    return replaced
+
+def binary_body(content_type, data, params):
+    """
+    Build the request body of an /invocations call whose payload is the raw
+    image, the other request fields are passed in the query string and are
+    read as JSON values when they parse, e.g. duration=true or scale=4.
+    args:
+        content_type(str): one of BINARY_CONTENT_TYPES
+        data(bytes): request payload
+        params(dict): query string parameters
+    """
+    body = dict()
+    for key, value in params.items():
         try:
-            if key.startswith('url'): # url形式
-                if body[key].startswith('http'): # http url
-                    image_string = urllib2.urlopen(body[key]).read()
-                elif body[key].startswith('s3'): # s3 key
-                    o = urlparse(body[key])
-                    bucket = o.netloc
-                    path = o.path.lstrip('/')
-                    s3 = boto3.resource('s3')
-                    img_obj = s3.Object(bucket, path)
-                    image_string = img_obj.get()['Body'].read()
-                else:
-                    raise
-            elif key.startswith('img'): # base64形式
-                image_string = base64.b64decode(body[key])
-            else:
-                raise
-            img = Image.open(BytesIO(image_string))
-            width, height = img.size
-            img = img.resize((width * 2, height * 2))
-            inputs[key] = np.array(img)[:, :, :3]
-        except:
-            inputs[key] = None
-    return inputs
+            body[key] = json.loads(value)
+        except ValueError:
+            body[key] = value
+    if content_type == 'application/x-npy':
+        body['img'] = np.load(BytesIO(data), allow_pickle=False)
+    else:
+        body['img'] = data
+    return body
+
+def binary_image_return(image, content_type):
+    """
+    Return an image output as raw bytes instead of base64 inside JSON, its
+    size and mode are sent in X-Image-* headers.
+    args:
+        image(PIL.Image): the output image
+        content_type(str): one of BINARY_IMAGE_TYPES
+    """
+    buffered = BytesIO()
+    if content_type == 'application/x-npy':
+        np.save(buffered, np.asarray(image), allow_pickle=False)
+    else:
+        image.save(buffered, format='png')
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': content_type,
+            'X-Image-Width': str(image.width),
+            'X-Image-Height': str(image.height),
+            'X-Image-Mode': image.mode
+        },
+        'body': buffered.getvalue()
+    }
+
+def binary_accept(body):
+    """
+    The raw image type the accept field of a request asks for, None if it asks
+    for none of BINARY_IMAGE_TYPES or the handler runs on Lambda, which then
+    returns the JSON response instead.
+    """
+    if ON_LAMBDA:
+        return None
+    accept = body.get('accept')
+    return accept if accept in BINARY_IMAGE_TYPES else None
 
 def lambda_return(statusCode, body):
     return {
@@ -4,6 +4,8 @@ from os import environ
 
 import cv2
 from aikits_utils import readimg, lambda_return
+import request_metrics
+from reading_order import sorted_boxes
 
 from main import *
 
@@ -11,28 +13,6 @@ if environ["MODEL_PATH"] is None:
     environ["MODEL_PATH"] = "/opt/program/model/"
 
 
-def sorted_boxes(dt_boxes):
-    """
-    Sort text boxes in order from top to bottom, left to right
-    args:
-        dt_boxes(array):detected text boxes with shape [4, 2]
-    return:
-        sorted boxes(array) with shape [4, 2]
-    """
-    num_boxes = dt_boxes.shape[0]
-    sorted_boxes = sorted(dt_boxes, key=lambda x: (x[0][1], x[0][0]))
-    _boxes = list(sorted_boxes)
-
-    for i in range(num_boxes - 1):
-        if abs(_boxes[i + 1][0][1] - _boxes[i][0][1]) < 10 and (
-            _boxes[i + 1][0][0] < _boxes[i][0][0]
-        ):
-            tmp = _boxes[i]
-            _boxes[i] = _boxes[i + 1]
-            _boxes[i + 1] = tmp
-    return _boxes
-
-
 class TextSystem:
     def __init__(self):
         self.text_detector = TextDetector()
@@ -85,7 +65,10 @@ class TextSystem:
         return dst_img
 
     def __call__(self, img):
-        ori_im = img.copy()
+        # the boxes are warped straight into the classifier and recognizer
+        # inputs, only the two-line fallback cuts them out, OpenCV would copy
+        # a strided view such as img[:, :, ::-1] per crop
+        ori_im = np.ascontiguousarray(img)
         dt_boxes = self.text_detector(img)
         if dt_boxes is None:
             return None, None
@@ -96,8 +79,8 @@ class TextSystem:
         for bno in range(len(dt_boxes)):
             tmp_box = copy.deepcopy(dt_boxes[bno])
             buffer = math.ceil((tmp_box[1][0] -tmp_box[0][0]) / 8)
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
+            with request_metrics.stage('rec_preprocess'):
+                img_crop_list.append(TextCrop(ori_im, tmp_box))
 
             img_crop_list, angle_list = self.text_classifier(img_crop_list)
             rec_res = self.text_recognizer(img_crop_list)
@@ -108,44 +91,45 @@ class TextSystem:
                     found = True
 
             if not found:
-                img_crop_list = []
-                # Vans license plate
-                tmp_box_up = copy.deepcopy(tmp_box)
-                tmp_box_up[0][0] = tmp_box[0][0] - buffer
-                tmp_box_up[0][1] = tmp_box[0][1] - buffer
+                with request_metrics.stage('rec_preprocess'):
+                    img_crop_list = []
+                    # Vans license plate
+                    tmp_box_up = copy.deepcopy(tmp_box)
+                    tmp_box_up[0][0] = tmp_box[0][0] - buffer
+                    tmp_box_up[0][1] = tmp_box[0][1] - buffer
 
-                tmp_box_up[1][0] = tmp_box[1][0] + buffer
-                tmp_box_up[1][1] = tmp_box[1][1] - buffer
+                    tmp_box_up[1][0] = tmp_box[1][0] + buffer
+                    tmp_box_up[1][1] = tmp_box[1][1] - buffer
 
-                tmp_box_up[2][0] = max(tmp_box[0][0], tmp_box[2][0]) + buffer
-                tmp_box_up[2][1] = math.ceil(tmp_box[1][1] + (tmp_box[2][1] - tmp_box[1][1]) / 2) - 10
+                    tmp_box_up[2][0] = max(tmp_box[0][0], tmp_box[2][0]) + buffer
+                    tmp_box_up[2][1] = math.ceil(tmp_box[1][1] + (tmp_box[2][1] - tmp_box[1][1]) / 2) - 10
 
-                tmp_box_up[3][0] = min(tmp_box[3][0], tmp_box[0][0]) -buffer
-                tmp_box_up[3][1] = math.ceil(tmp_box[0][1] + (tmp_box[3][1] - tmp_box[0][1]) / 2) - 10
+                    tmp_box_up[3][0] = min(tmp_box[3][0], tmp_box[0][0]) -buffer
+                    tmp_box_up[3][1] = math.ceil(tmp_box[0][1] + (tmp_box[3][1] - tmp_box[0][1]) / 2) - 10
 
-                img_crop_up = self.get_rotate_crop_image(ori_im, tmp_box_up)
+                    img_crop_up = self.get_rotate_crop_image(ori_im, tmp_box_up)
 
-                tmp_box_down = copy.deepcopy(tmp_box)
-                tmp_box_down[0][0] = min(tmp_box[3][0], tmp_box[0][0]) - buffer
-                tmp_box_down[0][1] = math.ceil(tmp_box[0][1] + (tmp_box[3][1] - tmp_box[0][1]) / 2) - buffer
+                    tmp_box_down = copy.deepcopy(tmp_box)
+                    tmp_box_down[0][0] = min(tmp_box[3][0], tmp_box[0][0]) - buffer
+                    tmp_box_down[0][1] = math.ceil(tmp_box[0][1] + (tmp_box[3][1] - tmp_box[0][1]) / 2) - buffer
 
-                tmp_box_down[1][0] = max(tmp_box[0][0], tmp_box[2][0]) + buffer
-                tmp_box_down[1][1] = math.ceil(tmp_box[1][1] + (tmp_box[2][1] - tmp_box[1][1]) / 2) - buffer
+                    tmp_box_down[1][0] = max(tmp_box[0][0], tmp_box[2][0]) + buffer
+                    tmp_box_down[1][1] = math.ceil(tmp_box[1][1] + (tmp_box[2][1] - tmp_box[1][1]) / 2) - buffer
 
-                tmp_box_down[2][0] = tmp_box[2][0] + buffer
-                tmp_box_down[2][1] = tmp_box[2][1] + buffer
+                    tmp_box_down[2][0] = tmp_box[2][0] + buffer
+                    tmp_box_down[2][1] = tmp_box[2][1] + buffer
 
-                tmp_box_down[3][0] = tmp_box[3][0] - buffer
-                tmp_box_down[3][1] = tmp_box[3][1] + buffer
+                    tmp_box_down[3][0] = tmp_box[3][0] - buffer
+                    tmp_box_down[3][1] = tmp_box[3][1] + buffer
 
-                img_crop_down = self.get_rotate_crop_image(ori_im, tmp_box_down)
+                    img_crop_down = self.get_rotate_crop_image(ori_im, tmp_box_down)
 
-                height, width = img_crop_down.shape[:2]
-                img_crop_up = cv2.resize(img_crop_up, (width, height), interpolation= cv2.INTER_LINEAR)
+                    height, width = img_crop_down.shape[:2]
+                    img_crop_up = cv2.resize(img_crop_up, (width, height), interpolation= cv2.INTER_LINEAR)
 
-                img_crop = cv2.hconcat([img_crop_up, img_crop_down])
-                img_crop = cv2.resize(img_crop, None, fx=2, fy=2, interpolation=cv2.INTER_LINEAR)
-                img_crop_list.append(img_crop)
+                    img_crop = cv2.hconcat([img_crop_up, img_crop_down])
+                    img_crop = cv2.resize(img_crop, None, fx=2, fy=2, interpolation=cv2.INTER_LINEAR)
+                    img_crop_list.append(img_crop)
 
         img_crop_list, angle_list = self.text_classifier(img_crop_list)
 
@@ -172,6 +156,7 @@ def read_img(body):
         if v is None:
             return str(k)
     return img
+@request_metrics.instrument('license-plate')
 def handler(event, context):
     start_time = time.time()
     if "body" not in event:
@@ -191,23 +176,23 @@ def handler(event, context):
         return lambda_return(400, 'invalid param')
     dt_boxes, rec_res = text_sys(img)
     dt_results = list(zip(dt_boxes, rec_res))
-    dt_results.sort(key=lambda x: (x[0].min(0)[1]))
-
-    result = []
-    for row in dt_results:
-        row = {
-            "words": row[1][0],
-            "location": {
-                "top": int(row[0][0][1]),
-                "left": int(row[0][0][0]),
-                "width": int(row[0][2][0] - row[0][0][0]),
-                "height": int(row[0][2][1] - row[0][0][1]),
-            },
-            "score": float(row[1][1]),
-        }
-        result.append(row)
+
+    with request_metrics.stage('serialize'):
+        result = []
+        for row in dt_results:
+            row = {
+                "words": row[1][0],
+                "location": {
+                    "top": int(row[0][0][1]),
+                    "left": int(row[0][0][0]),
+                    "width": int(row[0][2][0] - row[0][0][0]),
+                    "height": int(row[0][2][1] - row[0][0][1]),
+                },
+                "score": float(row[1][1]),
+            }
+            result.append(row)
     
-    if 'duration' in body and body['duration']:
-        result.append({"duration": time.time() - start_time})
+        if 'duration' in body and body['duration']:
+            result.append({"duration": time.time() - start_time})
 
-    return lambda_return(200, json.dumps(result))
+        return lambda_return(200, json.dumps(result))
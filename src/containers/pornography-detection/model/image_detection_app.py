@@ -1,33 +1,34 @@
 import json
 import os
 import cv2
-import onnxruntime
 import numpy as np
 # import time
 from PIL import Image
 from aikits_utils import readimg, lambda_return
+import request_metrics
+import result_cache
 
-import GPUtil
-cuda_available = True if len(GPUtil.getGPUs()) else False
-if cuda_available:
-    print(GPUtil.getGPUs()[0].name)
+from inference_runtime import create_session
     
 model_path = os.environ['MODEL_PATH']
 
-ort_session = onnxruntime.InferenceSession(model_path + '/resnest50_fast_4s2x40d.onnx', providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
+ort_session = create_session(model_path + '/resnest50_fast_4s2x40d.onnx')
+INPUT_SIZE = (512, 512)
 
 def read_img(body):
     if 'url' in body:
-        inputs = readimg(body, ['url'])
+        inputs = readimg(body, ['url'], min_size=INPUT_SIZE)
         img = inputs['url']
     else:
-        inputs = readimg(body, ['img'])
+        inputs = readimg(body, ['img'], min_size=INPUT_SIZE)
         img = inputs['img']
     for k, v in inputs.items():
         if v is None:
             return str(k)
     return img
 
+@request_metrics.instrument('pornography-detection')
+@result_cache.cached('pornography-detection', [model_path + '/resnest50_fast_4s2x40d.onnx'])
 def handler(event, context):
     if "body" not in event:
         return lambda_return(400, 'invalid param')
@@ -42,19 +43,23 @@ def handler(event, context):
         if isinstance(img, str):
             return lambda_return(400, f'`parameter `{img}` illegal')
 
-        raw_img = cv2.resize(img, (512,512))/255
+        with request_metrics.stage('preprocess'):
+            raw_img = cv2.resize(img, INPUT_SIZE)/255
     except:
         return lambda_return(400, 'invalid param')
 
     #raw_img = (raw_img-np.array([0.485, 0.456, 0.406]))/np.array([0.229, 0.224, 0.225])
     
-    img = raw_img.transpose((2,0,1))[np.newaxis,:].astype('float32')
+    with request_metrics.stage('preprocess'):
+        img = raw_img.transpose((2,0,1))[np.newaxis,:].astype('float32')
     y_hat = ort_session.run(['output'], {'input': img})[0][0]
-    y_hat = np.exp(y_hat)/sum(np.exp(y_hat))
+    with request_metrics.stage('postprocess'):
+        y_hat = np.exp(y_hat)/sum(np.exp(y_hat))
 
-    res = {
-        "normal":float(y_hat[0]),
-        "sexy":float(y_hat[1]),
-        "porn":float(y_hat[2])
-    }
-    return lambda_return(200, json.dumps(res))
+    with request_metrics.stage('serialize'):
+        res = {
+            "normal":float(y_hat[0]),
+            "sexy":float(y_hat[1]),
+            "porn":float(y_hat[2])
+        }
+        return lambda_return(200, json.dumps(res))
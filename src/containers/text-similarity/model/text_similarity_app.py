@@ -1,26 +1,23 @@
 import json
 import os
 import numpy as np
-import onnxruntime
 from transformers import BertTokenizerFast
 from aikits_utils import lambda_return
+import request_metrics
 
-import GPUtil
-cuda_available = True if len(GPUtil.getGPUs()) else False
-if cuda_available:
-    print(GPUtil.getGPUs()[0].name)
+from inference_runtime import create_session
     
 model_path = os.environ['MODEL_PATH']
-ort_session = onnxruntime.InferenceSession(model_path + '/CoSENT.onnx', providers=['CUDAExecutionProvider'] if cuda_available else ['CPUExecutionProvider'])
-_ = ort_session.run(None, {"input_ids": np.zeros([1, 1], dtype='int64'), "token_type_ids": np.zeros([1, 1], dtype='int64'), "attention_mask": np.zeros([1, 1], dtype='int64')})
+ort_session = create_session(model_path + '/CoSENT.onnx', warmup_shapes={'input_ids': [1, 1], 'token_type_ids': [1, 1], 'attention_mask': [1, 1]})
 tokenizer = BertTokenizerFast.from_pretrained(model_path +'/tokenizer')
 def get_embedding(text):
-    inputs = tokenizer(text, return_tensors='np')
-    data = {
-        'input_ids': inputs['input_ids'],
-        'attention_mask': inputs['attention_mask'],
-        'token_type_ids': inputs['token_type_ids']
-    }
+    with request_metrics.stage('preprocess'):
+        inputs = tokenizer(text, return_tensors='np')
+        data = {
+            'input_ids': inputs['input_ids'],
+            'attention_mask': inputs['attention_mask'],
+            'token_type_ids': inputs['token_type_ids']
+        }
     label_name = ort_session.get_outputs()[0].name
     text_embedding = ort_session.run([label_name], data)[0][0]
     return text_embedding
@@ -30,6 +27,7 @@ def get_cos_similar(v1, v2):
     denom = np.linalg.norm(v1) * np.linalg.norm(v2)
     return 0.5 + 0.5 * (num / denom)
 
+@request_metrics.instrument('text-similarity')
 def handler(event, context):
     if 'body' not in event:
         return lambda_return(400, 'invalid param')
@@ -55,4 +53,5 @@ def handler(event, context):
         text_embedding_1 = get_embedding(text_1)
         text_embedding_2 = get_embedding(text_2)
         result = {'similarity': float(get_cos_similar(text_embedding_1, text_embedding_2).round(6))}
-    return lambda_return(200, json.dumps(result))
\ No newline at end of file
+    with request_metrics.stage('serialize'):
+        return lambda_return(200, json.dumps(result))
\ No newline at end of file